@@ -1,14 +1,115 @@
 import streamlit as st
 import pandas as pd
+import io
+import os
 import re
-from utils import get_smi_from_map, helm_to_map, process_HELM_seq, convert_map_to_helm_sequence
+from jobs import ConversionJob
+from utils import get_library, get_smi_from_map, helm_to_map, map_to_helm
 
 
 
 st.set_page_config(layout="wide")
 
+# Upper bound on memoized conversion results per mode, shared by all sessions
+RESULT_CACHE_ENTRIES = 100_000
+
+@st.cache_resource
+def load_library():
+    # One warm monomer library per server process instead of one per rerun
+    library = get_library()
+    library.load()
+    return library
+
+@st.cache_data(max_entries=RESULT_CACHE_ENTRIES, show_spinner=False)
+def helm_to_map_cached(line):
+    return helm_to_map(line)
+
+@st.cache_data(max_entries=RESULT_CACHE_ENTRIES, show_spinner=False)
+def map_to_helm_cached(line, ID):
+    return map_to_helm(line, ID)
+
+@st.cache_data(max_entries=RESULT_CACHE_ENTRIES, show_spinner=False)
+def get_smi_from_map_cached(line):
+    return get_smi_from_map(line)
+
+def convert_changed(key, items, convert):
+    """
+    Convert items (input lines, or (line, ID) pairs) with convert, reusing this
+    session's results from the previous run, so only edited lines are looked up again
+    key: st.session_state key holding {item: result} of the last run
+    """
+    previous = st.session_state.get(key, {})
+    results = {}
+    for item in items:
+        if item not in results:
+            results[item] = previous[item] if item in previous else convert(item)
+    st.session_state[key] = results
+    return [results[item] for item in items]
+
+# Pasted inputs longer than this, and all uploaded files, are converted as a background job
+BACKGROUND_LINES = 1000
+
+def uploaded_lines(uploaded_file):
+    """(lines, approximate line count) of an uploaded text file; lines are read lazily by the job"""
+    data = uploaded_file.getvalue()
+    lines = (line.strip() for line in io.TextIOWrapper(io.BytesIO(data), encoding='utf-8') if line.strip())
+    return lines, data.count(b'\n') + 1
+
+def start_job(key, mode, lines, total):
+    clear_job(key)
+    st.session_state[key] = ConversionJob(mode, lines, total=total).start()
+
+def clear_job(key):
+    job = st.session_state.pop(key, None)
+    if job is not None:
+        job.remove()
+
+# Seconds between progress updates of a running job
+JOB_REFRESH_SECONDS = 0.5
+# Largest output offered as a page download; Streamlit holds a download in memory and sends it in
+# one message, whose size server.maxMessageSize caps at 200 MB by default
+DOWNLOAD_BYTES = 200 * 1024 * 1024
+
+def show_job(key, label, file_name, download_label):
+    """Progress and results so far of the tab's background job while it runs, then the download"""
+    job = st.session_state.get(key)
+    if job is None:
+        return
+    if not job.finished:
+        job_progress(key, label)
+        return
+    if job.error is not None:
+        st.error(f"Conversion failed: {job.error}")
+        return
+    st.success(f"Conversion Successful! {job.done:,} lines, {job.failed:,} could not be converted.")
+    st.text_area(f"{label} (first {len(job.preview):,} lines)", value="\n".join(job.preview), key=f"{key}_output")
+    size = os.path.getsize(job.output_path)
+    if size > DOWNLOAD_BYTES:
+        st.warning(f"The output has {size / 2**20:,.0f} MB, too much to download from the page. "
+                   f"It is on the server at {job.output_path}; the CLI converts files of any size.")
+        return
+    with open(job.output_path, 'rb') as f:
+        st.download_button(label=download_label, data=f, file_name=file_name, mime='text/plain',
+                           key=f"{key}_download")
+
+@st.fragment(run_every=JOB_REFRESH_SECONDS)
+def job_progress(key, label):
+    # Reruns on its own every JOB_REFRESH_SECONDS without blocking the page; once the job has
+    # finished, a full rerun lets show_job offer the results
+    job = st.session_state.get(key)
+    if job is None or job.finished:
+        st.rerun()
+    if st.button("Cancel", key=f"{key}_cancel"):
+        job.cancel()
+    st.progress(job.progress() or 0.0)
+    total = f" of ~{job.total:,}" if job.total else ""
+    st.text(f"{job.done:,}{total} lines in {job.elapsed():.1f}s ({job.rate():,.0f} lines/s)")
+    preview = list(job.preview)
+    st.text_area(f"{label} so far (first {len(preview):,} lines)", value="\n".join(preview), disabled=True)
+
 def main():
     st.title("MAP/HELM/SMILES Format Converter")
+    load_library()
 
     st.markdown("""
     <style>
@@ -65,11 +166,17 @@ def main():
             st.session_state.helm_input = helm_examples
 
         helm_input = st.text_area("Enter HELM notations (one per line):", value=st.session_state.get("helm_input", ""), key="helm_input_text")
+        helm_file = st.file_uploader("Or upload a file with one HELM notation per line:", type=["txt"], key="helm_file")
         if st.button("Convert", key="helm_to_map_convert"):
-            if helm_input:
-                helm_lines = [line.strip() for line in helm_input.strip().split('\n') if line.strip()]
-                map_outputs = [helm_to_map(line) for line in helm_lines]
-                map_output = "\n".join(map_outputs)
+            helm_lines = [line.strip() for line in helm_input.strip().split('\n') if line.strip()] if helm_input else []
+            if helm_file is not None:
+                start_job("helm_to_map_job", "helm_to_map", *uploaded_lines(helm_file))
+            elif len(helm_lines) > BACKGROUND_LINES:
+                start_job("helm_to_map_job", "helm_to_map", helm_lines, len(helm_lines))
+            elif helm_input:
+                clear_job("helm_to_map_job")
+                map_outputs = convert_changed("helm_to_map_results", helm_lines, helm_to_map_cached)
+                map_output = "\n".join(output or '' for output in map_outputs)
                 st.success("Conversion Successful!")
                 st.text_area("MAP Format:", value=map_output,  key="helm_map_output")
                 st.download_button(
@@ -81,6 +188,7 @@ def main():
                 )
             else:
                 st.error("Please enter a valid HELM notation.")
+        show_job("helm_to_map_job", "MAP Format", 'output_map.txt', "Download MAP Format")
 
     with tab2:
         st.header("Convert MAP to HELM")
@@ -122,14 +230,20 @@ def main():
         map_input = st.text_area("Enter MAP sequences (one per line):", value=st.session_state.get("map_input", ""), key="map_input_text")
         id_input = st.text_area("Enter a base ID for the peptide(s):", value=st.session_state.get("id_input", ""), key="map_id_input_text")
 
+        map_file = st.file_uploader("Or upload a file with one 'MAP,ID' pair per line:", type=["txt", "csv"], key="map_helm_file")
+
         if st.button("Convert", key="map_to_helm_convert"):
-            if map_input and id_input:
-                map_lines = [line.strip() for line in map_input.strip().split('\n') if line.strip()]
-                id_lines = [id.strip() for id in id_input.strip().split('\n') if id.strip()]
-                helm_outputs = []
-                for line, i in zip(map_lines, id_lines):
-                    helm_seq = convert_map_to_helm_sequence(line, i)
-                    helm_outputs.append(process_HELM_seq(helm_seq, i))
+            map_lines = [line.strip() for line in map_input.strip().split('\n') if line.strip()] if map_input else []
+            id_lines = [id.strip() for id in id_input.strip().split('\n') if id.strip()] if id_input else []
+            if map_file is not None:
+                start_job("map_to_helm_job", "map_to_helm", *uploaded_lines(map_file))
+            elif map_input and id_input and len(map_lines) > BACKGROUND_LINES:
+                pairs = [f"{line},{i}" for line, i in zip(map_lines, id_lines)]
+                start_job("map_to_helm_job", "map_to_helm", pairs, len(pairs))
+            elif map_input and id_input:
+                clear_job("map_to_helm_job")
+                helm_outputs = convert_changed("map_to_helm_results", list(zip(map_lines, id_lines)),
+                                               lambda item: map_to_helm_cached(*item))
                 helm_output = "\n".join(helm_outputs)
                 st.success("Conversion Successful!")
                 st.text_area("HELM Format:", value=helm_output,  key="map_helm_output")
@@ -142,6 +256,7 @@ def main():
                 )
             else:
                 st.error("Please enter a valid MAP format and ID.")
+        show_job("map_to_helm_job", "HELM Format", 'output_helm.txt', "Download HELM Format")
 
     with tab3:
         st.header("Convert MAP to SMILES")
@@ -179,12 +294,19 @@ def main():
 
         map_input_smiles = st.text_area("Enter MAP sequences (one per line):", value=st.session_state.get("map_input_smiles", ""), key="map_smiles_input_text")
 
+        smiles_file = st.file_uploader("Or upload a file with one MAP sequence per line:", type=["txt"], key="map_smiles_file")
+
         if st.button("Convert", key="map_to_smiles_convert"):
-            if map_input_smiles:
-                map_lines = [line.strip() for line in map_input_smiles.strip().split('\n') if line.strip()]
-                smiles_outputs = [get_smi_from_map(line) for line in map_lines]
-                print(smiles_outputs)
-                smiles_output = "\n".join(smiles_outputs)
+            map_lines = [line.strip() for line in map_input_smiles.strip().split('\n') if line.strip()] if map_input_smiles else []
+            if smiles_file is not None:
+                start_job("map_to_smiles_job", "map_to_smiles", *uploaded_lines(smiles_file))
+            elif len(map_lines) > BACKGROUND_LINES:
+                start_job("map_to_smiles_job", "map_to_smiles", map_lines, len(map_lines))
+            elif map_input_smiles:
+                clear_job("map_to_smiles_job")
+                smiles_outputs = convert_changed("map_to_smiles_results", map_lines, get_smi_from_map_cached)
+                # Lines that fail to convert are left empty so the output stays aligned with the input
+                smiles_output = "\n".join(output or '' for output in smiles_outputs)
                 st.success("Conversion Successful!")
                 st.text_area("SMILES Format:", value=smiles_output,  key="map_smiles_output")
                 st.download_button(
@@ -196,6 +318,7 @@ def main():
                 )
             else:
                 st.error("Please enter a valid MAP format.")
+        show_job("map_to_smiles_job", "SMILES Format", 'output_smiles.txt', "Download SMILES Format")
 
 
         
@@ -0,0 +1,77 @@
+##Peptide assembly
+# Builds a whole peptide as one editable molecule from per-monomer templates.
+# Every monomer is inserted once, the R2->R1 backbone links and the optional
+# cyclic link are paired up by atom index, and a single molzip joins them all,
+# so the cost grows linearly with peptide length.
+
+from collections import namedtuple
+import re
+
+from rdkit import Chem
+
+# mol: template molecule, ends: R group number -> dummy atom index
+Fragment = namedtuple('Fragment', ['mol', 'ends'])
+
+_rgroup_label_regex = re.compile(r'\[\*:_R(\d)\]')
+
+
+def parse_fragment(smi):
+    """
+    Parse a monomer SMILES with labelled R groups into a template Fragment
+    Input: 'CC(C)C[C@@H](N[*:_R1])C([*:_R2])=O'
+    Output: Fragment whose dummy atoms carry the R group number as isotope, i.e. 'CC(C)C[C@@H](N[1*])C([2*])=O'
+    """
+    mol = Chem.MolFromSmiles(_rgroup_label_regex.sub(r'[\1*]', smi))
+    if mol is None:
+        raise ValueError(f'Cannot parse monomer fragment {smi}')
+    return Fragment(mol, rgroup_atoms(mol))
+
+
+def rgroup_atoms(mol):
+    """R group number -> dummy atom index, e.g. {1: 4, 2: 7}"""
+    return {atom.GetIsotope(): atom.GetIdx() for atom in mol.GetAtoms()
+            if atom.GetAtomicNum() == 0 and atom.GetIsotope()}
+
+
+def parse_cyclic_link(cyclic_link):
+    """
+    Input: '4:R3-10:R2'
+    Output: ((3, 3), (9, 2)), zero-based monomer index and R group number of both ends
+    """
+    ends = []
+    for node in cyclic_link.split('-'):
+        idx, r_group = node.split(':')
+        ends.append((int(idx) - 1, int(r_group[1:])))
+    return tuple(ends)
+
+
+def assemble_peptide(fragments, cyclic_link=None):
+    """
+    Join monomer templates into one peptide molecule
+    fragments: Fragments from parse_fragment, in sequence order, with dummies
+               only on the R groups that take part in a link
+    cyclic_link: optional link between two monomers, e.g. '4:R3-10:R2'
+    Output: the assembled Mol
+    """
+    links = [((idx, 2), (idx + 1, 1)) for idx in range(len(fragments) - 1)]
+    if cyclic_link:
+        links.append(parse_cyclic_link(cyclic_link))
+
+    peptide = Chem.RWMol()
+    ends = {}
+    for idx, fragment in enumerate(fragments):
+        offset = peptide.GetNumAtoms()
+        peptide.InsertMol(fragment.mol)
+        for r_group, atom_idx in fragment.ends.items():
+            ends[(idx, r_group)] = offset + atom_idx
+
+    for map_num, link in enumerate(links, start=1):
+        for end in link:
+            atom_idx = ends.pop(end, None)
+            if atom_idx is None:
+                raise ValueError(f'No free R{end[1]} on monomer {end[0] + 1} for link {link}')
+            peptide.GetAtomWithIdx(atom_idx).SetAtomMapNum(map_num)
+    if ends:
+        raise ValueError(f'Unlinked R groups left on monomers: {sorted(ends)}')
+
+    return Chem.molzip(peptide)
@@ -0,0 +1,262 @@
+##Batch conversion
+# Runs one of the converter modes over many lines, optionally on a pool of
+# worker processes. Each worker loads the monomer library once. Lines are
+# handed out longest first within a block so long peptides do not straggle
+# at the end, and results always come back in input order. Duplicate lines,
+# rotations of a head-to-tail cyclic peptide already in the block and lines
+# found in the optional result cache are not converted again.
+
+from concurrent.futures import Future, ProcessPoolExecutor
+import functools
+import os
+
+from rdkit.Chem import rdDepictor
+
+from decompose import smiles_to_helm_line, smiles_to_map
+from profiling import profiler
+from rotation import canonical_map
+from utils import (get_library, get_mol_from_map, get_smi_from_map, helm_from_parsed, helm_to_formula, helm_to_map,
+                   map_to_formula, map_to_helm, parse_map, smiles_from_parsed, use_result_cache, warm_fragment_cache)
+from validator import check_map
+
+
+def map_to_helm_line(line):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C},2'
+    Output: HELM notation, or None for a line without a peptide ID
+    """
+    if ',' not in line:
+        return None
+    map_seq, peptide_id = map(str.strip, line.split(',', 1))
+    return map_to_helm.__wrapped__(map_seq, peptide_id)
+
+
+def map_to_mol_line(line):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C}', or with ',ID' which is ignored
+    Output: the RDKit binary (Mol.ToBinary()) of the peptide, or None
+    """
+    mol = get_mol_from_map(line.split(',', 1)[0].strip())
+    return None if mol is None else mol.ToBinary()
+
+
+def map_to_mol_2d_line(line):
+    """
+    As map_to_mol_line, with RDKit 2D coordinates in the binary
+    An SD file needs coordinates, and at a few tenths of a second per peptide laying them out is
+    most of the work, so it is done here in the workers rather than by the writer.
+    """
+    mol = get_mol_from_map(line.split(',', 1)[0].strip())
+    if mol is None:
+        return None
+    rdDepictor.Compute2DCoords(mol)
+    return mol.ToBinary()
+
+
+# Outputs a MAP line can be converted to in one pass, see targets_mode
+TARGETS = ('helm', 'smiles')
+TARGETS_PREFIX = 'map_to:'
+
+
+def targets_mode(targets):
+    """
+    Input: 'helm,smiles'
+    Output: 'map_to:helm,smiles', a mode whose results are the targets joined by tabs
+    """
+    names = [name.strip() for name in targets.split(',') if name.strip()]
+    unknown = [name for name in names if name not in TARGETS]
+    if not names or unknown:
+        raise ValueError(f"Unknown target(s) {unknown or targets!r}, choose from {', '.join(TARGETS)}")
+    return TARGETS_PREFIX + ','.join(names)
+
+
+def map_to_targets_line(line, targets):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C},2', ('helm', 'smiles')
+    Output: '<HELM>\\t<SMILES>', an empty field where that conversion failed; None if all failed
+    The MAP sequence is parsed once for every target. HELM needs the ',ID' part of the line.
+    """
+    map_seq, peptide_id = map(str.strip, line.split(',', 1)) if ',' in line else (line, None)
+    parsed = parse_map(map_seq)
+    fields = []
+    for target in targets:
+        result = None
+        if target == 'smiles':
+            with profiler.track('map_to_smiles', map_seq):
+                result = smiles_from_parsed(parsed)
+        elif peptide_id is not None:
+            try:
+                result = helm_from_parsed(parsed, peptide_id)
+            except Exception as e:
+                profiler.failure(e)
+        fields.append(result or '')
+    return '\t'.join(fields) if any(fields) else None
+
+
+def needs_id(mode):
+    """Whether lines of this mode are 'MAP,ID' (or 'SMILES,ID')"""
+    return mode in ('map_to_helm', 'smiles_to_helm') or mode.startswith(TARGETS_PREFIX)
+
+
+# Undecorated converters: result caching is done once per block in convert_lines
+CONVERTERS = {
+    'helm_to_map': helm_to_map.__wrapped__,
+    'map_to_helm': map_to_helm_line,
+    'map_to_smiles': get_smi_from_map.__wrapped__,
+    'validate': check_map,
+    'map_to_formula': map_to_formula.__wrapped__,
+    'helm_to_formula': helm_to_formula.__wrapped__,
+    'smiles_to_map': smiles_to_map.__wrapped__,
+    'smiles_to_helm': smiles_to_helm_line,
+}
+
+
+# Converters whose results are bytes, kept apart from the text modes the service offers
+BINARY_CONVERTERS = {
+    'map_to_mol': map_to_mol_line,
+    'map_to_mol_2d': map_to_mol_2d_line,
+}
+
+
+def converter(mode):
+    """Conversion function of a CONVERTERS or BINARY_CONVERTERS mode, or a targets_mode"""
+    if mode in BINARY_CONVERTERS:
+        return BINARY_CONVERTERS[mode]
+    if mode.startswith(TARGETS_PREFIX):
+        return functools.partial(map_to_targets_line, targets=tuple(mode[len(TARGETS_PREFIX):].split(',')))
+    return CONVERTERS[mode]
+
+
+# Modes giving the same result for every rotation of a head-to-tail cyclic peptide
+ROTATION_INVARIANT = ('map_to_smiles', 'map_to_formula', 'map_to_mol', 'map_to_mol_2d')
+
+
+def conversion_key(mode, line):
+    """
+    The line converted in place of line
+    Input: 'map_to_smiles', 'L{d}LL{d}PYL{d}{cyc:N-C}'
+    Output: 'LL{d}PYL{d}L{d}{cyc:N-C}', one rotation per ring in ROTATION_INVARIANT modes, else line
+    """
+    if mode not in ROTATION_INVARIANT:
+        return line
+    if mode in BINARY_CONVERTERS:
+        # The ',ID' part of a map_to_mol line is not used
+        line = line.split(',', 1)[0].strip()
+    return canonical_map(line)
+
+
+def init_worker(profile=False):
+    # A forked worker must not share the parent's SQLite connection
+    use_result_cache(None)
+    if profile:
+        # A forked worker starts with the parent's numbers, which the parent already has
+        profiler.reset()
+        profiler.enable()
+    get_library().load()
+    # Opt-in: decode every capped template at start-up rather than on first use
+    if os.environ.get('MAP_WARM_FRAGMENTS') == '1':
+        warm_fragment_cache()
+
+
+def convert_chunk(mode, chunk):
+    """
+    chunk: list of (index, line)
+    Output: list of (index, result, error), error is None on success
+    """
+    convert = converter(mode)
+    results = []
+    for idx, line in chunk:
+        try:
+            results.append((idx, convert(line), None))
+        except Exception as e:
+            results.append((idx, None, str(e)))
+    return results
+
+
+def convert_chunk_profiled(mode, chunk):
+    """convert_chunk in a worker; also ships the worker's profile since the last chunk"""
+    results = convert_chunk(mode, chunk)
+    return results, profiler.drain() if profiler.enabled else None
+
+
+def make_chunks(lines, chunksize):
+    """Split a block into chunks of similar length, longest lines first"""
+    order = sorted(range(len(lines)), key=lambda idx: len(lines[idx]), reverse=True)
+    return [[(idx, lines[idx]) for idx in order[start:start + chunksize]]
+            for start in range(0, len(order), chunksize)]
+
+
+def iter_blocks(lines, size):
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) == size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def convert_lines(lines, mode, workers=None, chunksize=64, cache=None, mp_context=None):
+    """
+    Convert lines with one of the CONVERTERS modes, or a targets_mode
+    workers: number of processes, default os.cpu_count(); 1 converts in this process
+    cache: optional ResultCache consulted before converting and filled afterwards
+    mp_context: multiprocessing context for the worker processes, default fork on Linux
+    Yields (line, result, error) in input order. Repeated lines within a block
+    are converted once, and so are rotations of a ring in ROTATION_INVARIANT modes.
+    """
+    workers = workers or os.cpu_count() or 1
+    block_size = workers * chunksize * 4
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_worker,
+                                   initargs=(profiler.enabled,))
+    try:
+        pending = []
+        for block in iter_blocks(lines, block_size):
+            pending.append(start_block(block, mode, chunksize, cache, pool))
+            # Keep the next block queued while the previous one is written out
+            if len(pending) > 1:
+                yield from finish_block(*pending.pop(0), mode, cache)
+        for job in pending:
+            yield from finish_block(*job, mode, cache)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def start_block(block, mode, chunksize, cache, pool):
+    distinct = list(dict.fromkeys(block))
+    known = {line: (result, None) for line, result in cache.get_many(mode, distinct).items()} if cache else {}
+    keys = {line: conversion_key(mode, line) for line in distinct if line not in known}
+    todo = list(dict.fromkeys(keys.values()))
+    profiler.count('rotation_duplicate', len(keys) - len(todo))
+    futures = []
+    for chunk in make_chunks(todo, chunksize):
+        if pool is None:
+            future = Future()
+            future.set_result(convert_chunk(mode, chunk))
+        else:
+            future = pool.submit(convert_chunk_profiled, mode, chunk)
+        futures.append(future)
+    return block, known, keys, todo, futures
+
+
+def finish_block(block, known, keys, todo, futures, mode, cache):
+    converted = {}
+    for future in futures:
+        results = future.result()
+        if isinstance(results, tuple):
+            results, profile = results
+            if profile:
+                profiler.merge(profile)
+        for idx, result, error in results:
+            converted[todo[idx]] = (result, error)
+    for line, key in keys.items():
+        known[line] = converted[key]
+    if cache and keys:
+        cache.put_many(mode, [(line, known[line][0]) for line in keys if known[line][1] is None])
+    for line in block:
+        result, error = known[line]
+        yield line, result, error
@@ -0,0 +1,249 @@
+"""
+Assembly benchmark: MAP->SMILES peptide assembly time versus peptide length
+
+Compares the fragment-by-fragment SMILES fold (get_linear_peptide +
+cyclize_linpep_from_smi) with the single-molecule engine used by
+cyclize_linpep_from_map, and checks both give the same canonical SMILES.
+The fold cannot handle ring-closure numbers above 9 ('%10'), so it fails on
+some long peptides; those are counted and left out of the comparison. The
+fold is kept here, as the converter used to run it, only to be measured.
+
+Run from the repository root:
+    python -m benchmarks.bench_assembly
+"""
+import argparse
+import random
+import re
+import time
+
+from rdkit import Chem
+
+from utils import (cyclize_linpep_from_map, get_library, get_links_between_monomers, get_smi_from_cxsmiles,
+                   relabel_rgroup2index, replace_unused_r_groups)
+
+# Copyright (c) 2021-2024 Charles Xu and others
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# The string-fold assembly, from utils.py before the single-molecule engine replaced it
+
+
+def get_cxsmiles_from_smi(smi):
+    """
+    Get CXSMILES from SMILES
+    Input: 'CCCC[C@H](N(C)[*:_R1])C([*:_R2])=O'
+    Output: 'CCCC[C@H](N(C)[*])C([*])=O|$;;;;;;;_R1;;_R2;$|'
+    """
+    cxsmiles = smi
+    # Get all labels with pattern [*:label]
+    labels = re.findall(r'\[\*\:(.*?)\]', smi)
+    r_groups = []
+    for label in labels:
+        # Replace [*:label] with [*]
+        cxsmiles = cxsmiles.replace(f'[*:{label}]', '[*]')
+        r_groups.append(f'{label}')     # Record label to r_groups list
+
+    pos = list()
+    r_group_idx = 0
+    # Iterate through the SMILES and add ';'s in pos
+    for i in range(len(cxsmiles)):
+        if cxsmiles[i] in ('H', '@', '[', ']', '(', ')', '=', '-', '#', ':', '+',
+                           '1', '2', '3', '4', '5', '6', '7', '8', '9', '0', '/', '\\',
+                           'l', 'r'):  # 'l' for Cl, 'r' for 'Br'
+            # print(cxsmiles[i])
+            continue
+        elif cxsmiles[i] == '*':
+            if r_group_idx >= len(r_groups):
+                raise Exception(
+                    f'Erorr in converting SMILES to CXSMILES, {smi}')
+            pos.append(f"{r_groups[r_group_idx]}")
+            r_group_idx += 1
+        else:
+            pos.append('')
+    pos = '|$' + ';'.join(pos) + '$|'
+    return f'{cxsmiles} {pos}'
+
+
+def clean_dummy_labels_in_cxsmiles(smi):
+    """
+    Clean dummy labels in cxsmiles
+    Input: '*C(=O)[C@@H]1CCCN1C(C)=O |$_R2;;;;;;;;;;$,atomProp:0.dummyLabel.*|'
+    Output: '[*]C(=O)[C@@H]1CCCN1C(C)=O |$_R2;;;;;;;;;;$|'
+    """
+    smi_parts = smi.split('|')
+    # logger.info(smi_parts)
+    smi = smi_parts[0].replace('*', '[*]') + '|$' + \
+        smi_parts[1].split('$')[1] + '$|'
+    return smi
+
+
+def combine_fragments(smi1, smi2):
+    # logger.info(f"Combine {smi1} and {smi2}...")
+
+    m1 = Chem.MolFromSmiles(get_cxsmiles_from_smi(smi1))
+    m2 = Chem.MolFromSmiles(get_cxsmiles_from_smi(smi2))
+
+    for atm in m1.GetAtoms():
+        if atm.HasProp("atomLabel") and atm.GetProp("atomLabel") == "_R2":
+            atm.SetAtomMapNum(10)  # Use 10 as the atom map number
+    for atm in m2.GetAtoms():
+        if atm.HasProp("atomLabel") and atm.GetProp("atomLabel") == "_R1":
+            atm.SetAtomMapNum(10)  # Use 10 as the atom map number
+    mol = Chem.molzip(m1, m2)
+
+    smi = Chem.MolToCXSmiles(mol)
+    
+    if '|' in smi:
+        # logger.info(smi)
+        smi = get_smi_from_cxsmiles(clean_dummy_labels_in_cxsmiles(smi))
+    # logger.info(f"Combined smiles: {smi}")
+    return smi
+
+
+def get_linear_peptide(monomer_smis):
+    """Get linear peptide from monomers"""
+
+    for idx, monomer in enumerate(monomer_smis):
+        if idx == 0:
+            smi = monomer
+        else:
+            smi = combine_fragments(smi, monomer)
+    return smi
+
+
+def connect_mapped_atoms(smi, end1, end2):
+    ''' 
+        smi: smiles contain the two merge ends, e.g. '[*:3]O[C@H](C)[C@H](NC(=O)[C@@H](CC(C)C)N(C)C(=O)[C@@H]1CCCN1C(C)=O)C(=O)N(C)[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N(C)[C@@H](C)C(=O)N[C@H](CC(C)C)C(=O)N1CCC[C@@H]1C([*:2])=O'
+        end1: atom map number of the first end, e.g. 3
+        end2: atom map number of the second end, e.g. 2
+
+        Note: this will not get atomic stereochemistry right
+    '''
+    res = Chem.RWMol(Chem.MolFromSmiles(smi))
+
+    dummy1 = None
+    dummy2 = None
+
+    for atom in res.GetAtoms():
+        if atom.GetAtomMapNum() == end1:
+            dummy1 = atom
+        elif atom.GetAtomMapNum() == end2:
+            dummy2 = atom
+
+    assert dummy1 is not None and dummy2 is not None
+    assert dummy1.GetDegree() == 1
+    assert dummy2.GetDegree() == 1
+
+    nbr1 = dummy1.GetNeighbors()[0]
+    nbr2 = dummy2.GetNeighbors()[0]
+
+    res.BeginBatchEdit()
+    res.RemoveAtom(dummy1.GetIdx())
+    res.RemoveAtom(dummy2.GetIdx())
+
+    res.AddBond(nbr1.GetIdx(), nbr2.GetIdx(), Chem.BondType.SINGLE)
+    res.CommitBatchEdit()
+    return Chem.MolToSmiles(res)
+
+
+def cyclize_linpep_from_smi(smi, link):
+    """
+    Cyclize a peptide through a link, through definiting a user-defined reaction
+    smi: SMILES of a linear peptide, e.g. '[*:_R3]O[C@H](C)[C@H](NC(=O)[C@@H](CC(C)C)N(C)C(=O)[C@@H]1CCCN1C(C)=O)C(=O)N(C)[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N(C)[C@@H](C)C(=O)N[C@H](CC(C)C)C(=O)N1CCC[C@@H]1C([*:_R2])=O'
+    link: the link between the two ends, e.g. '4:R3-10:R2', what if '4:R3-14:R3'
+    """
+    smi = relabel_rgroup2index(smi) # *:_R3 -> *:3
+    link = link.split('-')
+    start, end = (int(end.split(':')[1][1:]) for end in link) # 3, 3
+    if end == start: end = end + 1 # 3, 3 -> 3, 4
+    smi = connect_mapped_atoms(smi, start, end)
+    return smi
+
+
+def restore_unused_rgroup(monomer_smis, monomer_r_groups, monomer_links):
+    # Replace unused R groups with default _R1, _R2, _R3
+    for idx, mol_cxsmi in enumerate(monomer_smis):
+        # logger.debug(f"mol_cxsmi: {mol_cxsmi}")
+        r_groups = monomer_r_groups[idx]
+        used_r_groups = [r_group[1:] for r_group in list(monomer_links[idx].keys())]
+        # logger.debug(f"used_r_groups: {used_r_groups}, r_groups: {r_groups}")
+        mol_smi = replace_unused_r_groups(mol_cxsmi, r_groups, used_r_groups)
+        # logger.debug(f"after replace rgroup mol_smi: {mol_smi}")
+        monomer_smis[idx] = mol_smi
+    return monomer_smis
+
+
+# End of the MIT licensed code
+
+
+def fold_assembly(monomer_list, cyclic_link):
+    library = get_library()
+    monomer_smis = [library.monomers2smi_dict[monomer] for monomer in monomer_list]
+    monomer_r_groups = [dict(library.monomers2r_groups_dict[monomer]) for monomer in monomer_list]
+    monomer_links = get_links_between_monomers(monomer_smis, cyclic_link)
+    monomer_smis = restore_unused_rgroup(monomer_smis, monomer_r_groups, monomer_links)
+    pep_smi = get_linear_peptide(monomer_smis)
+    if cyclic_link:
+        pep_smi = cyclize_linpep_from_smi(pep_smi, cyclic_link)
+    return pep_smi
+
+
+def time_per_peptide(func, peptides):
+    results = []
+    start = time.perf_counter()
+    for monomer_list, cyclic_link in peptides:
+        try:
+            results.append(func(monomer_list, cyclic_link))
+        except Exception:
+            results.append(None)
+    return (time.perf_counter() - start) / len(peptides), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peptide assembly benchmark")
+    parser.add_argument("--lengths", default="5,10,20,40,70,100")
+    parser.add_argument("--peptides", type=int, default=10, help="Peptides per length")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    library = get_library()
+    # Plain backbone monomers, so every random sequence is a valid peptide
+    backbone = sorted(symbol for symbol, r_groups in library.monomers2r_groups_dict.items()
+                      if set(r_groups) == {'R1', 'R2'})
+    rng = random.Random(args.seed)
+
+    print(f"{'length':>6} {'fold ms':>9} {'engine ms':>10} {'speedup':>8} {'fold failed':>12}")
+    for length in (int(n) for n in args.lengths.split(',')):
+        peptides = []
+        for i in range(args.peptides):
+            monomer_list = [rng.choice(backbone) for _ in range(length)]
+            cyclic_link = f'1:R1-{length}:R2' if i % 2 else None
+            peptides.append((monomer_list, cyclic_link))
+        fold, fold_smis = time_per_peptide(fold_assembly, peptides)
+        engine, engine_smis = time_per_peptide(cyclize_linpep_from_map, peptides)
+        for a, b in zip(fold_smis, engine_smis):
+            assert b is not None
+            assert a is None or Chem.CanonSmiles(a) == Chem.CanonSmiles(b)
+        failed = sum(a is None for a in fold_smis)
+        print(f"{length:>6} {fold * 1e3:>9.2f} {engine * 1e3:>10.2f} {fold / engine:>7.1f}x {failed:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Tokenizer benchmark: per-sequence cost of MAP tokenization versus library size
+
+Run from the repository root:
+    python -m benchmarks.bench_tokenizer
+"""
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from map_tokenizer import MapTokenizer
+
+
+def linear_scan_tokenize(string, vocabulary):
+    # Reference implementation: try every denotation at every position
+    tokens = []
+    i = 0
+    while i < len(string):
+        for key in vocabulary:
+            if string[i:].startswith(key):
+                tokens.append(vocabulary[key])
+                i += len(key)
+                break
+        else:
+            tokens.append(string[i])
+            i += 1
+    return tokens
+
+
+def time_per_sequence(func, sequences, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for seq in sequences:
+            func(seq)
+        best = min(best, time.perf_counter() - start)
+    return best / len(sequences)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MAP tokenizer benchmark")
+    parser.add_argument("--library", default="data/MAP_momomers_library_new.csv")
+    parser.add_argument("--length", type=int, default=15, help="Monomers per sequence")
+    parser.add_argument("--sequences", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.library)
+    full = df.set_index('MAP_denotion')['Symbol'].sort_index(ascending=False).to_dict()
+    rng = random.Random(args.seed)
+    keys = list(full)
+    rng.shuffle(keys)
+
+    # Sequences only use the smallest library, so every size tokenizes them fully
+    sizes = [s for s in (25, 50, 100, 200) if s < len(keys)] + [len(keys)]
+    base = keys[:sizes[0]]
+    sequences = [''.join(rng.choice(base) for _ in range(args.length))
+                 for _ in range(args.sequences)]
+
+    print(f"{'library':>8} {'trie us/seq':>12} {'scan us/seq':>12} {'speedup':>8}")
+    for size in sizes:
+        vocabulary = {k: full[k] for k in sorted(keys[:size], reverse=True)}
+        tokenizer = MapTokenizer(vocabulary)
+        for seq in sequences[:20]:
+            assert tokenizer.tokenize(seq) == linear_scan_tokenize(seq, vocabulary)
+        trie = time_per_sequence(tokenizer.tokenize, sequences)
+        scan = time_per_sequence(lambda s: linear_scan_tokenize(s, vocabulary), sequences, repeat=1)
+        print(f"{size:>8} {trie * 1e6:>12.1f} {scan * 1e6:>12.1f} {scan / trie:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Worker memory benchmark: resident memory of each batch worker process
+
+Converts the synthetic workloads with map_to_smiles on a pool of workers set
+up like batch.convert_lines does, then reads every worker's
+/proc/<pid>/smaps_rollup. RSS counts pages shared with other processes in
+full; PSS splits each shared page between the processes mapping it, so the
+sum of PSS is what the pool really costs. Private is what a worker alone holds.
+Linux only.
+
+Run from the repository root:
+    python -m benchmarks.bench_workers --workers 4
+    python -m benchmarks.bench_workers --workers 4 --start-method spawn
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import time
+
+from batch import convert_chunk, init_worker, make_chunks
+from benchmarks.workloads import WORKLOADS, generate
+
+FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_kb(pid='self'):
+    """{'Rss': kB, 'Pss': kB, 'Private': kB} of a process"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                values[name] = int(rest.split()[0])
+    return {'Rss': values['Rss'], 'Pss': values['Pss'],
+            'Private': values['Private_Clean'] + values['Private_Dirty']}
+
+
+def worker_memory(delay):
+    # The delay keeps a worker busy so each one answers exactly once
+    time.sleep(delay)
+    return os.getpid(), memory_kb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory benchmark")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--length", type=int, default=20)
+    parser.add_argument("--peptides", type=int, default=250, help="Peptides per workload")
+    parser.add_argument("--chunksize", type=int, default=16)
+    parser.add_argument("--start-method", choices=multiprocessing.get_all_start_methods(), default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    lines = [map_str for workload in WORKLOADS
+             for map_str in generate(workload, args.length, args.peptides, seed=args.seed)]
+    context = multiprocessing.get_context(args.start_method)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=init_worker) as pool:
+        for future in [pool.submit(convert_chunk, 'map_to_smiles', chunk)
+                       for chunk in make_chunks(lines, args.chunksize)]:
+            future.result()
+        elapsed = time.perf_counter() - start
+        workers = dict(pool.map(worker_memory, [0.5] * args.workers))
+
+    print(f"{len(lines)} peptides in {elapsed:.2f}s ({len(lines) / elapsed:.1f}/s), "
+          f"{args.workers} {context.get_start_method()} workers")
+    print(f"{'pid':>8} {'RSS MB':>8} {'PSS MB':>8} {'private MB':>11}")
+    for pid, memory in sorted(workers.items()):
+        print(f"{pid:>8} {memory['Rss'] / 1024:>8.1f} {memory['Pss'] / 1024:>8.1f} {memory['Private'] / 1024:>11.1f}")
+    mean = {name: sum(memory[name] for memory in workers.values()) / len(workers) / 1024 for name in ('Rss', 'Pss', 'Private')}
+    print(f"{'mean':>8} {mean['Rss']:>8.1f} {mean['Pss']:>8.1f} {mean['Private']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Benchmark suite for helm_to_map, map_to_helm and map_to_smiles
+
+Measures per-sequence latency percentiles and sequences/sec on the synthetic
+workloads in benchmarks/workloads.py, peak RSS per mode (each mode runs in a
+fresh process) and the import / first library load time, and writes the
+results as JSON so runs on different commits can be compared.
+
+Run from the repository root:
+    python -m benchmarks.run_suite --output bench.json
+    python -m benchmarks.run_suite --output new.json --compare bench.json
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.workloads import WORKLOADS, generate, load_monomer_classes
+
+MODES = ('helm_to_map', 'map_to_helm', 'map_to_smiles')
+
+# map_to_smiles is far slower per sequence than the string conversions
+DEFAULT_COUNTS = {'helm_to_map': 500, 'map_to_helm': 500, 'map_to_smiles': 20}
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import utils; imported = time.perf_counter(); "
+    "utils.get_library().load(); loaded = time.perf_counter(); "
+    "print(imported - start, loaded - imported)"
+)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def measure(func, inputs):
+    latencies = []
+    failures = 0
+    for args in inputs:
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception:
+            result = None
+        latencies.append(time.perf_counter() - start)
+        if result is None or (isinstance(result, str) and result.startswith('ERROR')):
+            failures += 1
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'count': len(inputs),
+        'failures': failures,
+        'seq_per_s': len(inputs) / total if total else None,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p90_us': percentile(latencies, 90) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'max_us': latencies[-1] * 1e6,
+    }
+
+
+def run_mode(mode, lengths, count, seed):
+    """Runs in its own process so the reported peak RSS belongs to this mode alone"""
+    import utils
+
+    functions = {
+        'helm_to_map': utils.helm_to_map,
+        'map_to_helm': utils.map_to_helm,
+        'map_to_smiles': utils.get_smi_from_map,
+    }
+    classes = load_monomer_classes()
+    utils.get_library().load()
+    results = []
+    for workload in WORKLOADS:
+        for length in lengths:
+            sequences = generate(workload, length, count, seed, classes)
+            if mode == 'helm_to_map':
+                inputs = [(utils.map_to_helm(seq, str(i + 1)),) for i, seq in enumerate(sequences)]
+            elif mode == 'map_to_helm':
+                inputs = [(seq, str(i + 1)) for i, seq in enumerate(sequences)]
+            else:
+                inputs = [(seq,) for seq in sequences]
+            row = {'mode': mode, 'workload': workload, 'length': length}
+            row.update(measure(functions[mode], inputs))
+            results.append(row)
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure_import(repeat=3):
+    # The first run may build the library cache; report the best of the rest
+    timings = []
+    for _ in range(repeat + 1):
+        out = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], capture_output=True,
+                             text=True, check=True).stdout.split()
+        timings.append((float(out[0]), float(out[1])))
+    imported, loaded = min(timings[1:], key=sum)
+    return {'import_utils_s': imported, 'first_library_load_s': loaded}
+
+
+def metadata(seed):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    from rdkit import rdBase
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'rdkit': rdBase.rdkitVersion,
+        'platform': platform.platform(),
+        'seed': seed,
+    }
+
+
+def compare(results, baseline, threshold):
+    old = {(row['mode'], row['workload'], row['length']): row for row in baseline['results']}
+    print(f"{'mode':<14} {'workload':<13} {'length':>6} {'old seq/s':>11} {'new seq/s':>11} {'ratio':>7}")
+    regressions = 0
+    for row in results['results']:
+        before = old.get((row['mode'], row['workload'], row['length']))
+        if not before or not before['seq_per_s'] or not row['seq_per_s']:
+            continue
+        ratio = row['seq_per_s'] / before['seq_per_s']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{row['mode']:<14} {row['workload']:<13} {row['length']:>6} "
+              f"{before['seq_per_s']:>11.1f} {row['seq_per_s']:>11.1f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HELM/MAP/SMILES conversion benchmark suite")
+    parser.add_argument("--modes", default=','.join(MODES))
+    parser.add_argument("--lengths", default="5,10,20,50,100")
+    parser.add_argument("--count", type=int, help="Sequences per workload and length (default depends on mode)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="Earlier JSON results to compare sequences/sec against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative slowdown reported as a regression (default 0.1)")
+    args = parser.parse_args()
+
+    lengths = [int(n) for n in args.lengths.split(',')]
+    results = {'meta': metadata(args.seed), 'import': measure_import(), 'peak_rss_kb': {}, 'results': []}
+    context = multiprocessing.get_context('spawn')
+    for mode in args.modes.split(','):
+        count = args.count or DEFAULT_COUNTS[mode]
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            rows, peak_rss = pool.submit(run_mode, mode, lengths, count, args.seed).result()
+        results['results'].extend(rows)
+        results['peak_rss_kb'][mode] = peak_rss
+        print(f"{mode}: done, peak RSS {peak_rss / 1024:.0f} MB", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Reproducible synthetic MAP workloads drawn from the monomer library
+
+    linear        plain backbone monomers
+    head_to_tail  linear + {cyc:N-C}
+    side_chain    acid and amine side chains at positions i < j linked by {cyc:i-j}
+    terminal      {nt:...} + linear + {ct:...}
+
+Every workload mixes monomers from across the whole library.
+"""
+import csv
+import random
+
+from monomer_library import LIBRARY_PATH
+
+WORKLOADS = ('linear', 'head_to_tail', 'side_chain', 'terminal')
+
+
+def load_monomer_classes(path=LIBRARY_PATH):
+    """MAP denotations grouped by the role they can play in a generated sequence"""
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    symbols = {}
+    for row in rows:
+        # Only denotations that resolve back to this row, so tokenizing is unambiguous
+        symbols[row['MAP_denotion']] = row['Symbol']
+    rows = [row for row in rows if symbols[row['MAP_denotion']] == row['Symbol']]
+    return {
+        'backbone': sorted(row['MAP_denotion'] for row in rows
+                           if row['R1'] != '-' and row['R2'] != '-' and row['R3'] == '-'),
+        # Some rows list an R3 their CXSMILES does not have
+        'acid': sorted(row['MAP_denotion'] for row in rows if row['R3'] == 'OH' and '_R3' in row['CXSMILES']),
+        'amine': sorted(row['MAP_denotion'] for row in rows if row['R3'] == 'H' and '_R3' in row['CXSMILES']),
+        'nterm': sorted(row['MAP_denotion'] for row in rows if row['MAP_denotion'].startswith('{nt:')),
+        'cterm': sorted(row['MAP_denotion'] for row in rows if row['MAP_denotion'].startswith('{ct:')),
+    }
+
+
+def generate(workload, length, count, seed=0, classes=None):
+    """count MAP strings of the given workload with length monomers each (terminal caps included)"""
+    classes = classes or load_monomer_classes()
+    rng = random.Random(f'{workload}:{length}:{seed}')
+    sequences = []
+    for _ in range(count):
+        if workload == 'terminal':
+            body = [rng.choice(classes['backbone']) for _ in range(max(length - 2, 1))]
+            sequences.append(rng.choice(classes['nterm']) + ''.join(body) + rng.choice(classes['cterm']))
+            continue
+        monomers = [rng.choice(classes['backbone']) for _ in range(length)]
+        if workload == 'linear':
+            sequences.append(''.join(monomers))
+        elif workload == 'head_to_tail':
+            sequences.append(''.join(monomers) + '{cyc:N-C}')
+        elif workload == 'side_chain':
+            # The start index is read as a single digit, and 1 or the last position
+            # would mean a backbone end, so keep i in 2..9 and j before the end
+            i = rng.randint(2, min(9, length - 2))
+            j = rng.randint(i + 1, length - 1)
+            monomers[i - 1] = rng.choice(classes['acid'])
+            monomers[j - 1] = rng.choice(classes['amine'])
+            sequences.append(''.join(monomers) + f'{{cyc:{i}-{j}}}')
+        else:
+            raise ValueError(f'Unknown workload {workload}')
+    return sequences
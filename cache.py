@@ -0,0 +1,162 @@
+##Caches
+# In-process LRU caches shared by the converters, and the optional on-disk
+# cache of conversion results.
+
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry when full
+    Keeps hit, miss and eviction counts; maxsize=None means unbounded.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+
+MISSING = object()
+
+
+class ResultCache:
+    """
+    On-disk cache of conversion results in a SQLite file, with an LRUCache in front
+    Entries are keyed by sha256(namespace, mode, input); pass the monomer library
+    hash as namespace so a changed library never serves stale results.
+    Once the file holds more than max_entries the least recently used are evicted.
+    """
+
+    def __init__(self, path, namespace='', max_entries=1_000_000, memory_size=10_000):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.memory = LRUCache(memory_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results '
+                           '(key BLOB PRIMARY KEY, value TEXT, last_used INTEGER) WITHOUT ROWID')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def key(self, mode, text):
+        return hashlib.sha256(f'{self.namespace}\0{mode}\0{text}'.encode('utf-8')).digest()
+
+    def get(self, mode, text):
+        """Cached result, or MISSING"""
+        return self.get_many(mode, [text]).get(text, MISSING)
+
+    def get_many(self, mode, texts):
+        """text -> cached result, for the texts that are cached"""
+        found = {}
+        lookup = {}
+        for text in texts:
+            key = self.key(mode, text)
+            value = self.memory.get(key, MISSING)
+            if value is MISSING:
+                lookup[key] = text
+            else:
+                found[text] = value
+        if lookup:
+            keys = list(lookup)
+            with self._lock:
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    rows = self._conn.execute(
+                        f'SELECT key, value FROM results WHERE key IN ({",".join("?" * len(batch))})',
+                        batch).fetchall()
+                    for key, value in rows:
+                        self.memory.put(key, value)
+                        found[lookup[key]] = value
+                    if rows:
+                        self._conn.executemany('UPDATE results SET last_used = ? WHERE key = ?',
+                                               [(time.time_ns(), key) for key, _ in rows])
+                self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put(self, mode, text, value):
+        self.put_many(mode, [(text, value)])
+
+    def put_many(self, mode, items):
+        """Store (text, result) pairs; result may be None for a failed conversion"""
+        rows = []
+        for text, value in items:
+            key = self.key(mode, text)
+            self.memory.put(key, value)
+            rows.append((key, value, time.time_ns()))
+        if not rows:
+            return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', rows)
+            self._size += self._conn.total_changes - before
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop an extra tenth so eviction does not run on every insert
+        self._size = self._conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        excess = self._size - self.max_entries + self.max_entries // 10
+        if excess > 0:
+            self._conn.execute('DELETE FROM results WHERE key IN '
+                               '(SELECT key FROM results ORDER BY last_used LIMIT ?)', (excess,))
+            self._size -= excess
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': self._size,
+                'max_entries': self.max_entries, 'memory': self.memory.stats()}
@@ -0,0 +1,104 @@
+##Checkpoints
+# Progress of a resumable file conversion, kept next to the output as
+# '<output>.checkpoint'. A checkpoint is only written once the output it
+# describes has been fsynced, so after a crash the output can be cut back to
+# the recorded size and the input read again from the recorded offset: no
+# line is written twice and none is missed. The input's size and modification
+# time are recorded too: offsets into an input that has since changed mean
+# nothing, so such a checkpoint is refused rather than resumed.
+
+import json
+import os
+import time
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+# Seconds between checkpoints; each one costs an fsync of the output
+CHECKPOINT_SECONDS = 10.0
+
+
+def fsync_directory(path):
+    # Makes a rename in this directory durable
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Checkpoint:
+    """
+    Progress of converting input_path with mode into output_path
+        input_size, input_mtime_ns: the input as it was when the run started
+        input_offset: bytes of input whose lines are converted and written
+        records: non-empty input lines converted so far
+        output_size: bytes of output holding their results
+        complete: the whole input has been converted
+    """
+
+    def __init__(self, output_path, input_path, mode, interval=None):
+        self.path = output_path + CHECKPOINT_SUFFIX
+        self.output_path = output_path
+        self.input_path = os.path.abspath(input_path)
+        self.mode = mode
+        stat = os.stat(input_path)
+        self.input_size = stat.st_size
+        self.input_mtime_ns = stat.st_mtime_ns
+        self.interval = CHECKPOINT_SECONDS if interval is None else interval
+        self.input_offset = 0
+        self.records = 0
+        self.output_size = 0
+        self.complete = False
+        self._saved_at = time.monotonic()
+
+    def load(self):
+        """Read a previous run's checkpoint; False when there is none, ValueError when it does not fit the input"""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        if (state['input'], state['mode']) != (self.input_path, self.mode):
+            raise ValueError(f"{self.path} is for {state['mode']} of {state['input']}, "
+                             f"not {self.mode} of {self.input_path}")
+        if (state.get('input_size'), state.get('input_mtime_ns')) != (self.input_size, self.input_mtime_ns):
+            raise ValueError(f"{self.input_path} has changed since {self.path} was written; "
+                             f"delete the checkpoint and {self.output_path} to start over")
+        self.input_offset = state['input_offset']
+        self.records = state['records']
+        self.output_size = state['output_size']
+        self.complete = state['complete']
+        return True
+
+    def truncate_output(self):
+        """Drop output written after the checkpoint, i.e. results of lines that will be converted again"""
+        size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+        if size < self.output_size:
+            raise ValueError(f"{self.output_path} has {size} bytes, its checkpoint records {self.output_size}")
+        if size > self.output_size:
+            os.truncate(self.output_path, self.output_size)
+
+    def due(self):
+        return time.monotonic() - self._saved_at >= self.interval
+
+    def save(self, output, input_offset, records, complete=False):
+        """
+        output: the open output file, or anything with flush() and fileno(); synced before the checkpoint
+        input_offset, records: as of the last result written to output
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        self.output_size = os.fstat(output.fileno()).st_size
+        self.input_offset = input_offset
+        self.records = records
+        self.complete = complete
+        state = {'input': self.input_path, 'mode': self.mode, 'input_size': self.input_size,
+                 'input_mtime_ns': self.input_mtime_ns, 'input_offset': input_offset,
+                 'records': records, 'output_size': self.output_size, 'complete': complete}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_directory(self.path)
+        self._saved_at = time.monotonic()
@@ -1,81 +1,418 @@
 import argparse
+from collections import Counter, deque
+import contextlib
 import os
-import pandas as pd
-import re
-from utils import get_smi_from_map, helm_to_map, process_HELM_seq, convert_map_to_helm_sequence 
+import sys
+import time
+from utils import (get_smi_from_map, helm_to_formula, helm_to_map, map_to_formula, map_to_helm, open_result_cache,
+                   use_result_cache)
+from batch import ROTATION_INVARIANT, conversion_key, convert_lines, converter, targets_mode
+from checkpoint import Checkpoint
+from decompose import smiles_to_map
+from enumeration import enumerate_library, substitution_scan
+from molfiles import MOL_FORMATS, MolWriter
+from rdkit import Chem
+from profiling import profiler
+from shard import merge_shards, parse_shard, shard_span, write_shard_info
+from tables import convert_table
+from validator import check_map
 
+# Output is flushed every FLUSH_EVERY lines so partial results show up during long runs
+FLUSH_EVERY = 1000
 
 
+def report_throughput(count, start):
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print(f"Converted {count} lines in {elapsed:.2f}s ({rate:.1f} lines/s)", file=sys.stderr)
+
+
+def open_input(path, offset=None):
+    # '-' reads from stdin; with an offset the file is read as bytes from there, see read_lines
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin)
+    if offset is None:
+        return open(path, 'r')
+    infile = open(path, 'rb')
+    infile.seek(offset)
+    return infile
+
+
+def open_output(path, append=False):
+    # '-' writes to stdout
+    if path == '-':
+        return contextlib.nullcontext(sys.stdout)
+    return open(path, 'a' if append else 'w', buffering=1 << 16)
+
+
+def iter_lines(infile):
+    for line in infile:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def read_lines(infile, offsets, end=None):
+    """
+    iter_lines over a binary file; the input offset just past each line is appended to offsets
+    end: offset where reading stops, e.g. the end of a --shard
+    """
+    offset = infile.tell()
+    for raw in infile:
+        if end is not None and offset >= end:
+            break
+        offset += len(raw)
+        line = raw.decode('utf-8').strip()
+        if line:
+            offsets.append(offset)
+            yield line
+
+
+def start_checkpoint(args, mode):
+    """
+    Checkpoint of a --resume run, None without --resume
+    Output written after a previous run's last checkpoint is cut off, since those lines are converted again.
+    """
+    if not args.resume:
+        return None
+    if args.input == '-' or args.output == '-':
+        raise ValueError("--resume needs an input file and an output file.")
+    if args.rotation_report:
+        raise ValueError("--resume cannot be combined with --rotation-report.")
+    checkpoint = Checkpoint(args.output, args.input, f'{mode} shard {args.shard}' if args.shard else mode)
+    if checkpoint.load() and not checkpoint.complete:
+        checkpoint.truncate_output()
+        print(f"Resuming after {checkpoint.records} lines", file=sys.stderr)
+    return checkpoint
+
+
+class RotationReport:
+    """
+    Writes '<input>\t<canonical>' per line: the sequence converted in its place, the same for
+    every rotation of a head-to-tail cyclic peptide, see rotation.canonical_map
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.lines = 0
+        self.canonical = set()
+
+    def iter_lines(self, lines):
+        with open_output(self.path) as report:
+            for line in lines:
+                key = conversion_key(self.mode, line)
+                self.lines += 1
+                self.canonical.add(key)
+                report.write(f"{line}\t{key}\n")
+                yield line
+
+    def summary(self):
+        return (f"Rotation report: {self.lines} lines, {len(self.canonical)} distinct sequences, "
+                f"saved to {self.path}")
+
+
+def report_lines(args, lines, mode):
+    # Wraps the input lines so each one is written to the --rotation-report as it is read
+    if not args.rotation_report:
+        return lines, None
+    report = RotationReport(args.rotation_report, mode)
+    return report.iter_lines(lines), report
+
+
+def input_span(args):
+    """(start, end) byte range of the input a --shard converts, None without --shard"""
+    return shard_span(args.input, *parse_shard(args.shard)) if args.shard else None
+
+
+def start_offset(checkpoint, span):
+    """Input offset to start reading at, None to read the whole input as text"""
+    if checkpoint is not None and checkpoint.records:
+        return checkpoint.input_offset
+    if span is not None:
+        return span[0]
+    return 0 if checkpoint is not None else None
+
+
+def convert_file(args, cache=None):
+    # Status messages go to stderr when the converted lines go to stdout
+    status = sys.stderr if args.output == '-' else sys.stdout
+    span = input_span(args)
+    checkpoint = start_checkpoint(args, args.mode)
+    if checkpoint is not None and checkpoint.complete:
+        print(f"Nothing to resume, {args.output} is complete", file=status)
+        if span is not None:
+            write_shard_info(args.input, args.output, args.mode, parse_shard(args.shard), span, checkpoint.records)
+        return
+    resumed = checkpoint is not None and checkpoint.records > 0
+    start = time.perf_counter()
+    count = done = checkpoint.records if checkpoint else 0
+    offset = start_offset(checkpoint, span)
+    offsets = deque()
+    reasons = Counter()
+    with open_input(args.input, offset) as infile, open_output(args.output, resumed) as outfile:
+        lines = iter_lines(infile) if offset is None else read_lines(infile, offsets, span and span[1])
+        lines, report = report_lines(args, lines, args.mode)
+        results = convert_lines(lines, args.mode, args.workers, args.chunksize, cache)
+        for line, result, error in results:
+            if checkpoint is not None:
+                # Every line before this one has been written
+                if checkpoint.due():
+                    checkpoint.save(outfile, offset, count)
+                offset = offsets.popleft()
+            count += 1
+            if args.mode in ('map_to_helm', 'smiles_to_helm'):
+                if error is not None:
+                    print(f"Skipping invalid line: {line} | Error: {error}", file=status)
+                    continue
+                if result is None:
+                    continue
+            elif args.mode == 'validate':
+                reasons[(result or error).split(':', 1)[0]] += 1
+            # Failed conversions are left as empty lines so output stays aligned with input
+            outfile.write((result or '') + '\n')
+            if count % FLUSH_EVERY == 0:
+                outfile.flush()
+        if checkpoint is not None:
+            checkpoint.save(outfile, offset, count, complete=True)
+    if span is not None:
+        write_shard_info(args.input, args.output, args.mode, parse_shard(args.shard), span, count)
+    print(f"Conversion complete. Output saved to {args.output}", file=status)
+    if reasons:
+        print("Validation: " + ', '.join(f"{code}={n}" for code, n in reasons.most_common()), file=status)
+    if report is not None:
+        print(report.summary(), file=sys.stderr)
+    report_throughput(count - done, start)
+    if cache is not None:
+        print(f"Result cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+
+
+def convert_mol_file(args, cache=None):
+    # Lines are 'MAP' or 'MAP,ID'; without an ID the record is named by its line number,
+    # '<shard>-<line number in the shard>' with --shard
+    if args.output == '-':
+        raise ValueError(f"--format {args.format} needs an output file path.")
+    mode = f'map_to_mol:{args.format}'
+    span = input_span(args)
+    prefix = f'{parse_shard(args.shard)[0]}-' if args.shard else ''
+    checkpoint = start_checkpoint(args, mode)
+    if checkpoint is not None and checkpoint.complete:
+        print(f"Nothing to resume, {args.output} is complete")
+        if span is not None:
+            write_shard_info(args.input, args.output, mode, parse_shard(args.shard), span, checkpoint.records,
+                             text=False)
+        return
+    resumed = checkpoint is not None and checkpoint.records > 0
+    start = time.perf_counter()
+    count = done = checkpoint.records if checkpoint else 0
+    offset = start_offset(checkpoint, span)
+    offsets = deque()
+    failed = 0
+    with open_input(args.input, offset) as infile, MolWriter(args.output, args.format, resumed) as writer:
+        lines = iter_lines(infile) if offset is None else read_lines(infile, offsets, span and span[1])
+        # SD records need 2D coordinates, which the workers lay out
+        convert_mode = 'map_to_mol_2d' if args.format == 'sdf' else 'map_to_mol'
+        lines, report = report_lines(args, lines, convert_mode)
+        results = convert_lines(lines, convert_mode, args.workers, args.chunksize, cache)
+        for line, result, error in results:
+            if checkpoint is not None:
+                if checkpoint.due():
+                    checkpoint.save(writer, offset, count)
+                offset = offsets.popleft()
+            count += 1
+            if result is None:
+                failed += 1
+                continue
+            name = line.split(',', 1)[1].strip() if ',' in line else f'{prefix}{count}'
+            writer.write(Chem.Mol(result), name)
+            if count % FLUSH_EVERY == 0:
+                writer.flush()
+        if checkpoint is not None:
+            checkpoint.save(writer, offset, count, complete=True)
+    if span is not None:
+        write_shard_info(args.input, args.output, mode, parse_shard(args.shard), span, count, text=False)
+    print(f"Conversion complete. {writer.count} molecules saved to {args.output}")
+    if failed:
+        print(f"{failed} lines could not be converted and were skipped", file=sys.stderr)
+    if report is not None:
+        print(report.summary(), file=sys.stderr)
+    report_throughput(count - done, start)
+    if cache is not None:
+        print(f"Result cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+
+
+def convert_table_file(args, cache=None):
+    if not args.output:
+        raise ValueError("Output table path required for --column.")
+    start = time.perf_counter()
+    counts = convert_table(args.input, args.output, args.mode, args.column, args.id_column,
+                           args.workers, args.chunksize, cache, args.rows_per_chunk)
+    print(f"Conversion complete. Output saved to {args.output}")
+    print(', '.join(f"{status}={n}" for status, n in counts.items()))
+    report_throughput(sum(counts.values()), start)
+    if cache is not None:
+        print(f"Result cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+
+
+def merge_files(args):
+    # --input lists the shard outputs, comma-separated, in any order
+    if not args.output or args.output == '-':
+        raise ValueError("merge needs an --output file path.")
+    paths = [path.strip() for path in args.input.split(',') if path.strip()]
+    records, lines = merge_shards(paths, args.output)
+    written = f"{lines} lines" if lines is not None else "molecules"
+    print(f"Merged {len(paths)} shards ({records} input lines) into {args.output}, {written} checked")
+
+
+def enumerate_to_file(args):
+    # --input is a choice spec, or the parent MAP sequence of a --scan
+    if args.scan:
+        positions = [int(p) for p in args.positions.split(',')] if args.positions else None
+        products = substitution_scan(args.input, args.scan, positions)
+    else:
+        products = enumerate_library(args.input)
+    start = time.perf_counter()
+    count = failed = 0
+    with open_output(args.output or '-') as outfile:
+        for map_str, smiles in products:
+            count += 1
+            if smiles is None:
+                failed += 1
+            outfile.write(f"{map_str}\t{smiles or ''}\n")
+            if count % FLUSH_EVERY == 0:
+                outfile.flush()
+    if failed:
+        print(f"{failed} products could not be converted", file=sys.stderr)
+    report_throughput(count, start)
 
 
 def main():
     parser = argparse.ArgumentParser(description="HELM-MAP-SMILES Format Converter")
-    parser.add_argument("mode", choices=["helm_to_map", "map_to_helm", "map_to_smiles"], help="Conversion mode")
-    parser.add_argument("--input", required=True, help="Input string or input file path")
-    parser.add_argument("--output", help="Output file path (required if input is a file)")
-    parser.add_argument("--id", help="Peptide ID(s) for MAP to HELM (comma-separated for batch)")
+    parser.add_argument("mode", choices=["helm_to_map", "map_to_helm", "map_to_smiles", "validate", "enumerate",
+                                         "map_to_formula", "helm_to_formula", "smiles_to_map", "smiles_to_helm", "merge"],
+                        help="Conversion mode")
+    parser.add_argument("--input", required=True, help="Input string or input file path ('-' for stdin)")
+    parser.add_argument("--output", help="Output file path, required if input is a file ('-' for stdout)")
+    parser.add_argument("--id", help="Peptide ID(s) for MAP/SMILES to HELM (comma-separated for batch)")
+    parser.add_argument("--workers", type=int, help="Worker processes for file input (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=64, help="Lines handed to a worker at a time")
+    parser.add_argument("--cache", default=os.environ.get("MAP_RESULT_CACHE"),
+                        help="SQLite file caching conversion results across runs (default: $MAP_RESULT_CACHE)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use a result cache")
+    parser.add_argument("--column", help="Convert this column of a CSV/TSV/Parquet input table")
+    parser.add_argument("--id-column", help="Table column copied to the output id column (and used as peptide ID for map_to_helm)")
+    parser.add_argument("--rows-per-chunk", type=int, default=65536, help="CSV/TSV rows read at a time with --column")
+    parser.add_argument("--format", choices=("smiles",) + MOL_FORMATS, default="smiles",
+                        help="map_to_smiles file output: SMILES lines, RDKit binary pickles or SDF (records named by ID)")
+    parser.add_argument("--targets", help="map_to_helm/map_to_smiles: convert each MAP line to several formats in one pass, "
+                                          "e.g. 'helm,smiles'; results are tab-separated in this order")
+    parser.add_argument("--rotation-report", help="map_to_smiles/map_to_formula file input: write '<input>\\t<canonical>' "
+                                                  "per line, rotations of a {cyc:N-C} peptide share one canonical sequence")
+    parser.add_argument("--resume", action="store_true",
+                        help="File input: checkpoint progress next to the output ('<output>.checkpoint') and, "
+                             "when a checkpoint is there, continue from it instead of starting over")
+    parser.add_argument("--shard", help="File input: convert only shard i of N, e.g. 2/8, a line-aligned byte range; "
+                                        "join the shard outputs with the merge mode")
+    parser.add_argument("--scan", help="enumerate: substitutes for a scan of the --input parent MAP, e.g. 'A|G|L{d}'")
+    parser.add_argument("--positions", help="enumerate: 1-based positions for --scan, comma-separated (default: all)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print per-stage timings, counters and the slowest inputs to stderr")
+    parser.add_argument("--profile-slowest", type=int, default=10, help="Slowest inputs listed by --profile")
 
     args = parser.parse_args()
-    is_file = os.path.isfile(args.input)
+    if args.profile:
+        profiler.enable(args.profile_slowest)
+        try:
+            run(args)
+        finally:
+            print(profiler.report(), file=sys.stderr)
+    else:
+        run(args)
+
+
+def run(args):
+    if args.mode == 'enumerate':
+        enumerate_to_file(args)
+        return
+    if args.mode == 'merge':
+        merge_files(args)
+        return
+
+    if args.format != 'smiles' and args.mode != 'map_to_smiles':
+        raise ValueError("--format pickle/sdf is for map_to_smiles mode.")
+    if args.format != 'smiles' and args.column:
+        raise ValueError("--format pickle/sdf is for line-based file input, not --column.")
+    if args.targets:
+        if args.mode not in ('map_to_helm', 'map_to_smiles'):
+            raise ValueError("--targets needs MAP input: use map_to_helm or map_to_smiles mode.")
+        args.mode = targets_mode(args.targets)
+    if args.rotation_report and (args.mode not in ROTATION_INVARIANT or args.column):
+        raise ValueError("--rotation-report is for map_to_smiles or map_to_formula file input.")
+
+    is_file = args.input == '-' or os.path.isfile(args.input)
+    if args.resume and (not is_file or args.column):
+        raise ValueError("--resume is for line-based file input.")
+    if args.shard and (args.input == '-' or not is_file or args.column):
+        raise ValueError("--shard is for line-based input files, not stdin.")
+    cache = open_result_cache(args.cache) if args.cache and not args.no_cache else None
+
+    if args.column:
+        convert_table_file(args, cache)
+        return
+
+    if is_file:
+        if not args.output:
+            if args.mode == 'map_to_helm':
+                print("Error: Please specify --output for saving the converted HELM format.")
+                return
+            raise ValueError("Output file path required for file input.")
+        if args.format != 'smiles':
+            convert_mol_file(args, cache)
+            return
+        convert_file(args, cache)
+        return
+
+    use_result_cache(cache)
 
     # Handle HELM to MAP
     if args.mode == "helm_to_map":
-        if is_file:
-            with open(args.input, "r") as f:
-                lines = [line.strip() for line in f if line.strip()]
-            results = [helm_to_map(line) for line in lines]
-            if not args.output:
-                raise ValueError("Output file path required for file input.")
-            with open(args.output, "w") as f:
-                f.write("\n".join(results))
-            print(f"Conversion complete. Output saved to {args.output}")
-        else:
-            print(helm_to_map(args.input))
+        print(helm_to_map(args.input))
 
     # Handle MAP to HELM
     elif args.mode == 'map_to_helm':
-      if is_file:
-          if not args.output:
-              print("Error: Please specify --output for saving the converted HELM format.")
-          else:
-              with open(args.input, 'r') as infile, open(args.output, 'w') as outfile:
-                  for line in infile:
-                      line = line.strip()
-                      if not line or ',' not in line:
-                          continue
-                      try:
-                          map_seq, peptide_id = map(str.strip, line.split(',', 1))
-                          helm_seq = convert_map_to_helm_sequence(map_seq, peptide_id)
-                          result = process_HELM_seq(helm_seq, peptide_id)
-                          outfile.write(result + '\n')
-                      except Exception as e:
-                          print(f"Skipping invalid line: {line} | Error: {e}")
-              print(f"Conversion complete. Output saved to {args.output}")
-      else:
-          if not args.id:
-              print("Error: --id is required for single sequence MAP to HELM conversion.")
-          else:
-              helm_seq = convert_map_to_helm_sequence(args.input, args.id)
-              result = process_HELM_seq(helm_seq, args.id)
-              print(result)
-
-
+        if not args.id:
+            print("Error: --id is required for single sequence MAP to HELM conversion.")
+        else:
+            print(map_to_helm(args.input, args.id))
 
     # Handle MAP to SMILES
     elif args.mode == "map_to_smiles":
-        if is_file:
-            with open(args.input, "r") as f:
-                lines = [line.strip() for line in f if line.strip()]
-                # print("lines",lines)
-            results = [get_smi_from_map(line) for line in lines]
-            # print(results)
-            if not args.output:
-                raise ValueError("Output file path required for file input.")
-            with open(args.output, "w") as f:
-                f.write("\n".join(results))
-            print(f"Conversion complete. Output saved to {args.output}")
+        print(get_smi_from_map(args.input))
+
+    # Check a MAP sequence without converting it
+    elif args.mode == "validate":
+        print(check_map(args.input))
+
+    # Formula, average MW and monoisotopic mass without building the molecule
+    elif args.mode == "map_to_formula":
+        print(map_to_formula(args.input))
+
+    elif args.mode == "helm_to_formula":
+        print(helm_to_formula(args.input))
+
+    # Back from SMILES by matching its pieces to library monomers
+    elif args.mode == "smiles_to_map":
+        print(smiles_to_map(args.input))
+
+    elif args.mode == "smiles_to_helm":
+        if not args.id:
+            print("Error: --id is required for single SMILES to HELM conversion.")
         else:
-            print(get_smi_from_map(args.input))
+            print(converter(args.mode)(f"{args.input},{args.id}"))
+
+    # Several formats from one parse
+    elif args.targets:
+        print(converter(args.mode)(f"{args.input},{args.id}" if args.id else args.input))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,405 @@
+##SMILES decomposition
+# Reads a peptide SMILES back into MAP notation. The molecule is cut at the
+# bonds monomers are joined through, C(=O)-N and C(=O)-O between two heavy
+# atoms, and every piece is looked up in an index of the library templates
+# built with the other library tables: a piece's atom counts screen it, and
+# the canonical SMILES of the piece, with plain dummies where it was cut, finds
+# its monomer. No piece is compared against the library one entry at a time,
+# so the cost grows with the number of pieces, not with the library.
+# A piece with no match was cut inside a monomer, e.g. an acylated side chain,
+# and is joined back to its neighbours until it matches.
+
+from collections import Counter
+from itertools import combinations
+
+from rdkit import Chem, RDLogger
+
+from monomer_library import get_library
+from profiling import profiler
+from rotation import canonical_map
+from utils import cached_conversion, map_to_helm
+from validator import cyclic_link_from_linker
+
+# Bonds in rings up to this size are kept, i.e. lactams and lactones inside one monomer
+MAX_MONOMER_RING = 7
+# Most pieces joined back into one monomer
+MAX_MERGED = 6
+
+
+def atom_counts(mol, atoms):
+    """Input: a Mol and atom indices; Output: sorted ((element, n), ...) with hydrogens, dummies left out"""
+    counts = Counter()
+    for idx in atoms:
+        atom = mol.GetAtomWithIdx(idx)
+        if atom.GetAtomicNum() == 0:
+            continue
+        counts[atom.GetSymbol()] += 1
+        hydrogens = atom.GetTotalNumHs()
+        if hydrogens:
+            counts['H'] += hydrogens
+    return tuple(sorted(counts.items()))
+
+
+def piece_key(mol):
+    """
+    Canonical SMILES of a monomer template with its dummies unlabelled, and the labels
+    (isotopes) of its dummies in the order they are written, see dummy_key
+    """
+    mol = Chem.Mol(mol)
+    labels = {}
+    for atom in mol.GetAtoms():
+        if atom.GetAtomicNum() == 0:
+            labels[atom.GetIdx()] = atom.GetIsotope()
+            atom.SetIsotope(0)
+            atom.SetAtomMapNum(0)
+    return dummy_key(mol, labels)
+
+
+def dummy_key(mol, labels):
+    """
+    mol: a molecule whose dummies are unlabelled, labels: dummy atom index -> label
+    Output: (canonical SMILES, labels of the dummies in the order they are written)
+    Two molecules with the same SMILES list corresponding dummies in the same order.
+    """
+    smiles = Chem.MolToSmiles(mol)
+    order = mol.GetProp('_smilesAtomOutputOrder').strip('[]').split(',')
+    return smiles, tuple(labels[int(idx)] for idx in order if idx and int(idx) in labels)
+
+
+def fragment_mol(mol, atoms):
+    """
+    Copy of one fragment of mol, given by its atom indices, with stereo kept and its dummies unlabelled
+    Output: (Mol, {dummy atom index: its isotope in mol}), as dummy_key reads them
+    Chem.GetMolFrags(asMols=True) copies the whole molecule for every fragment,
+    which makes cutting a peptide into monomers quadratic in its length.
+    """
+    atoms = sorted(atoms)
+    index = {old: new for new, old in enumerate(atoms)}
+    piece = Chem.RWMol()
+    labels = {}
+    chiral = []
+    bonds = []
+    for old in atoms:
+        atom = mol.GetAtomWithIdx(old)
+        new = piece.AddAtom(atom)
+        if atom.GetAtomicNum() == 0:
+            labels[new] = atom.GetIsotope()
+            piece.GetAtomWithIdx(new).SetIsotope(0)
+        elif atom.GetChiralTag() in (Chem.ChiralType.CHI_TETRAHEDRAL_CW, Chem.ChiralType.CHI_TETRAHEDRAL_CCW):
+            chiral.append((new, atom))
+        bonds.extend(bond for bond in atom.GetBonds() if bond.GetOtherAtomIdx(old) > old)
+    flagged = []
+    for bond in bonds:
+        n_bonds = piece.AddBond(index[bond.GetBeginAtomIdx()], index[bond.GetEndAtomIdx()], bond.GetBondType())
+        if bond.GetIsAromatic() or bond.GetBondDir() != Chem.BondDir.NONE or bond.GetStereo() != Chem.BondStereo.STEREONONE:
+            flagged.append((n_bonds - 1, bond))
+    # Double bond stereo refers to neighbouring atoms, so it is set once every bond is in place
+    for new_idx, bond in flagged:
+        new_bond = piece.GetBondWithIdx(new_idx)
+        new_bond.SetIsAromatic(bond.GetIsAromatic())
+        new_bond.SetBondDir(bond.GetBondDir())
+        if bond.GetStereo() != Chem.BondStereo.STEREONONE:
+            new_bond.SetStereoAtoms(*(index[idx] for idx in bond.GetStereoAtoms()))
+            new_bond.SetStereo(bond.GetStereo())
+    # A chiral tag is relative to the order of the atom's bonds, which may have changed
+    for new, atom in chiral:
+        before = [index[bond.GetOtherAtomIdx(atom.GetIdx())] for bond in atom.GetBonds()]
+        after = [bond.GetOtherAtomIdx(new) for bond in piece.GetAtomWithIdx(new).GetBonds()]
+        if permutation_parity([after.index(idx) for idx in before]):
+            piece.GetAtomWithIdx(new).InvertChirality()
+    piece = piece.GetMol()
+    piece.UpdatePropertyCache(strict=False)
+    Chem.FastFindRings(piece)
+    return piece, labels
+
+
+def permutation_parity(permutation):
+    """1 for an odd permutation of range(n), else 0"""
+    permutation = list(permutation)
+    swaps = 0
+    for i in range(len(permutation)):
+        while permutation[i] != i:
+            j = permutation[i]
+            permutation[i], permutation[j] = permutation[j], permutation[i]
+            swaps += 1
+    return swaps % 2
+
+
+def build_monomer_index(rows, map_to_helm_dict):
+    """
+    Index of the capped templates of every monomer, for every subset of its linkable R groups
+    rows: the library CSV rows; a row is left out unless map_to_helm_dict resolves its MAP denotation to it
+    Output: {'templates': {SMILES: ((MAP denotation, R group numbers in dummy order), ...)},
+             'counts': set of atom_counts of all templates}
+    """
+    from assembly import parse_fragment
+    from utils import get_smi_from_cxsmiles, replace_unused_r_groups
+
+    templates = {}
+    counts = set()
+    RDLogger.DisableLog('rdApp.*')
+    try:
+        for row in rows:
+            denotation = row['MAP_denotion']
+            if map_to_helm_dict.get(denotation) != row['Symbol']:
+                continue
+            try:
+                mol_smi = get_smi_from_cxsmiles(row['CXSMILES'])
+            except Exception:
+                continue
+            r_groups = {r_group: row[r_group] for r_group in ['R1', 'R2', 'R3'] if row[r_group] != '-'}
+            link_r_groups = sorted(r_group for r_group in r_groups if f'[*:_{r_group}]' in mol_smi)
+            for size in range(1, len(link_r_groups) + 1):
+                for used in combinations(link_r_groups, size):
+                    try:
+                        fragment = parse_fragment(replace_unused_r_groups(mol_smi, r_groups, frozenset(used)))
+                    except Exception:
+                        continue
+                    if set(fragment.ends) != {int(r_group[1:]) for r_group in used}:
+                        continue
+                    smiles, r_numbers = piece_key(fragment.mol)
+                    entries = templates.setdefault(smiles, [])
+                    if all(entry[0] != denotation for entry in entries):
+                        entries.append((denotation, r_numbers))
+                    counts.add(atom_counts(fragment.mol, range(fragment.mol.GetNumAtoms())))
+    finally:
+        RDLogger.EnableLog('rdApp.*')
+    return {'templates': {smiles: tuple(entries) for smiles, entries in templates.items()}, 'counts': counts}
+
+
+# The C of a C-C(=O) or C-C(=S) group bonded to an N or O that has another heavy neighbour: the
+# R2 end of every backbone monomer and the C=O of an R3 side chain. Carbamates and ureas stay whole.
+LINK_BOND = Chem.MolFromSmarts('[CX3;!a](=[O,S])(-[#6])-[N,O;!a;!D1]')
+
+
+def link_bonds(mol):
+    """Indices of the bonds monomers may have been joined through, outside rings of monomer size"""
+    ring_info = mol.GetRingInfo()
+    bonds = []
+    for carbon, _, _, other in mol.GetSubstructMatches(LINK_BOND, uniquify=False):
+        bond = mol.GetBondBetweenAtoms(carbon, other).GetIdx()
+        if not 0 < ring_info.MinBondRingSize(bond) <= MAX_MONOMER_RING and bond not in bonds:
+            bonds.append(bond)
+    return sorted(bonds)
+
+
+class Decomposition:
+    """The pieces of a molecule cut at a set of link bonds, each matched against the monomer index"""
+
+    def __init__(self, mol, index):
+        self.mol = mol
+        self.index = index
+        self._matches = {}
+        self._elements = [(atom.GetSymbol(), atom.GetTotalNumHs()) for atom in mol.GetAtoms()]
+
+    def counts(self, atoms):
+        """atom_counts of some atoms of mol, which has no dummies"""
+        counts = Counter()
+        for idx in atoms:
+            symbol, hydrogens = self._elements[idx]
+            counts[symbol] += 1
+            if hydrogens:
+                counts['H'] += hydrogens
+        return tuple(sorted(counts.items()))
+
+    def pieces(self, cuts):
+        """
+        cuts: bond indices
+        Output: list of (atoms, piece), atoms are indices into mol and piece is (cut molecule, its
+                atom indices with the dummies); the dummies of a cut carry its bond index + 1 as isotope
+        """
+        cut_mol = Chem.FragmentOnBonds(self.mol, cuts, dummyLabels=[(bond + 1, bond + 1) for bond in cuts]) \
+            if cuts else self.mol
+        n_atoms = self.mol.GetNumAtoms()
+        return [(frozenset(idx for idx in atoms if idx < n_atoms), (cut_mol, atoms))
+                for atoms in Chem.GetMolFrags(cut_mol)]
+
+    def match(self, atoms, piece):
+        """(MAP denotation, {cut bond: R group number}) of a piece, or None"""
+        if atoms not in self._matches:
+            self._matches[atoms] = None
+            if self.counts(atoms) in self.index['counts']:
+                profiler.count('decompose_lookup')
+                smiles, labels = dummy_key(*fragment_mol(*piece))
+                entries = self.index['templates'].get(smiles)
+                if entries:
+                    denotation, r_numbers = entries[0]
+                    self._matches[atoms] = denotation, {label - 1: r_group for label, r_group in zip(labels, r_numbers)}
+        return self._matches[atoms]
+
+    def bond_pieces(self, cuts, pieces):
+        """{cut bond: (piece, piece)} for the cuts between two different pieces"""
+        piece_of = {idx: n for n, (atoms, piece) in enumerate(pieces) for idx in atoms}
+        joins = {}
+        for bond in cuts:
+            a = piece_of[self.mol.GetBondWithIdx(bond).GetBeginAtomIdx()]
+            b = piece_of[self.mol.GetBondWithIdx(bond).GetEndAtomIdx()]
+            if a != b:
+                joins[bond] = (a, b)
+        return joins
+
+    def join(self, cuts, atoms, inner):
+        """cuts without the inner bonds if the piece they leave on atoms matches a monomer, else None"""
+        if self.counts(atoms) not in self.index['counts']:
+            return None
+        new_cuts = [bond for bond in cuts if bond not in inner]
+        if atoms not in self._matches:
+            for merged_atoms, piece in self.pieces(new_cuts):
+                if merged_atoms == atoms:
+                    self.match(atoms, piece)
+        return new_cuts if self._matches.get(atoms) else None
+
+    def merge(self, cuts, pieces, unmatched):
+        """cuts with the bonds around one unmatched piece joined until the merged piece matches, or None"""
+        joins = self.bond_pieces(cuts, pieces)
+        # Grow the piece one neighbour at a time, smallest groups first
+        groups = [frozenset([unmatched])]
+        seen = set()
+        for size in range(2, MAX_MERGED + 1):
+            grown = []
+            for group in groups:
+                for bond, (a, b) in joins.items():
+                    if (a in group) == (b in group) or group | {a, b} in seen:
+                        continue
+                    new_group = group | {a, b}
+                    seen.add(new_group)
+                    grown.append(new_group)
+                    atoms = frozenset().union(*(pieces[n][0] for n in new_group))
+                    # Bonds between two pieces of the group are joined too
+                    inner = {bond for bond, (a, b) in joins.items() if a in new_group and b in new_group}
+                    new_cuts = self.join(cuts, atoms, inner)
+                    if new_cuts is not None:
+                        profiler.count('decompose_merge')
+                        return new_cuts
+            groups = grown
+        return None
+
+    def branch(self, cuts, pieces, matches):
+        """
+        cuts with one single-link piece joined to its neighbour where the library has the whole, or None
+        A cap on a side chain, e.g. the pyrrolidine of a Gln pyrrolidide, cannot sit on the chain;
+        a terminal cap is kept apart only where the library has no monomer with it.
+        """
+        for bond, (a, b) in self.bond_pieces(cuts, pieces).items():
+            if len(matches[a][1]) > 1 and len(matches[b][1]) > 1:
+                continue
+            new_cuts = self.join(cuts, pieces[a][0] | pieces[b][0], {bond})
+            if new_cuts is not None:
+                profiler.count('decompose_merge')
+                return new_cuts
+        return None
+
+    def run(self):
+        """(MAP denotation, {cut bond: R group number}) per monomer; raises ValueError"""
+        cuts = link_bonds(self.mol)
+        while True:
+            pieces = self.pieces(cuts)
+            matches = [self.match(atoms, piece) for atoms, piece in pieces]
+            if None in matches:
+                unmatched = matches.index(None)
+                cuts = self.merge(cuts, pieces, unmatched)
+                if cuts is None:
+                    smiles = dummy_key(*fragment_mol(*pieces[unmatched][1]))[0]
+                    raise ValueError(f'No monomer matches {smiles}')
+                continue
+            cuts = self.branch(cuts, pieces, matches) if len(pieces) > 1 else None
+            if cuts is None:
+                return matches
+
+
+def map_from_monomers(monomers):
+    """
+    Input: [(MAP denotation, {cut bond: R group number}), ...] in any order
+    Output: the MAP sequence, e.g. 'L{d}L{d}LL{d}PY{cyc:N-C}'; raises ValueError where MAP cannot express the links
+    """
+    ends = {}
+    for n, (denotation, r_groups) in enumerate(monomers):
+        for bond, r_group in r_groups.items():
+            ends.setdefault(bond, []).append((n, r_group))
+    following = {}
+    extra = []
+    for (a, r_a), (b, r_b) in ends.values():
+        if (r_a, r_b) == (2, 1):
+            following[a] = b
+        elif (r_a, r_b) == (1, 2):
+            following[b] = a
+        else:
+            extra.append(((a, r_a), (b, r_b)))
+
+    starts = [n for n in range(len(monomers)) if n not in set(following.values())]
+    first = starts[0] if starts else 0
+    if len(starts) > 1:
+        raise ValueError('The monomers do not form a single chain')
+    order = [first]
+    while order[-1] in following and following[order[-1]] != first:
+        order.append(following[order[-1]])
+    if len(order) != len(monomers):
+        raise ValueError('The monomers do not form a single chain')
+    sequence = ''.join(monomers[n][0] for n in order)
+    if not starts:
+        if extra:
+            raise ValueError('MAP has one cyclic link, this peptide has more')
+        return canonical_map(sequence + '{cyc:N-C}')
+    if not extra:
+        return sequence
+    if len(extra) > 1:
+        raise ValueError('MAP has one cyclic link, this peptide has more')
+
+    position = {n: idx + 1 for idx, n in enumerate(order)}
+    link = {(position[n], r_group) for n, r_group in extra[0]}
+    for linker in linker_candidates(link, len(order)):
+        nodes = cyclic_link_from_linker(linker, len(order)).split('-')
+        if {(int(idx), int(r_group[1:])) for idx, r_group in (node.split(':') for node in nodes)} == link:
+            return sequence + linker
+    raise ValueError(f'MAP cannot write a link between {sorted(link)}')
+
+
+def linker_candidates(link, length):
+    """{cyc:..} texts that could stand for a link between two (position, R group) ends"""
+    candidates = []
+    for (i, r_i), (j, r_j) in (sorted(link), sorted(link, reverse=True)):
+        start = 'N' if (i, r_i) == (1, 1) else str(i)
+        end = 'C' if (j, r_j) == (length, 2) else str(j)
+        candidates.append(f'{{cyc:{start}-{end}}}')
+    return candidates
+
+
+def decompose_smiles(smiles):
+    """
+    Input: 'CC(C)C[C@@H]1NC(=O)[C@@H](Cc2ccc(O)cc2)...'
+    Output: the MAP sequence; raises ValueError
+    """
+    with profiler.stage('parse_smiles'):
+        mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        raise ValueError(f'Cannot parse SMILES {smiles}')
+    with profiler.stage('decompose'):
+        monomers = Decomposition(mol, get_library().monomer_index).run()
+    return map_from_monomers(monomers)
+
+
+@cached_conversion('smiles_to_map')
+def smiles_to_map(smiles):
+    """
+    Input: a peptide SMILES, e.g. as written by get_smi_from_map
+    Output: its MAP sequence, or None where a piece matches no monomer or MAP cannot write the links
+    Head-to-tail cyclic peptides start at their smallest rotation, see rotation.canonical_map.
+    """
+    with profiler.track('smiles_to_map', smiles):
+        try:
+            return decompose_smiles(smiles)
+        except ValueError as e:
+            profiler.failure(e)
+            return None
+
+
+def smiles_to_helm_line(line):
+    """
+    Input: '<SMILES>,2'
+    Output: HELM notation, or None for a line without a peptide ID or a SMILES with no MAP sequence
+    """
+    if ',' not in line:
+        return None
+    smiles, peptide_id = map(str.strip, line.split(',', 1))
+    map_seq = smiles_to_map.__wrapped__(smiles)
+    return None if map_seq is None else map_to_helm.__wrapped__(map_seq, peptide_id)
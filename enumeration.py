@@ -0,0 +1,293 @@
+##Library enumeration
+# Enumerates virtual peptide libraries and streams (MAP, SMILES) pairs:
+#   enumerate_library('[A|G]L[P|P{d}]Y{cyc:N-C}')        every combination of the choices
+#   substitution_scan('LLLPY{cyc:N-C}', 'A|G', [2, 3])    one position swapped at a time
+# Partial peptides are assembled once and reused: products sharing a prefix
+# share its molecule, and a scan joins each substitute to the parent's
+# prefix and suffix. The cost per product is then one or two joins plus the
+# SMILES output, whatever the peptide length.
+
+import re
+
+from rdkit import Chem, rdBase
+
+from assembly import parse_cyclic_link
+from monomer_library import get_library
+from utils import get_capped_fragment, get_smi_from_map
+from validator import (BAD_CYCLIC_LINK, EMPTY, INDEX_OUT_OF_RANGE, MISSING_R_GROUP, R_GROUP_IN_USE,
+                       UNKNOWN_TOKEN, MapValidationError, cyclic_link_from_linker)
+
+cyc_regex = re.compile(r'\{cyc:\s*([N]|\d+)-([C]|\d+)\}')
+
+
+def parse_choices(text):
+    """
+    Input: 'A|G|L{d}'
+    Output: [('A', 'A'), ('G', 'G'), ('L{d}', 'dL')], (MAP denotation, Symbol) pairs
+    """
+    choices = []
+    for start, end, symbol in get_library().tokenizer.scan(text):
+        if symbol is not None:
+            choices.append((text[start:end], symbol))
+        elif text[start:end] != '|':
+            raise MapValidationError(UNKNOWN_TOKEN, f"Unknown token '{text[start:end]}' in '{text}'")
+    return choices
+
+
+def parse_spec(spec):
+    """
+    Input: '[A|G]L[P|P{d}]Y{cyc:N-C}', fixed MAP text with a [..|..] group per varied position
+    Output: (positions, linker), positions is a list of parse_choices lists, linker e.g. '{cyc:N-C}' or None
+    """
+    match = cyc_regex.search(spec)
+    linker = match.group(0) if match else None
+    body = cyc_regex.sub('', spec).strip()
+    positions = []
+    for group, fixed in re.findall(r'\[([^\]]*)\]|([^\[]+)', body):
+        if group:
+            choices = list(dict.fromkeys(parse_choices(group)))
+            if not choices:
+                raise MapValidationError(EMPTY, f"No monomers in '[{group}]'")
+            positions.append(choices)
+        else:
+            if '{cyc:' in fixed or ']' in fixed:
+                raise MapValidationError(BAD_CYCLIC_LINK if '{cyc:' in fixed else UNKNOWN_TOKEN,
+                                         f"Cannot read '{fixed}' in '{spec}'")
+            positions.extend([choice] for choice in parse_choices(fixed))
+    if not positions:
+        raise MapValidationError(EMPTY, 'No monomers')
+    return positions, linker
+
+
+def used_r_groups(idx, length, cyclic_ends):
+    """R groups of the monomer at idx taking part in a link"""
+    used = set()
+    if idx > 0:
+        used.add('R1')
+    if idx < length - 1:
+        used.add('R2')
+    for end_idx, r_group in cyclic_ends:
+        if end_idx == idx:
+            if f'R{r_group}' in used:
+                raise MapValidationError(R_GROUP_IN_USE, f'R{r_group} of monomer {idx + 1} is linked twice')
+            used.add(f'R{r_group}')
+    return used
+
+
+def cyclic_ends_of(linker, length):
+    if not linker:
+        return ()
+    ends = parse_cyclic_link(cyclic_link_from_linker(linker, length))
+    for idx, r_group in ends:
+        if not 0 <= idx < length:
+            raise MapValidationError(INDEX_OUT_OF_RANGE, f'Cyclic link {linker} is outside the {length} monomers')
+    return ends
+
+
+def missing_r_groups(idx, length, cyclic_ends, symbol):
+    """R groups the monomer would need at idx but does not have"""
+    used = used_r_groups(idx, length, cyclic_ends)
+    return sorted(used - get_library().monomers2link_r_groups_dict.get(symbol, frozenset()))
+
+
+def number_ends(fragment, idx, length, cyclic_ends):
+    """
+    Copy of a capped Fragment with an atom map number on each dummy, unique per link:
+    R1 of monomer idx and R2 of monomer idx - 1 share idx, both cyclic ends get length.
+    Any two partial peptides then join with one molzip, and the cyclic link closes
+    as soon as both of its ends are in the same molecule.
+    """
+    mol = Chem.Mol(fragment.mol)
+    for r_group, atom_idx in fragment.ends.items():
+        if (idx, r_group) in cyclic_ends:
+            map_num = length
+        elif r_group == 1:
+            map_num = idx
+        else:
+            map_num = idx + 1
+        mol.GetAtomWithIdx(atom_idx).SetAtomMapNum(map_num)
+    return mol
+
+
+def choice_fragments(idx, length, cyclic_ends, choices):
+    """Numbered template molecules of the choices for position idx; None for a choice lacking an R group it needs"""
+    used = sorted(used_r_groups(idx, length, cyclic_ends))
+    return [None if missing_r_groups(idx, length, cyclic_ends, symbol)
+            else number_ends(get_capped_fragment(symbol, used), idx, length, cyclic_ends)
+            for denotation, symbol in choices]
+
+
+def fragments_for(positions, cyclic_ends):
+    """Numbered template molecules of every choice at every position"""
+    return [choice_fragments(idx, len(positions), cyclic_ends, choices) for idx, choices in enumerate(positions)]
+
+
+def join(left, right):
+    """Bond left and right at every pair of dummies with the same map number"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    # Ends waiting for a later join are reported as incomplete labelling
+    with rdBase.BlockLogs():
+        return Chem.molzip(left, right)
+
+
+def close(mol, cyclic_ends, length):
+    """
+    SMILES of a whole peptide; a single monomer still has its cyclic link open
+    None where get_smi_from_map gives none: a lone monomer without a cyclic link, or a choice
+    lacking an R group (mol None)
+    """
+    if mol is None or (length == 1 and not cyclic_ends):
+        return None
+    if cyclic_ends and length == 1:
+        mol = Chem.molzip(mol)
+    return Chem.MolToSmiles(mol)
+
+
+def products_from_start(fragments):
+    """
+    (choice indices, molecule) in itertools.product order, prefixes assembled once
+    The molecule is None when a chosen fragment is None
+    """
+    last = len(fragments) - 1
+
+    def walk(depth, prefix, chosen, valid):
+        for k, fragment in enumerate(fragments[depth]):
+            ok = valid and fragment is not None
+            mol = join(prefix, fragment) if ok else None
+            if depth == last:
+                yield chosen + (k,), mol
+            else:
+                yield from walk(depth + 1, mol, chosen + (k,), ok)
+
+    return walk(0, None, (), True)
+
+
+def products_from_end(fragments):
+    """As products_from_start, but suffixes are shared and the last position varies slowest"""
+    def walk(depth, suffix, chosen, valid):
+        for k, fragment in enumerate(fragments[depth]):
+            ok = valid and fragment is not None
+            mol = join(fragment, suffix) if ok else None
+            if depth == 0:
+                yield (k,) + chosen, mol
+            else:
+                yield from walk(depth - 1, mol, (k,) + chosen, ok)
+
+    return walk(len(fragments) - 1, None, (), True)
+
+
+def read_in_other_order(denotations):
+    """
+    True when get_smi_from_map assembles the MAP denotations in another order than written:
+    it reads every {nt:} modification first, wherever it stands
+    """
+    after_other = False
+    for denotation in denotations:
+        if not denotation.startswith('{nt:'):
+            after_other = True
+        elif after_other:
+            return True
+    return False
+
+
+def join_count(sizes):
+    """Joins needed to build every prefix, i.e. the internal nodes of the product tree"""
+    count, width = 0, 1
+    for size in sizes[:-1]:
+        width *= size
+        count += width
+    return count
+
+
+def enumerate_library(spec):
+    """
+    Yield (MAP, SMILES) for every combination of the choices in spec, e.g. '[A|G]L[P|P{d}]Y{cyc:N-C}'
+    SMILES is None for a product get_smi_from_map gives none for: one that cannot be cyclized,
+    has a choice lacking an R group its position links through, or is a lone monomer. Products
+    with an {nt:} choice after another monomer are converted by get_smi_from_map, which moves it
+    to the front. Assembly starts from whichever end
+    needs fewer joins: from the N-terminus products come in itertools.product order, from the
+    C-terminus the last position varies slowest.
+    """
+    positions, linker = parse_spec(spec)
+    length = len(positions)
+    cyclic_ends = cyclic_ends_of(linker, length)
+    fragments = fragments_for(positions, cyclic_ends)
+    sizes = [len(choices) for choices in positions]
+    if join_count(sizes[::-1]) < join_count(sizes):
+        products = products_from_end(fragments)
+    else:
+        products = products_from_start(fragments)
+    for chosen, mol in products:
+        denotations = [positions[idx][k][0] for idx, k in enumerate(chosen)]
+        map_str = ''.join(denotations) + (linker or '')
+        if read_in_other_order(denotations):
+            yield map_str, get_smi_from_map(map_str)
+        else:
+            yield map_str, close_or_none(mol, cyclic_ends, length)
+
+
+def substitution_scan(parent, substitutes, positions=None):
+    """
+    Yield (MAP, SMILES) for the parent MAP sequence with one position replaced by one substitute
+    substitutes: 'A|G|L{d}'
+    positions: 1-based positions to scan, default all; a substitute equal to the parent monomer is skipped
+    SMILES is None where a substitute lacks an R group the position links through, and is
+    get_smi_from_map's for a {nt:} substitute after the first position, which it reads first.
+    """
+    spec_positions, linker = parse_spec(parent)
+    if any(len(choices) > 1 for choices in spec_positions):
+        raise MapValidationError(UNKNOWN_TOKEN, 'The parent of a scan must be a plain MAP sequence')
+    parent_choices = [choices[0] for choices in spec_positions]
+    length = len(parent_choices)
+    cyclic_ends = cyclic_ends_of(linker, length)
+    substitutes = parse_choices(substitutes)
+    positions = range(1, length + 1) if positions is None else positions
+    for position in positions:
+        if not 1 <= position <= length:
+            raise MapValidationError(INDEX_OUT_OF_RANGE, f'Position {position} is outside the {length} monomers')
+
+    parent_fragments = [fragments[0] for fragments in fragments_for([[choice] for choice in parent_choices], cyclic_ends)]
+    for idx, fragment in enumerate(parent_fragments):
+        # A parent read in another order is only converted by get_smi_from_map
+        if fragment is None and not read_in_other_order([choice[0] for choice in parent_choices]):
+            denotation, symbol = parent_choices[idx]
+            missing = missing_r_groups(idx, length, cyclic_ends, symbol)
+            raise MapValidationError(MISSING_R_GROUP, f'{denotation} at position {idx + 1} lacks {missing}')
+    unbuildable = {idx for idx, fragment in enumerate(parent_fragments) if fragment is None}
+    # prefixes[i]: monomers before i, suffixes[i]: monomers after i
+    prefixes = [None]
+    for fragment in parent_fragments[:-1]:
+        prefixes.append(join(prefixes[-1], fragment) if fragment is not None else None)
+    suffixes = [None]
+    for fragment in parent_fragments[:0:-1]:
+        suffixes.insert(0, join(fragment, suffixes[0]) if fragment is not None else None)
+
+    for position in positions:
+        idx = position - 1
+        before = ''.join(choice[0] for choice in parent_choices[:idx])
+        after = ''.join(choice[0] for choice in parent_choices[idx + 1:]) + (linker or '')
+        for denotation, symbol in substitutes:
+            if symbol == parent_choices[idx][1]:
+                continue
+            denotations = [choice[0] for choice in parent_choices]
+            denotations[idx] = denotation
+            if read_in_other_order(denotations):
+                yield before + denotation + after, get_smi_from_map(before + denotation + after)
+                continue
+            fragment = choice_fragments(idx, length, cyclic_ends, [(denotation, symbol)])[0]
+            if fragment is None or unbuildable - {idx}:
+                yield before + denotation + after, None
+                continue
+            mol = join(join(prefixes[idx], fragment), suffixes[idx])
+            yield before + denotation + after, close_or_none(mol, cyclic_ends, length)
+
+
+def close_or_none(mol, cyclic_ends, length):
+    try:
+        return close(mol, cyclic_ends, length)
+    except Exception:
+        return None
@@ -0,0 +1,160 @@
+##Formula and mass
+# Molecular formula, average molecular weight and monoisotopic mass of a
+# peptide without assembling it. Joining two monomers removes the two linked
+# R group dummies and nothing else, so the element counts are the sum of one
+# increment per monomer: its template capped for the R groups it links
+# through, minus those dummies. The masses are taken from the summed integer
+# counts once, so they do not drift from RDKit's with the number of monomers.
+# Increments and element masses are computed with RDKit when the library
+# tables are built and cached with them; summing them needs no RDKit.
+
+from collections import namedtuple
+from itertools import combinations
+import math
+
+from assembly import parse_cyclic_link
+
+# counts: ((element, n), ...), charge: formal charge
+Increment = namedtuple('Increment', ['counts', 'charge'])
+
+# Taken off the monoisotopic mass per positive charge, as by RDKit's ExactMolWt
+ELECTRON_MASS = 0.00054857991
+
+# formula, average molecular weight and monoisotopic mass of a peptide
+Formula = namedtuple('Formula', ['formula', 'average', 'monoisotopic'])
+
+
+def fragment_increment(mol, linked):
+    """
+    Increment of a capped monomer template
+    linked: R group numbers of its dummies, each replaced by a link, e.g. {1, 2}
+    Sums to the element counts and charge of the assembled peptide.
+    """
+    counts = {}
+    charge = 0
+    for atom in mol.GetAtoms():
+        if atom.GetAtomicNum() == 0 and atom.GetIsotope() in linked:
+            continue
+        symbol = atom.GetSymbol()
+        counts[symbol] = counts.get(symbol, 0) + 1
+        hydrogens = atom.GetTotalNumHs()
+        if hydrogens:
+            counts['H'] = counts.get('H', 0) + hydrogens
+        charge += atom.GetFormalCharge()
+    return Increment(tuple(sorted(counts.items())), charge)
+
+
+def build_increments(monomers2smi_dict, monomers2r_groups_dict, monomers2link_r_groups_dict):
+    """
+    Symbol -> {frozenset of linked R groups: Increment}, for every subset of the linkable R groups
+    Combinations the assembly would reject are left out: templates that cannot be capped,
+    and templates keeping an R group dummy that is neither capped nor linked.
+    """
+    from rdkit import RDLogger
+
+    from assembly import parse_fragment
+    from utils import replace_unused_r_groups
+
+    increments = {}
+    RDLogger.DisableLog('rdApp.*')
+    try:
+        for symbol, link_r_groups in monomers2link_r_groups_dict.items():
+            by_used = {}
+            for size in range(len(link_r_groups) + 1):
+                for used in combinations(sorted(link_r_groups), size):
+                    try:
+                        mol_smi = replace_unused_r_groups(monomers2smi_dict[symbol],
+                                                          monomers2r_groups_dict[symbol], frozenset(used))
+                        fragment = parse_fragment(mol_smi)
+                    except Exception:
+                        continue
+                    linked = {int(r_group[1:]) for r_group in used}
+                    if set(fragment.ends) == linked:
+                        by_used[frozenset(used)] = fragment_increment(fragment.mol, linked)
+            increments[symbol] = by_used
+    finally:
+        RDLogger.EnableLog('rdApp.*')
+    return increments
+
+
+def build_element_masses(monomers2increments_dict):
+    """
+    Element -> (atomic weight, most common isotope mass) for every element in the increments,
+    the masses RDKit's MolWt and ExactMolWt add up per atom
+    """
+    from rdkit import Chem
+
+    table = Chem.GetPeriodicTable()
+    elements = {element for by_used in monomers2increments_dict.values()
+                for increment in by_used.values() for element, n in increment.counts}
+    return {element: (table.GetAtomicWeight(element), table.GetMostCommonIsotopeMass(element))
+            for element in sorted(elements)}
+
+
+def hill_formula(counts, charge=0):
+    """
+    Input: {'C': 6, 'H': 12, 'N': 2, 'O': 3}, 0
+    Output: 'C6H12N2O3', carbon and hydrogen first when there is carbon, then alphabetical
+    """
+    if 'C' in counts:
+        order = ['C'] + (['H'] if 'H' in counts else []) + sorted(k for k in counts if k not in ('C', 'H'))
+    else:
+        order = sorted(counts)
+    formula = ''.join(f'{element}{counts[element]}' if counts[element] > 1 else element
+                      for element in order if counts[element])
+    if charge:
+        sign = '+' if charge > 0 else '-'
+        formula += sign if abs(charge) == 1 else f'{sign}{abs(charge)}'
+    return formula
+
+
+def peptide_formula(monomer_list, cyclic_link=None, increments=None, masses=None):
+    """
+    Input: ['dL', 'dL', 'L', 'dL', 'P', 'Y'], '1:R1-6:R2', e.g. as returned by validator.validate_parts
+    Output: Formula('C38H60N6O7', 712.933, 712.45234...), or None where the peptide cannot be built
+    increments, masses: monomers2increments_dict and element_masses, default the library's
+    """
+    if increments is None or masses is None:
+        from monomer_library import get_library
+
+        library = get_library()
+        increments = library.monomers2increments_dict if increments is None else increments
+        masses = library.element_masses if masses is None else masses
+    length = len(monomer_list)
+    # A lone monomer has no links, which validator.validate_parts rejects as single_monomer
+    if length == 1 and not cyclic_link:
+        return None
+    used = [set() for _ in monomer_list]
+    for idx in range(length - 1):
+        used[idx].add('R2')
+        used[idx + 1].add('R1')
+    if cyclic_link:
+        try:
+            ends = parse_cyclic_link(cyclic_link)
+        except (ValueError, IndexError):
+            return None
+        for idx, r_group in ends:
+            if not 0 <= idx < length or f'R{r_group}' in used[idx]:
+                return None
+            used[idx].add(f'R{r_group}')
+
+    counts = {}
+    charge = 0
+    for symbol, r_groups in zip(monomer_list, used):
+        increment = increments.get(symbol, {}).get(frozenset(r_groups))
+        if increment is None:
+            return None
+        for element, n in increment.counts:
+            counts[element] = counts.get(element, 0) + n
+        charge += increment.charge
+    average = math.fsum(n * masses[element][0] for element, n in counts.items())
+    monoisotopic = math.fsum(n * masses[element][1] for element, n in counts.items()) - charge * ELECTRON_MASS
+    return Formula(hill_formula(counts, charge), average, monoisotopic)
+
+
+def format_formula(formula):
+    """
+    Input: Formula('C38H60N6O7', 712.933, 712.452348)
+    Output: 'C38H60N6O7\\t712.933\\t712.4523', formula, average MW and monoisotopic mass
+    """
+    return f'{formula.formula}\t{formula.average:.3f}\t{formula.monoisotopic:.4f}'
@@ -0,0 +1,113 @@
+##Background conversion jobs
+# Runs a batch conversion on a background thread and writes the results to a
+# temporary file as they arrive, so a UI can poll progress and offer the
+# output for download without holding the whole job in memory.
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from batch import convert_lines
+
+# Results kept in memory for showing the start of the output
+PREVIEW_LINES = 1000
+# Worker processes per job by default; every UI session can run its own job, so a job does not take
+# a process per core
+JOB_WORKERS = 2
+
+
+def remove_output(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ConversionJob:
+    """
+    Convert lines with a batch.CONVERTERS mode on a background thread
+        job = ConversionJob('map_to_smiles', lines, total=len(lines)).start()
+        job.done, job.total, job.rate(), job.finished, job.output_path
+    lines: iterable of input lines, consumed on the job thread
+    Every input line gives one output line, empty when it could not be converted.
+    workers: processes, default JOB_WORKERS (at most one per core)
+    The output file is deleted by remove(), or once the job is garbage collected or the process exits.
+    """
+
+    def __init__(self, mode, lines, total=None, workers=None, chunksize=64):
+        self.mode = mode
+        self.lines = lines
+        self.total = total
+        self.workers = workers or min(JOB_WORKERS, os.cpu_count() or 1)
+        self.chunksize = chunksize
+        self.done = 0
+        self.failed = 0
+        self.preview = []
+        self.error = None
+        self.started = None
+        self.ended = None
+        self._cancel = threading.Event()
+        fd, self.output_path = tempfile.mkstemp(prefix=f'{mode}_', suffix='.txt')
+        os.close(fd)
+        # Holds the path, not the job, so a session dropping its job without remove() still cleans up
+        self._remove_output = weakref.finalize(self, remove_output, self.output_path)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def finished(self):
+        return self.ended is not None
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.perf_counter()) - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def progress(self):
+        """Fraction done in [0, 1], or None while the total is unknown"""
+        if not self.total:
+            return 1.0 if self.finished else None
+        return min(self.done / self.total, 1.0)
+
+    def _run(self):
+        # Workers are spawned: forking the threaded UI server is not safe
+        mp_context = multiprocessing.get_context('spawn')
+        try:
+            with open(self.output_path, 'w', buffering=1 << 16) as outfile:
+                results = convert_lines(self.lines, self.mode, self.workers, self.chunksize,
+                                        mp_context=mp_context)
+                for line, result, error in results:
+                    if self._cancel.is_set():
+                        results.close()
+                        break
+                    if result is None:
+                        self.failed += 1
+                    outfile.write((result or '') + '\n')
+                    if len(self.preview) < PREVIEW_LINES:
+                        self.preview.append(result or '')
+                    self.done += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ended = time.perf_counter()
+
+    def remove(self):
+        """Cancel the job and delete its output file"""
+        self.cancel()
+        if self.started is not None:
+            self._thread.join()
+        self._remove_output()
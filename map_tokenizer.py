@@ -0,0 +1,80 @@
+##MAP tokenizer
+# Longest-match tokenizer over the MAP_denotion column of the monomer library.
+# The vocabulary is compiled once into a character trie, so the cost of
+# tokenizing a sequence depends on its length and not on the library size.
+
+_END = ''  # trie key holding the value of a complete MAP denotation
+
+
+class MapTokenizer:
+    """
+    Precompiled longest-match tokenizer for MAP strings
+    vocabulary: dict of MAP denotation -> value, e.g. {'L': 'L', 'L{d}': 'dL'}
+
+    Gives the same tokens as scanning the denotations in descending order and
+    taking the first one the remaining string starts with: two keys matching at
+    the same position are prefixes of each other, so that is the longest one.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = dict(vocabulary)
+        self._root = {}
+        for key, value in self.vocabulary.items():
+            if not key:
+                continue
+            node = self._root
+            for char in key:
+                node = node.setdefault(char, {})
+            node[_END] = value
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    def __contains__(self, key):
+        return key in self.vocabulary
+
+    def match(self, string, pos=0):
+        """
+        Longest MAP denotation starting at string[pos]
+        Input: 'L{d}PY', 0
+        Output: (4, 'dL'), or None if no denotation starts there
+        """
+        node = self._root
+        best = None
+        for i in range(pos, len(string)):
+            node = node.get(string[i])
+            if node is None:
+                break
+            if _END in node:
+                best = (i + 1 - pos, node[_END])
+        return best
+
+    def scan(self, string):
+        """
+        Walk a MAP string left to right
+        Input: 'L{d}P?'
+        Output: [(0, 4, 'dL'), (4, 5, 'P'), (5, 6, None)]
+        Unmatched characters come out one at a time with value None.
+        """
+        spans = []
+        pos = 0
+        length = len(string)
+        while pos < length:
+            found = self.match(string, pos)
+            if found:
+                size, value = found
+                spans.append((pos, pos + size, value))
+                pos += size
+            else:
+                spans.append((pos, pos + 1, None))
+                pos += 1
+        return spans
+
+    def tokenize(self, string):
+        """
+        Input: 'L{d}L{d}LL{d}PY'
+        Output: ['dL', 'dL', 'L', 'dL', 'P', 'Y']
+        Unmatched characters are kept as-is.
+        """
+        return [string[start] if value is None else value
+                for start, end, value in self.scan(string)]
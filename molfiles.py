@@ -0,0 +1,71 @@
+##Molecule files
+# Writes assembled peptides as RDKit binary pickles or SDF, one record per
+# molecule named by its peptide ID, so downstream descriptor or docking jobs
+# load Mols without parsing SMILES again. Records are written as they arrive.
+
+import pickle
+
+from rdkit import Chem
+
+MOL_FORMATS = ('pickle', 'sdf')
+
+
+class MolWriter:
+    """
+    Appends named Mols to a file
+        'pickle': a stream of pickled Mol.ToBinary() strings with all properties, read with read_pickled_mols
+        'sdf': an SD file with RDKit 2D coordinates, the name on the title line
+    append: keep the records already in the file, e.g. when resuming a conversion
+    """
+
+    def __init__(self, path, fmt, append=False):
+        if fmt not in MOL_FORMATS:
+            raise ValueError(f"Unknown molecule format '{fmt}', choose from {', '.join(MOL_FORMATS)}")
+        self.format = fmt
+        self.count = 0
+        if fmt == 'pickle':
+            self._file = open(path, 'ab' if append else 'wb', buffering=1 << 16)
+            self._pickler = pickle.Pickler(self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            self._file = open(path, 'a' if append else 'w', buffering=1 << 16)
+            self._writer = Chem.SDWriter(self._file)
+
+    def write(self, mol, name):
+        mol.SetProp('_Name', name)
+        if self.format == 'pickle':
+            self._pickler.dump(mol.ToBinary(Chem.PropertyPickleOptions.AllProps))
+            # Pickler otherwise remembers every record it has written
+            self._pickler.clear_memo()
+        else:
+            self._writer.write(mol)
+        self.count += 1
+
+    def flush(self):
+        if self.format == 'sdf':
+            self._writer.flush()
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        if self.format == 'sdf':
+            self._writer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_pickled_mols(path):
+    """Yield the Mols of a MolWriter 'pickle' file; mol.GetProp('_Name') is the peptide ID"""
+    with open(path, 'rb') as infile:
+        while True:
+            try:
+                data = pickle.load(infile)
+            except EOFError:
+                return
+            yield Chem.Mol(data)
@@ -0,0 +1,311 @@
+##Monomer library
+# Loads data/MAP_momomers_library_new.csv once, on first use, and derives the
+# lookup tables the converters need. The derived tables are written to a
+# versioned cache file keyed by the CSV's content hash, so later processes skip
+# CSV parsing and SMILES preparation entirely. The same file holds every capped
+# monomer template as an RDKit binary. It is memory-mapped read-only, so all
+# worker processes share one copy of the templates in the page cache and each
+# decodes only the templates it uses.
+
+import csv
+import hashlib
+from itertools import combinations
+import io
+import mmap
+import os
+import pickle
+import tempfile
+
+from map_tokenizer import MapTokenizer
+
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'MAP_momomers_library_new.csv')
+# Bump when the layout of the cached tables changes
+CACHE_VERSION = 7
+# Cache file: CACHE_MAGIC, the size of the pickled (header, directory) as 8 bytes little-endian,
+# that pickle, then the sections the directory points into: one pickle per table, the pickled
+# template index and the template binaries
+CACHE_MAGIC = b'MAPLIB\n'
+
+
+def default_cache_dir(path):
+    return os.environ.get('MAP_MONOMER_CACHE_DIR',
+                          os.path.join(os.path.dirname(path), '.cache'))
+
+
+class MonomerLibrary:
+    """
+    Lookup tables derived from the monomer library CSV
+        monomers2smi_dict: Symbol -> SMILES with labelled R groups, e.g. 'C[C@H](N[*:_R1])C([*:_R2])=O'
+        monomers2r_groups_dict: Symbol -> {'R1': 'H', 'R2': 'OH'}
+        monomers2link_r_groups_dict: Symbol -> R groups that can take part in a link, i.e. listed
+                                     in the R1/R2/R3 columns and present in the SMILES
+        monomers2increments_dict: Symbol -> {frozenset of linked R groups: formula.Increment}
+        element_masses: element -> (atomic weight, most common isotope mass), see formula.build_element_masses
+        monomer_index: capped templates keyed by canonical SMILES, see decompose.build_monomer_index
+        map_to_helm_dict: MAP denotation -> Symbol
+        helm_to_map_dict: Symbol -> MAP denotation
+        tokenizer: MapTokenizer over map_to_helm_dict
+        templates: TemplateStore of the capped monomer templates
+    The library is loaded on first attribute access, and each table is unpickled from the
+    memory-mapped cache file the first time it is used; cache_dir=False keeps the packed
+    tables in memory instead.
+    """
+
+    def __init__(self, path=LIBRARY_PATH, cache_dir=None):
+        self.path = path
+        self.cache_dir = default_cache_dir(path) if cache_dir is None else cache_dir
+        self.library_hash = None
+        self._buffer = None
+        self._directory = None
+        self._tables = {}
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set in __init__, i.e. the tables
+        if name.startswith('_'):
+            raise AttributeError(name)
+        self.load()
+        if name not in self._tables:
+            if name not in self._directory:
+                raise AttributeError(f"'MonomerLibrary' object has no attribute '{name}'")
+            self._tables[name] = self._unpack(name)
+        return self._tables[name]
+
+    def load(self):
+        if self._buffer is None:
+            with open(self.path, 'rb') as f:
+                content = f.read()
+            self.library_hash = hashlib.sha256(content).hexdigest()
+            opened = self._read_cache()
+            if opened is None:
+                tables = build_tables(content.decode('utf-8'))
+                chunks = pack_library(self.cache_header(), tables, build_templates(tables))
+                self._write_cache(chunks)
+                # Map the file just written, so this process shares it like any other
+                opened = self._read_cache() or open_packed(b''.join(chunks))
+            header, self._directory, self._buffer = opened
+        return self
+
+    def _unpack(self, name):
+        offset, size = self._directory[name]
+        if name == 'templates':
+            index_offset, index_size = self._directory['template_index']
+            index = pickle.loads(self._buffer[index_offset:index_offset + index_size])
+            return TemplateStore(self._buffer, index, offset)
+        return pickle.loads(self._buffer[offset:offset + size])
+
+    def cache_path(self):
+        name = os.path.basename(self.path)
+        return os.path.join(self.cache_dir, f'{name}.{self.library_hash[:16]}.v{CACHE_VERSION}.tables')
+
+    def cache_header(self):
+        # Template canonical SMILES in monomer_index and template binaries can change between RDKit releases
+        from rdkit import rdBase
+        return {'version': CACHE_VERSION, 'library_hash': self.library_hash, 'rdkit': rdBase.rdkitVersion}
+
+    def _read_cache(self):
+        """open_packed over a read-only map of the cache file, or None"""
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.cache_path(), 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            opened = open_packed(buffer)
+        except (pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+            opened = None
+        if opened is None or opened[0] != self.cache_header():
+            buffer.close()
+            return None
+        return opened
+
+    def _write_cache(self, chunks):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.writelines(chunks)
+            os.replace(tmp_path, self.cache_path())
+        except OSError:
+            # A read-only install still works, it just rebuilds every time
+            pass
+
+    def dataframe(self):
+        """The raw library as a pandas DataFrame, for code that still wants one"""
+        import pandas as pd
+        return pd.read_csv(self.path)
+
+
+def pack_library(header, tables, templates):
+    """
+    Contents of a cache file as a list of bytes chunks, see CACHE_MAGIC
+    templates: {(Symbol, used R groups): assembly.Fragment}, as from build_templates
+    """
+    index, binaries = pack_templates(templates)
+    sections = {name: pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL) for name, table in tables.items()}
+    sections['template_index'] = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+    sections['templates'] = binaries
+    head_size = 0
+    while True:
+        # Offsets are absolute, so they depend on the size of the pickle listing them
+        directory = {}
+        offset = len(CACHE_MAGIC) + 8 + head_size
+        for name, data in sections.items():
+            directory[name] = (offset, len(data))
+            offset += len(data)
+        head = pickle.dumps((header, directory), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(head) == head_size:
+            break
+        head_size = len(head)
+    return [CACHE_MAGIC, len(head).to_bytes(8, 'little'), head, *sections.values()]
+
+
+def open_packed(buffer):
+    """
+    Input: the contents of a cache file, e.g. a read-only mmap
+    Output: (header, directory, buffer), directory: section name -> (offset, size) in buffer
+    """
+    start = len(CACHE_MAGIC) + 8
+    if buffer[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+        raise ValueError('Not a monomer library cache file')
+    header, directory = pickle.loads(buffer[start:start + int.from_bytes(buffer[len(CACHE_MAGIC):start], 'little')])
+    return header, directory, buffer
+
+
+def build_tables(text):
+    from decompose import build_monomer_index
+    from formula import build_element_masses, build_increments
+    from utils import get_smi_from_cxsmiles
+
+    rows = list(csv.DictReader(io.StringIO(text)))
+
+    monomers2smi_dict = {}
+    monomers2r_groups_dict = {}
+    for row in rows:
+        monomers2smi_dict[row['Symbol']] = get_smi_from_cxsmiles(row['CXSMILES'])
+        monomers2r_groups_dict[row['Symbol']] = {}
+        for r_group in ['R1', 'R2', 'R3']:
+            if row[r_group] != '-':
+                monomers2r_groups_dict[row['Symbol']][r_group] = row[r_group]
+
+    monomers2link_r_groups_dict = {
+        symbol: frozenset(r_group for r_group in r_groups if f'[*:_{r_group}]' in monomers2smi_dict[symbol])
+        for symbol, r_groups in monomers2r_groups_dict.items()
+    }
+
+    monomers2increments_dict = build_increments(monomers2smi_dict, monomers2r_groups_dict,
+                                                monomers2link_r_groups_dict)
+    element_masses = build_element_masses(monomers2increments_dict)
+
+    # As the pandas tables did: the last row wins for a MAP denotation listed more than once
+    # (set_index(...).to_dict()), the first row for a Symbol (df2.loc[...].values[0])
+    map_to_helm_dict = {}
+    helm_to_map_dict = {}
+    for row in rows:
+        map_to_helm_dict[row['MAP_denotion']] = row['Symbol']
+        helm_to_map_dict.setdefault(row['Symbol'], row['MAP_denotion'])
+    monomer_index = build_monomer_index(rows, map_to_helm_dict)
+    map_to_helm_dict = dict(sorted(map_to_helm_dict.items(), reverse=True))
+
+    return {
+        'monomers2smi_dict': monomers2smi_dict,
+        'monomers2r_groups_dict': monomers2r_groups_dict,
+        'monomers2link_r_groups_dict': monomers2link_r_groups_dict,
+        'monomers2increments_dict': monomers2increments_dict,
+        'element_masses': element_masses,
+        'monomer_index': monomer_index,
+        'map_to_helm_dict': map_to_helm_dict,
+        'helm_to_map_dict': helm_to_map_dict,
+        'tokenizer': MapTokenizer(map_to_helm_dict),
+    }
+
+
+class TemplateStore:
+    """
+    Capped monomer templates kept as RDKit binaries in a read-only buffer, normally the memory
+    map of the library cache file
+    index: (Symbol, frozenset of used R groups) -> (offset, size, ((R group number, dummy atom index), ...))
+    offset: where the binaries start in buffer
+    """
+
+    def __init__(self, buffer, index, offset=0):
+        self.buffer = buffer
+        self.index = index
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def fragment(self, symbol, used_r_groups):
+        """
+        Input: 'L', frozenset({'R1', 'R2'})
+        Output: a new assembly.Fragment of the template, or None where it is not in the store
+        """
+        from rdkit import Chem
+
+        from assembly import Fragment
+
+        entry = self.index.get((symbol, used_r_groups))
+        if entry is None:
+            return None
+        start, size, ends = entry
+        start += self.offset
+        return Fragment(Chem.Mol(self.buffer[start:start + size]), dict(ends))
+
+
+def build_templates(tables):
+    """
+    (Symbol, frozenset of used R groups) -> assembly.Fragment, for every subset of each monomer's
+    R groups; subsets whose capped template cannot be built are left out
+    """
+    from rdkit import RDLogger
+
+    from assembly import parse_fragment
+    from utils import replace_unused_r_groups
+
+    templates = {}
+    RDLogger.DisableLog('rdApp.*')
+    try:
+        for symbol, r_groups in tables['monomers2r_groups_dict'].items():
+            for size in range(len(r_groups) + 1):
+                for used in combinations(list(r_groups), size):
+                    used = frozenset(used)
+                    try:
+                        mol_smi = replace_unused_r_groups(tables['monomers2smi_dict'][symbol], r_groups, used)
+                        templates[(symbol, used)] = parse_fragment(mol_smi)
+                    except Exception:
+                        continue
+    finally:
+        RDLogger.EnableLog('rdApp.*')
+    return templates
+
+
+def pack_templates(templates):
+    """
+    Input: {(Symbol, used R groups): Fragment}
+    Output: (TemplateStore index, the concatenated RDKit binaries it points into)
+    """
+    index = {}
+    blob = bytearray()
+    for key, fragment in templates.items():
+        binary = fragment.mol.ToBinary()
+        index[key] = (len(blob), len(binary), tuple(sorted(fragment.ends.items())))
+        blob += binary
+    return index, bytes(blob)
+
+
+_library = None
+
+def get_library():
+    """The shared MonomerLibrary for the default CSV, loaded on first use"""
+    global _library
+    if _library is None:
+        _library = MonomerLibrary()
+    return _library
@@ -0,0 +1,138 @@
+##Profiling
+# Per-stage wall time, counters, failure reasons and slowest inputs for the
+# MAP->SMILES pipeline. The shared `profiler` is disabled by default; while
+# disabled every hook returns immediately.
+
+from collections import Counter
+import contextlib
+import heapq
+import time
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _Track(_Stage):
+    __slots__ = ('text',)
+
+    def __init__(self, profiler, name, text):
+        super().__init__(profiler, name)
+        self.text = text
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.profiler.add_time(self.name, elapsed)
+        self.profiler.add_input(self.text, elapsed)
+
+
+class Profiler:
+    """
+    Accumulates stage timings, counters, failures by exception type and the slowest inputs
+        with profiler.stage('tokenize'): ...
+        with profiler.track('map_to_smiles', map_str): ...   # also ranks the input
+    """
+
+    def __init__(self, slowest=10):
+        self.enabled = False
+        self.slowest = slowest
+        self.reset()
+
+    def enable(self, slowest=None):
+        if slowest is not None:
+            self.slowest = slowest
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.times = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.failures = Counter()
+        self._slowest = []  # min-heap of (elapsed, input)
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Stage(self, name)
+
+    def track(self, name, text):
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Track(self, name, text)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def failure(self, exc):
+        # Validation errors are counted by reason code
+        if self.enabled:
+            self.failures[getattr(exc, 'code', None) or type(exc).__name__] += 1
+
+    def add_time(self, name, elapsed):
+        self.times[name] += elapsed
+        self.calls[name] += 1
+
+    def add_input(self, text, elapsed):
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, (elapsed, text))
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (elapsed, text))
+
+    def snapshot(self):
+        return {
+            'times': dict(self.times),
+            'calls': dict(self.calls),
+            'counters': dict(self.counters),
+            'failures': dict(self.failures),
+            'slowest': sorted(self._slowest, reverse=True),
+        }
+
+    def drain(self):
+        """Snapshot and reset, for shipping a worker's numbers to the parent"""
+        snapshot = self.snapshot()
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        self.times.update(snapshot['times'])
+        self.calls.update(snapshot['calls'])
+        self.counters.update(snapshot['counters'])
+        self.failures.update(snapshot['failures'])
+        for elapsed, text in snapshot['slowest']:
+            self.add_input(text, elapsed)
+
+    def report(self, total_stage='map_to_smiles'):
+        total = self.times.get(total_stage) or sum(self.times.values())
+        lines = [f"{'stage':<16} {'calls':>9} {'total s':>9} {'mean us':>9} {'share':>7}"]
+        for name, elapsed in sorted(self.times.items(), key=lambda item: -item[1]):
+            calls = self.calls[name]
+            share = f'{elapsed / total:>6.1%}' if total else ''
+            lines.append(f"{name:<16} {calls:>9} {elapsed:>9.3f} {elapsed / calls * 1e6:>9.1f} {share:>7}")
+        if self.counters:
+            lines.append('counters: ' + ', '.join(f'{k}={v}' for k, v in sorted(self.counters.items())))
+        if self.failures:
+            lines.append('failures: ' + ', '.join(f'{k}={v}' for k, v in self.failures.most_common()))
+        if self._slowest:
+            lines.append(f'slowest {len(self._slowest)} inputs:')
+            for elapsed, text in sorted(self._slowest, reverse=True):
+                lines.append(f'  {elapsed * 1e3:9.2f} ms  {text}')
+        return '\n'.join(lines)
+
+
+profiler = Profiler()
@@ -0,0 +1,65 @@
+##Head-to-tail rotations
+# A head-to-tail cyclic peptide ({cyc:N-C}) has no first monomer: every
+# rotation of its sequence, e.g. L{d}L{d}LL{d}PY and L{d}LL{d}PYL{d}, is the
+# same ring. Every monomer links through R1 and R2 wherever it sits, so a
+# rotation also validates, builds and fails exactly like the original.
+# canonical_map picks one rotation per ring from the tokens alone, which lets
+# batch modes convert each ring once instead of once per rotation.
+
+from utils import parse_map
+from validator import cyclic_link_from_linker
+
+HEAD_TO_TAIL = '{cyc:N-C}'
+
+
+def least_rotation(items):
+    """
+    Input: ['L{d}', 'L', 'L{d}', 'P', 'Y', 'L{d}']
+    Output: 1, the start of the lexicographically smallest rotation (first one on ties)
+    Booth's algorithm, linear in the number of items.
+    """
+    n = len(items)
+    failure = [-1] * (2 * n)
+    k = 0
+    for j in range(1, 2 * n):
+        item = items[j % n]
+        i = failure[j - k - 1]
+        while i != -1 and item != items[(k + i + 1) % n]:
+            if item < items[(k + i + 1) % n]:
+                k = j - i - 1
+            i = failure[i]
+        if i == -1 and item != items[(k + i + 1) % n]:
+            if item < items[(k + i + 1) % n]:
+                k = j
+            failure[j - k] = -1
+        else:
+            failure[j - k] = i + 1
+    return k
+
+
+def head_to_tail_monomers(map_str):
+    """MAP denotations of a head-to-tail cyclic peptide, or None for anything else"""
+    # The parser moves {nt:} modifications to the front, so a rotation would not stay put
+    if '{cyc' not in map_str or '{nt:' in map_str:
+        return None
+    parsed = parse_map(map_str)
+    if not parsed.linker or not parsed.spans or any(symbol is None for start, end, symbol in parsed.spans):
+        return None
+    length = len(parsed.spans)
+    # As the SMILES builder reads the link, e.g. '{cyc:1-C}' and '{cyc:1-6}' are head-to-tail too
+    if cyclic_link_from_linker(parsed.linker, length) != f'1:R1-{length}:R2':
+        return None
+    return [parsed.sequence[start:end] for start, end, symbol in parsed.spans]
+
+
+def canonical_map(map_str):
+    """
+    Input: 'L{d}LL{d}PYL{d}{cyc:N-C}'
+    Output: 'LL{d}PYL{d}L{d}{cyc:N-C}', the smallest rotation by MAP denotation
+    Any other input, linear, side-chain cyclic, with {nt:} or not fully tokenized, is returned unchanged.
+    """
+    monomers = head_to_tail_monomers(map_str)
+    if monomers is None:
+        return map_str
+    k = least_rotation(monomers)
+    return ''.join(monomers[k:] + monomers[:k]) + HEAD_TO_TAIL
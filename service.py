@@ -0,0 +1,405 @@
+##Conversion service
+# A local HTTP/1.1 service for workflow engines that would otherwise start
+# converter_cli.py once per job. A pool of worker processes is started up
+# front and keeps the monomer library loaded; each request's lines are
+# deduplicated and sent to the pool in chunks. Only the standard library is
+# used.
+#
+#   POST /convert/<mode>          {"inputs": [...]} -> {"results": [...]}
+#   POST /convert/<mode>/stream   NDJSON in -> NDJSON out, one record per input, in order
+#   GET  /health
+#   GET  /metrics
+#
+# An input is a string, or {"input": ...}; map_to_helm also takes {"map": ..., "id": ...}.
+
+import argparse
+import asyncio
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+import json
+import os
+import time
+
+from batch import CONVERTERS, convert_chunk, init_worker, make_chunks
+from utils import get_library
+
+MAX_HEADER_LINES = 100
+# Seconds an idle keep-alive connection stays open
+IDLE_TIMEOUT = 60
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None, headers=()):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.headers = headers
+
+
+class LatencyWindow:
+    """The most recent request latencies, for percentiles"""
+
+    def __init__(self, size=10_000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {'count': self.count}
+        def percentile(p):
+            return round(ordered[min(int(p * len(ordered)), len(ordered) - 1)] * 1e3, 3)
+        return {'count': self.count, 'p50_ms': percentile(0.5), 'p90_ms': percentile(0.9),
+                'p99_ms': percentile(0.99), 'max_ms': round(ordered[-1] * 1e3, 3)}
+
+
+def input_line(mode, item):
+    """
+    Input: 'LL{d}PY{cyc:N-C}', {'input': ...} or, for map_to_helm, {'map': 'LL{d}PY{cyc:N-C}', 'id': 2}
+    (for smiles_to_helm, {'smiles': ..., 'id': 2})
+    Output: the line as batch.CONVERTERS expects it
+    """
+    if isinstance(item, dict):
+        if mode == 'map_to_helm' and 'map' in item:
+            return f"{item['map']},{item.get('id', '')}"
+        if mode == 'smiles_to_helm' and 'smiles' in item:
+            return f"{item['smiles']},{item.get('id', '')}"
+        item = item.get('input')
+    if not isinstance(item, str):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f'Input must be a string, got {item!r}')
+    return item.strip()
+
+
+def record(line, result, error):
+    return {'input': line, 'result': result, 'error': error}
+
+
+class ConversionService:
+    """
+    workers: worker processes, default os.cpu_count()
+    chunksize: lines handed to a worker at a time
+    max_concurrency: requests converting at once; others wait for a slot
+    max_waiting: requests allowed to wait for a slot before new ones get 503
+    max_queue: chunks queued on the pool before new requests get 503
+    max_body: largest accepted JSON request body in bytes
+    """
+
+    def __init__(self, workers=None, chunksize=64, max_concurrency=8, max_waiting=64,
+                 max_queue=4096, max_body=64 << 20):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.max_waiting = max_waiting
+        self.max_queue = max_queue
+        self.max_body = max_body
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.pool = None
+        self.queued = 0
+        self.active = 0
+        self.waiting = 0
+        self.requests = Counter()
+        self.lines = Counter()
+        self.latency = {}
+        self.started = time.time()
+
+    async def start(self):
+        get_library().load()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        # Start every worker now so the first requests do not pay for process and library start-up
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, convert_chunk, 'helm_to_map', [])
+                               for _ in range(self.workers)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    # Backpressure
+
+    def check_capacity(self):
+        if self.queued >= self.max_queue or self.waiting >= self.max_waiting:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, 'Server busy, retry later', [('Retry-After', '1')])
+
+    async def acquire(self):
+        self.check_capacity()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    def submit(self, mode, chunk):
+        loop = asyncio.get_running_loop()
+        self.queued += 1
+        future = loop.run_in_executor(self.pool, convert_chunk, mode, chunk)
+        future.add_done_callback(self._chunk_done)
+        return future
+
+    def _chunk_done(self, future):
+        self.queued -= 1
+
+    # Conversion
+
+    async def convert(self, mode, lines):
+        """(line, result, error) for each line, repeated lines converted once"""
+        distinct = list(dict.fromkeys(lines))
+        futures = [self.submit(mode, chunk) for chunk in make_chunks(distinct, self.chunksize)]
+        known = {}
+        for results in await asyncio.gather(*futures):
+            for idx, result, error in results:
+                known[distinct[idx]] = (result, error)
+        self.lines[mode] += len(lines)
+        return [(line, *known[line]) for line in lines]
+
+    async def handle_convert(self, request, writer, mode):
+        body = await request.read_body(self.max_body)
+        try:
+            inputs = json.loads(body)['inputs']
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Expected a JSON object {"inputs": [...]}')
+        if not isinstance(inputs, list):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, '"inputs" must be a list')
+        lines = [input_line(mode, item) for item in inputs]
+        await self.acquire()
+        try:
+            converted = await self.convert(mode, lines)
+        finally:
+            self.release()
+        await send_json(writer, HTTPStatus.OK, {'results': [record(*item) for item in converted]},
+                        request.keep_alive)
+
+    async def handle_stream(self, request, writer, mode):
+        await self.acquire()
+        try:
+            await send_head(writer, HTTPStatus.OK, 'application/x-ndjson', [('Transfer-Encoding', 'chunked')],
+                            request.keep_alive)
+            request.responded = True
+            # Reading stops while this many chunks are in flight, which pushes back on the client
+            window = deque()
+            batch = []
+            async for item in request.iter_ndjson():
+                try:
+                    batch.append(input_line(mode, item))
+                except HTTPError as e:
+                    batch.append(e)
+                if len(batch) == self.chunksize:
+                    window.append(self.stream_chunk(mode, batch))
+                    batch = []
+                    if len(window) >= self.workers * 2:
+                        await write_chunk(writer, await window.popleft())
+            if batch:
+                window.append(self.stream_chunk(mode, batch))
+            while window:
+                await write_chunk(writer, await window.popleft())
+            await write_chunk(writer, b'')
+        finally:
+            self.release()
+
+    def stream_chunk(self, mode, batch):
+        """Awaitable of the NDJSON bytes for a batch of lines; bad inputs carry their HTTPError"""
+        lines = [(idx, line) for idx, line in enumerate(batch) if not isinstance(line, HTTPError)]
+        future = self.submit(mode, lines)
+
+        async def encode():
+            results = {idx: (result, error) for idx, result, error in await future}
+            self.lines[mode] += len(batch)
+            out = []
+            for idx, line in enumerate(batch):
+                if isinstance(line, HTTPError):
+                    out.append(record(None, None, str(line)))
+                else:
+                    out.append(record(line, *results[idx]))
+            return ''.join(json.dumps(item) + '\n' for item in out).encode('utf-8')
+
+        return asyncio.ensure_future(encode())
+
+    # Status
+
+    def health(self):
+        return {'status': 'ok', 'workers': self.workers, 'library_hash': get_library().library_hash}
+
+    def metrics(self):
+        return {
+            'uptime_s': round(time.time() - self.started, 3),
+            'workers': self.workers,
+            'queue_depth': self.queued,
+            'active_requests': self.active,
+            'waiting_requests': self.waiting,
+            'requests': dict(self.requests),
+            'lines': dict(self.lines),
+            'latency': {endpoint: window.summary() for endpoint, window in self.latency.items()},
+        }
+
+    # HTTP
+
+    async def route(self, request, writer):
+        parts = request.path.strip('/').split('/')
+        if request.method == 'GET' and parts == ['health']:
+            return 'health', send_json(writer, HTTPStatus.OK, self.health(), request.keep_alive)
+        if request.method == 'GET' and parts == ['metrics']:
+            return 'metrics', send_json(writer, HTTPStatus.OK, self.metrics(), request.keep_alive)
+        if parts[0] == 'convert' and len(parts) in (2, 3) and parts[1] in CONVERTERS:
+            if request.method != 'POST':
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            if len(parts) == 2:
+                return parts[1], self.handle_convert(request, writer, parts[1])
+            if parts[2] == 'stream':
+                return f'{parts[1]}/stream', self.handle_stream(request, writer, parts[1])
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except HTTPError as e:
+                    self.requests[f'other {e.status.value}'] += 1
+                    await send_json(writer, e.status, {'error': str(e)}, False)
+                    break
+                if request is None:
+                    break
+                start = time.perf_counter()
+                endpoint = 'other'
+                try:
+                    endpoint, response = await self.route(request, writer)
+                    await response
+                    status = HTTPStatus.OK
+                except HTTPError as e:
+                    status = e.status
+                    if request.responded:
+                        break
+                    request.keep_alive = request.keep_alive and request.body_consumed
+                    await send_json(writer, e.status, {'error': str(e)}, request.keep_alive, e.headers)
+                self.requests[f'{endpoint} {status.value}'] += 1
+                self.latency.setdefault(endpoint, LatencyWindow()).add(time.perf_counter() - start)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class Request:
+    def __init__(self, method, path, headers, reader):
+        self.method = method
+        self.path = path.split('?', 1)[0]
+        self.headers = headers
+        self.reader = reader
+        self.keep_alive = headers.get('connection', '').lower() != 'close'
+        self.responded = False
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED, 'Chunked request bodies are not supported')
+        try:
+            self.remaining = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Bad Content-Length')
+
+    @property
+    def body_consumed(self):
+        return self.remaining == 0
+
+    async def read_body(self, limit):
+        if self.remaining > limit:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f'Body larger than {limit} bytes')
+        body = await self.reader.readexactly(self.remaining)
+        self.remaining = 0
+        return body
+
+    async def iter_ndjson(self):
+        while self.remaining > 0:
+            line = await self.reader.readline()
+            if not line:
+                raise asyncio.IncompleteReadError(line, self.remaining)
+            self.remaining -= len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Not JSON: take the raw line as the input
+                yield line.decode('utf-8', 'replace')
+
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Bad request line')
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return Request(method, path, headers, reader)
+
+
+async def send_head(writer, status, content_type, headers=(), keep_alive=True):
+    lines = [f'HTTP/1.1 {status.value} {status.phrase}', f'Content-Type: {content_type}',
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f'{name}: {value}' for name, value in headers]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    await writer.drain()
+
+
+async def send_json(writer, status, payload, keep_alive=True, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send_head(writer, status, 'application/json',
+                    [('Content-Length', str(len(body))), *headers], keep_alive)
+    writer.write(body)
+    await writer.drain()
+
+
+async def write_chunk(writer, data):
+    # An empty chunk ends a chunked response
+    writer.write(f'{len(data):X}\r\n'.encode('latin-1') + data + b'\r\n')
+    await writer.drain()
+
+
+async def serve(args):
+    service = ConversionService(args.workers, args.chunksize, args.max_concurrency,
+                                args.max_waiting, args.max_queue)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, args.host, args.port, limit=1 << 20)
+    print(f"Serving on http://{args.host}:{args.port} with {service.workers} workers", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HELM-MAP-SMILES conversion service")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=64, help="Lines handed to a worker at a time")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Requests converted at once")
+    parser.add_argument("--max-waiting", type=int, default=64, help="Requests waiting before 503")
+    parser.add_argument("--max-queue", type=int, default=4096, help="Chunks queued on the pool before 503")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
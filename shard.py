@@ -0,0 +1,142 @@
+##Shards
+# Splits one input file between several machines sharing a filesystem. Shard
+# i of N converts the lines starting in the i-th of N equal byte ranges; the
+# cut points are moved forward to the next line start by looking at the bytes
+# around them through a memory map, so the file is never read as a whole.
+# Each shard writes its own output and a '<output>.shard' file describing it,
+# which merge checks before joining the outputs back in input order.
+
+import json
+import mmap
+import os
+import shutil
+
+SHARD_SUFFIX = '.shard'
+# Modes writing no line for an input they cannot convert; every other mode writes one line per input
+SKIPPING_MODES = ('map_to_helm', 'smiles_to_helm')
+
+
+def parse_shard(text):
+    """
+    Input: '2/8'
+    Output: (2, 8), the 1-based shard number and the number of shards
+    """
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"--shard must look like i/N, e.g. 2/8, got {text!r}") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"--shard {text}: i must be between 1 and N")
+    return index, count
+
+
+def line_start(buffer, pos):
+    """Offset of the first line starting at or after pos"""
+    if pos <= 0:
+        return 0
+    newline = buffer.find(b'\n', pos - 1)
+    return len(buffer) if newline == -1 else newline + 1
+
+
+def shard_span(path, index, count):
+    """
+    Input: 'peptides.txt', 2, 8
+    Output: (start, end), the byte range of lines shard 2 of 8 converts; the spans of all shards
+    follow each other and cover the whole file
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return (line_start(buffer, size * (index - 1) // count),
+                line_start(buffer, size * index // count))
+
+
+def shard_info_path(output_path):
+    return output_path + SHARD_SUFFIX
+
+
+def write_shard_info(input_path, output_path, mode, shard, span, records, text=True):
+    """
+    Record what a finished shard converted next to its output
+    shard: (i, N) as from parse_shard; span: its (start, end) from shard_span
+    records: input lines converted; text: output is lines, not a molecule file
+    """
+    index, count = shard
+    info = {'input': os.path.abspath(input_path), 'input_size': os.path.getsize(input_path), 'mode': mode,
+            'shard': index, 'shards': count, 'start': span[0], 'end': span[1], 'records': records,
+            'output_size': os.path.getsize(output_path), 'output_lines': count_lines(output_path) if text else None}
+    with open(shard_info_path(output_path), 'w') as f:
+        json.dump(info, f, indent=1)
+
+
+def read_shard_info(output_path):
+    try:
+        with open(shard_info_path(output_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"{output_path} has no {SHARD_SUFFIX} file, was it written with --shard?") from None
+
+
+def count_lines(path):
+    count = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            count += block.count(b'\n')
+    return count
+
+
+def check_shards(paths):
+    """
+    Input: shard output paths, in any order
+    Output: (path, info) pairs in shard order; raises ValueError unless they are every shard of
+    one run, each complete and unchanged since it was written
+    """
+    if not paths:
+        raise ValueError("No shard outputs to merge")
+    shards = sorted(((path, read_shard_info(path)) for path in paths), key=lambda item: item[1]['shard'])
+    first = shards[0][1]
+    run = ('input', 'input_size', 'mode', 'shards')
+    for path, info in shards:
+        if any(info[key] != first[key] for key in run):
+            raise ValueError(f"{path} is from another run: {', '.join(f'{key}={info[key]}' for key in run)}")
+    numbers = [info['shard'] for path, info in shards]
+    if numbers != list(range(1, first['shards'] + 1)):
+        raise ValueError(f"Need shards 1-{first['shards']} once each, got {numbers}")
+    end = 0
+    for path, info in shards:
+        if info['start'] != end:
+            raise ValueError(f"{path} starts at byte {info['start']} of the input, not {end}")
+        end = info['end']
+        if os.path.getsize(path) != info['output_size']:
+            raise ValueError(f"{path} has {os.path.getsize(path)} bytes, its shard file records {info['output_size']}")
+        if info['output_lines'] is not None:
+            lines = count_lines(path)
+            if lines != info['output_lines']:
+                raise ValueError(f"{path} has {lines} lines, its shard file records {info['output_lines']}")
+            if info['mode'] not in SKIPPING_MODES and lines != info['records']:
+                raise ValueError(f"{path} has {lines} lines for {info['records']} input lines")
+    if end != first['input_size']:
+        raise ValueError(f"The shards cover {end} of {first['input_size']} input bytes")
+    return shards
+
+
+def merge_shards(paths, output_path):
+    """
+    Concatenate shard outputs in input order into output_path after check_shards
+    Output: (input lines, output lines or None for molecule files)
+    """
+    shards = check_shards(paths)
+    tmp_path = output_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as outfile:
+            for path, info in shards:
+                with open(path, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile, 1 << 20)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    records = sum(info['records'] for path, info in shards)
+    text = all(info['output_lines'] is not None for path, info in shards)
+    return records, sum(info['output_lines'] for path, info in shards) if text else None
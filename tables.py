@@ -0,0 +1,165 @@
+##Columnar batch I/O
+# Converts one column of a CSV, TSV or Parquet table and writes id, input,
+# result, status and error columns to a new table. The input is read and the
+# output written one chunk at a time (a Parquet row group, or rows_per_chunk
+# CSV rows), so the whole table is never held in memory. pandas is needed for
+# CSV/TSV and pyarrow for Parquet; both are imported on first use.
+
+from collections import deque
+import os
+
+from batch import convert_lines, needs_id
+from validator import check_map
+
+OUTPUT_COLUMNS = ['id', 'input', 'result', 'status', 'error']
+
+# status values
+OK = 'ok'
+FAILED = 'failed'
+ERROR = 'error'
+# How helm_to_map returns an exception instead of raising it
+ERROR_PREFIX = 'ERROR:'
+
+
+def table_format(path):
+    """'csv', 'tsv' or 'parquet', from the file extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.parquet', '.pq'):
+        return 'parquet'
+    if ext in ('.tsv', '.tab'):
+        return 'tsv'
+    if ext == '.csv':
+        return 'csv'
+    raise ValueError(f"Cannot tell the table format of '{path}', use .csv, .tsv or .parquet")
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet files need pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def read_chunks(path, columns, rows_per_chunk=65536):
+    """Yield {column: list of values} for the requested columns, one chunk at a time"""
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        pyarrow = import_pyarrow()
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        missing = [column for column in columns if column not in parquet_file.schema_arrow.names]
+        if missing:
+            raise KeyError(f"Column(s) {missing} not in {path}")
+        for group in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(group, columns=columns).to_pydict()
+    else:
+        import pandas as pd
+        reader = pd.read_csv(path, sep='\t' if fmt == 'tsv' else ',', usecols=columns, dtype=str,
+                             keep_default_na=False, chunksize=rows_per_chunk)
+        for frame in reader:
+            yield {column: frame[column].tolist() for column in columns}
+
+
+class TableWriter:
+    """Appends chunks of OUTPUT_COLUMNS to a CSV, TSV or Parquet file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = table_format(path)
+        self._writer = None
+        self._header = True
+
+    def write(self, chunk):
+        if self.format == 'parquet':
+            pyarrow = import_pyarrow()
+            schema = pyarrow.schema([(column, pyarrow.string()) for column in OUTPUT_COLUMNS])
+            table = pyarrow.Table.from_pydict(chunk, schema=schema)
+            if self._writer is None:
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, schema)
+            self._writer.write_table(table)
+        else:
+            import pandas as pd
+            frame = pd.DataFrame(chunk, columns=OUTPUT_COLUMNS)
+            frame.to_csv(self.path, sep='\t' if self.format == 'tsv' else ',', index=False,
+                         mode='w' if self._header else 'a', header=self._header)
+            self._header = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        elif self._header:
+            # No rows: still leave a table with the output columns
+            self.write({column: [] for column in OUTPUT_COLUMNS})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            self._writer.close()
+
+
+def status_of(mode, line, result, error):
+    """
+    (status, result, error) of one converted row; failed MAP lines get their validation reason
+    helm_to_map reports an exception as an 'ERROR: <message>' result, which becomes the error
+    """
+    if error is None and isinstance(result, str) and result.startswith(ERROR_PREFIX):
+        result, error = None, result[len(ERROR_PREFIX):].strip()
+    if error is not None:
+        return ERROR, None, error
+    if result is None or result == '':
+        if mode == 'map_to_smiles':
+            reason = check_map(line)
+            return FAILED, result, None if reason == 'ok' else reason
+        return FAILED, result, None
+    return OK, result, None
+
+
+def convert_table(input_path, output_path, mode, column, id_column=None, workers=None, chunksize=64,
+                  cache=None, rows_per_chunk=65536):
+    """
+    Convert `column` of a CSV/TSV/Parquet table and write OUTPUT_COLUMNS to output_path
+    id is taken from id_column, or is the 1-based row number; for map_to_helm and --targets it is also the peptide ID
+    Output: rows per status, e.g. {'ok': 98, 'failed': 2, 'error': 0}
+    """
+    columns = [column] if id_column is None or id_column == column else [column, id_column]
+    pending = deque()
+    row = 0
+
+    def lines():
+        nonlocal row
+        for chunk in read_chunks(input_path, columns, rows_per_chunk):
+            inputs = ['' if value is None else str(value).strip() for value in chunk[column]]
+            if not inputs:
+                continue
+            if id_column is None:
+                ids = [str(row + idx + 1) for idx in range(len(inputs))]
+            else:
+                ids = ['' if value is None else str(value) for value in chunk[id_column]]
+            row += len(inputs)
+            pending.append((ids, inputs))
+            for seq, ID in zip(inputs, ids):
+                yield f'{seq},{ID}' if needs_id(mode) else seq
+
+    counts = {OK: 0, FAILED: 0, ERROR: 0}
+    with TableWriter(output_path) as writer:
+        out = {name: [] for name in OUTPUT_COLUMNS}
+        for line, result, error in convert_lines(lines(), mode, workers, chunksize, cache):
+            ids, inputs = pending[0]
+            idx = len(out['id'])
+            status, result, error = status_of(mode, inputs[idx], result, error)
+            counts[status] += 1
+            out['id'].append(ids[idx])
+            out['input'].append(inputs[idx])
+            out['result'].append(result)
+            out['status'].append(status)
+            out['error'].append(error)
+            if len(out['id']) == len(ids):
+                writer.write(out)
+                pending.popleft()
+                out = {name: [] for name in OUTPUT_COLUMNS}
+    return counts
@@ -0,0 +1,30 @@
+from batch import convert_lines, init_worker, targets_mode
+from monomer_library import get_library
+from utils import fragment_cache, get_smi_from_map
+
+
+def test_init_worker_warms_fragments_when_asked(monkeypatch):
+    monkeypatch.setenv('MAP_WARM_FRAGMENTS', '1')
+    fragment_cache.clear()
+    init_worker()
+    assert fragment_cache.get(('L', frozenset({'R1', 'R2'}))) is not None
+    assert len(fragment_cache) >= len(get_library().monomers2r_groups_dict)
+
+
+def test_convert_lines_keeps_input_order():
+    lines = ['LPY{cyc:N-C}', 'AG', 'X', 'AG']
+    results = list(convert_lines(lines, 'map_to_smiles', workers=1))
+    assert [line for line, result, error in results] == lines
+    assert results[1][1] == results[3][1] is not None
+    assert results[2][1] is None
+
+
+def test_targets_match_separate_conversions():
+    lines = ['L{d}L{d}LL{d}PY{cyc:N-C},2', 'A{nnr:TLA}G,3', 'X,4']
+    mode = targets_mode('helm,smiles')
+    results = list(convert_lines(lines, mode, workers=1))
+    helm = [result for line, result, error in convert_lines(lines, 'map_to_helm', workers=1)]
+    smiles = [get_smi_from_map(line.split(',')[0]) for line in lines]
+    for (line, result, error), h, s in zip(results, helm, smiles):
+        expected = '\t'.join([h or '', s or ''])
+        assert result == (expected if h or s else None), line
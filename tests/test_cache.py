@@ -0,0 +1,58 @@
+import pytest
+
+import utils
+from cache import MISSING, LRUCache, ResultCache
+from utils import cached_conversion, open_result_cache, use_result_cache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    use_result_cache(cache)
+    yield cache
+    use_result_cache(None)
+    cache.close()
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+    assert 'b' not in lru and 'a' in lru and 'c' in lru
+    assert lru.stats()['evictions'] == 1
+
+
+def test_result_cache_persists(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    first = ResultCache(path, namespace='lib')
+    first.put_many('map_to_smiles', [('AG', 'smiles'), ('X', None)])
+    first.close()
+    second = ResultCache(path, namespace='lib')
+    assert second.get_many('map_to_smiles', ['AG', 'X', 'GA']) == {'AG': 'smiles', 'X': None}
+    assert ResultCache(path, namespace='other lib').get('map_to_smiles', 'AG') is MISSING
+
+
+def test_arguments_are_keyed_unambiguously(cache):
+    calls = []
+
+    @cached_conversion('pair')
+    def pair(first, second):
+        calls.append((first, second))
+        return f'{first}|{second}'
+
+    assert pair('A,1', '') == 'A,1|'
+    assert pair('A', '1,') == 'A|1,'
+    assert pair('A,1', '') == 'A,1|'
+    assert calls == [('A,1', ''), ('A', '1,')]
+
+
+def test_namespace_follows_converter_code(tmp_path, monkeypatch):
+    path = str(tmp_path / 'results.sqlite')
+    before = open_result_cache(path)
+    monkeypatch.setattr(utils, 'converter_code_hash', lambda: 'changed')
+    after = open_result_cache(path)
+    assert before.namespace != after.namespace
+    before.close()
+    after.close()
@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+import checkpoint
+import converter_cli
+from benchmarks.workloads import generate
+
+
+def convert(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['converter_cli.py', *argv])
+    converter_cli.main()
+
+
+def crash_after(count):
+    """convert_lines that gives count results, then fails as a killed run would"""
+    convert_lines = converter_cli.convert_lines
+
+    def crashing(*args, **kwargs):
+        for done, item in enumerate(convert_lines(*args, **kwargs)):
+            if done == count:
+                raise KeyboardInterrupt
+            yield item
+    return crashing
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    path = tmp_path / 'peptides.txt'
+    path.write_text('\n'.join(generate('head_to_tail', 10, 60)) + '\nX\n\nAG\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('fmt', ['smiles', 'pickle'])
+def test_resume_after_interrupted_run(monkeypatch, tmp_path, input_path, fmt):
+    expected = str(tmp_path / 'expected.out')
+    convert(monkeypatch, 'map_to_smiles', '--input', input_path, '--output', expected, '--workers', '1',
+            '--format', fmt)
+
+    output = str(tmp_path / 'resumed.out')
+    # A checkpoint after every line, and a crash with lines written past the last one
+    monkeypatch.setattr(checkpoint, 'CHECKPOINT_SECONDS', 0.0)
+    with monkeypatch.context() as patch:
+        patch.setattr(converter_cli, 'convert_lines', crash_after(25))
+        with pytest.raises(KeyboardInterrupt):
+            convert(monkeypatch, 'map_to_smiles', '--input', input_path, '--output', output, '--workers', '1',
+                    '--format', fmt, '--resume')
+    assert os.path.getsize(output) < os.path.getsize(expected)
+
+    convert(monkeypatch, 'map_to_smiles', '--input', input_path, '--output', output, '--workers', '1',
+            '--format', fmt, '--resume')
+    with open(expected, 'rb') as f, open(output, 'rb') as g:
+        assert f.read() == g.read()
+
+
+def test_changed_input_is_not_resumed(monkeypatch, tmp_path, input_path):
+    output = str(tmp_path / 'smiles.txt')
+    monkeypatch.setattr(checkpoint, 'CHECKPOINT_SECONDS', 0.0)
+    with monkeypatch.context() as patch:
+        patch.setattr(converter_cli, 'convert_lines', crash_after(10))
+        with pytest.raises(KeyboardInterrupt):
+            convert(monkeypatch, 'map_to_smiles', '--input', input_path, '--output', output, '--workers', '1',
+                    '--resume')
+    with open(input_path, 'r+') as f:
+        lines = f.readlines()
+        f.seek(0)
+        f.writelines(lines[1:])
+        f.truncate()
+    with pytest.raises(ValueError, match='has changed'):
+        convert(monkeypatch, 'map_to_smiles', '--input', input_path, '--output', output, '--workers', '1',
+                '--resume')
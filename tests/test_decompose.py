@@ -0,0 +1,23 @@
+from benchmarks.workloads import WORKLOADS, generate
+from decompose import smiles_to_helm_line, smiles_to_map
+from utils import get_smi_from_map
+
+
+def test_smiles_round_trip_through_map():
+    for workload in WORKLOADS:
+        for map_str in generate(workload, 8, 15):
+            smiles = get_smi_from_map(map_str)
+            assert smiles, map_str
+            # The MAP may differ (e.g. another rotation), the structure may not
+            assert get_smi_from_map(smiles_to_map(smiles)) == smiles, map_str
+
+
+def test_known_peptide():
+    smiles = get_smi_from_map('L{d}LL{d}PY')
+    assert smiles_to_map(smiles) == 'L{d}LL{d}PY'
+    assert smiles_to_helm_line(get_smi_from_map('AGL') + ',5') == 'PEPTIDE5{A.G.L}$$$$'
+
+
+def test_unmatched_smiles_give_none():
+    assert smiles_to_map('c1ccccc1') is None
+    assert smiles_to_map('not smiles') is None
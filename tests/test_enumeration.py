@@ -0,0 +1,33 @@
+import pytest
+
+from enumeration import enumerate_library, substitution_scan
+from utils import get_smi_from_map
+
+
+@pytest.mark.parametrize('spec', [
+    '[A|G]L[P|P{d}]Y{cyc:N-C}',
+    '[A|G]',
+    '[A|G]{cyc:N-C}',
+    'G[A|{nt:ACE}]L',
+    '[A|{nt:ACE}|G][{nt:ACE}|L]',
+])
+def test_enumerate_library_matches_get_smi_from_map(spec):
+    products = list(enumerate_library(spec))
+    assert products
+    for map_str, smiles in products:
+        assert smiles == get_smi_from_map(map_str), map_str
+
+
+def test_choice_lacking_an_r_group_only_fails_its_products():
+    # {nt:ACE} has no R1: a second one, after the first, cannot be linked
+    products = dict(enumerate_library('[A|{nt:ACE}|G][{nt:ACE}|L]L'))
+    assert len(products) == 6
+    assert products['A{nt:ACE}L'] is not None
+    assert products['{nt:ACE}{nt:ACE}L'] is None
+    assert products['GLL'] is not None
+
+
+@pytest.mark.parametrize('parent', ['GAL', 'G{nt:ACE}AL', 'LPYA{cyc:N-C}'])
+def test_substitution_scan_matches_get_smi_from_map(parent):
+    for map_str, smiles in substitution_scan(parent, 'A|{nt:ACE}|G|P{d}'):
+        assert smiles == get_smi_from_map(map_str), map_str
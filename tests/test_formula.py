@@ -0,0 +1,43 @@
+import pytest
+from rdkit import Chem
+from rdkit.Chem import Descriptors
+from rdkit.Chem.rdMolDescriptors import CalcMolFormula
+
+from benchmarks.workloads import WORKLOADS, generate
+from formula import peptide_formula
+from utils import get_smi_from_map, parse_map
+from validator import MapValidationError, validate_parts
+
+
+def rdkit_formula(map_str):
+    mol = Chem.MolFromSmiles(get_smi_from_map(map_str))
+    return CalcMolFormula(mol), Descriptors.MolWt(mol), Descriptors.ExactMolWt(mol)
+
+
+def test_reported_drift():
+    map_str = '{nnr:DOS}G{nnm:NXE}M{nnr:MO4}{nnr:M31}E{nnr:LOS}A{nnm:3CP}{cyc:6-7}'
+    parsed = parse_map(map_str)
+    formula = peptide_formula(*validate_parts(parsed.sequence, parsed.linker, parsed.spans))
+    assert f'{formula.monoisotopic:.4f}' == '1180.4902'
+    assert formula.monoisotopic == pytest.approx(rdkit_formula(map_str)[2], abs=1e-9)
+
+
+@pytest.mark.parametrize('workload', WORKLOADS)
+def test_formula_matches_rdkit_on_workload(workload):
+    checked = 0
+    for map_str in generate(workload, 20, 40):
+        parsed = parse_map(map_str)
+        try:
+            parts = validate_parts(parsed.sequence, parsed.linker, parsed.spans)
+        except MapValidationError:
+            continue
+        formula = peptide_formula(*parts)
+        if formula is None or get_smi_from_map(map_str) is None:
+            assert formula is None and get_smi_from_map(map_str) is None, map_str
+            continue
+        expected, average, monoisotopic = rdkit_formula(map_str)
+        assert formula.formula == expected, map_str
+        assert formula.average == pytest.approx(average, abs=1e-9), map_str
+        assert formula.monoisotopic == pytest.approx(monoisotopic, abs=1e-9), map_str
+        checked += 1
+    assert checked
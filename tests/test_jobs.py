@@ -0,0 +1,29 @@
+import gc
+import os
+import time
+
+from jobs import JOB_WORKERS, ConversionJob
+
+
+def test_job_workers_are_bounded():
+    job = ConversionJob('helm_to_map', [])
+    assert 1 <= job.workers <= JOB_WORKERS
+    job.remove()
+
+
+def test_remove_deletes_output():
+    job = ConversionJob('helm_to_map', ['PEPTIDE1{A.G}$$$$'], total=1, workers=1).start()
+    job.remove()
+    assert job.finished
+    assert not os.path.exists(job.output_path)
+
+
+def test_dropped_job_deletes_output():
+    job = ConversionJob('helm_to_map', ['PEPTIDE1{A.G}$$$$'], total=1, workers=1).start()
+    while not job.finished:
+        time.sleep(0.01)
+    path = job.output_path
+    assert os.path.exists(path)
+    del job
+    gc.collect()
+    assert not os.path.exists(path)
@@ -0,0 +1,22 @@
+from utils import get_library, helm_to_map, map_to_helm
+
+
+def test_duplicate_denotation_resolves_to_last_row():
+    # {nnr:TLA} is listed twice in the library CSV; like the original pandas table, the last row wins
+    assert get_library().map_to_helm_dict['{nnr:TLA}'] == 'Ala(5-Tet)'
+    assert map_to_helm('A{nnr:TLA}G', '1') == 'PEPTIDE1{A.[Ala(5-Tet)].G}$$$$'
+
+
+def test_duplicate_denotation_symbols_map_back():
+    assert helm_to_map('PEPTIDE1{A.[Ala(5-Tet)].G}$$$$') == 'A{nnr:TLA}G'
+    assert helm_to_map('PEPTIDE1{A.[Me_Ala(indol-2-yl)].G}$$$$') == 'A{nnr:TLA}G'
+
+
+def test_smiles_to_map_uses_the_same_denotation():
+    from decompose import smiles_to_map
+    from utils import get_smi_from_map
+
+    # The tetrazole of Ala(5-Tet), not the indole of the earlier {nnr:TLA} row
+    smiles = get_smi_from_map('A{nnr:TLA}G')
+    assert 'nnn[nH]' in smiles
+    assert smiles_to_map(smiles) == 'A{nnr:TLA}G'
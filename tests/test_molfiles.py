@@ -0,0 +1,35 @@
+import sys
+
+from rdkit import Chem
+
+import converter_cli
+from molfiles import read_pickled_mols
+from utils import get_smi_from_map
+
+LINES = ['L{d}L{d}LL{d}PY{cyc:N-C},cyclo', 'AGL,linear', 'X,bad', 'LPYA']
+
+
+def convert(monkeypatch, tmp_path, fmt):
+    source = tmp_path / 'peptides.txt'
+    source.write_text('\n'.join(LINES) + '\n')
+    output = str(tmp_path / f'peptides.{fmt}')
+    monkeypatch.setattr(sys, 'argv', ['converter_cli.py', 'map_to_smiles', '--input', str(source),
+                                      '--output', output, '--format', fmt, '--workers', '1'])
+    converter_cli.main()
+    return output
+
+
+def expected():
+    return [('cyclo', get_smi_from_map('L{d}L{d}LL{d}PY{cyc:N-C}')), ('linear', get_smi_from_map('AGL')),
+            ('4', get_smi_from_map('LPYA'))]
+
+
+def test_pickle_records(monkeypatch, tmp_path):
+    mols = list(read_pickled_mols(convert(monkeypatch, tmp_path, 'pickle')))
+    assert [(mol.GetProp('_Name'), Chem.MolToSmiles(mol)) for mol in mols] == expected()
+
+
+def test_sdf_records_keep_stereo(monkeypatch, tmp_path):
+    mols = list(Chem.SDMolSupplier(convert(monkeypatch, tmp_path, 'sdf')))
+    assert [(mol.GetProp('_Name'), Chem.MolToSmiles(mol)) for mol in mols] == expected()
+    assert all(mol.GetNumConformers() == 1 for mol in mols)
@@ -0,0 +1,37 @@
+import random
+
+from benchmarks.workloads import generate
+from rotation import canonical_map, least_rotation
+from utils import get_smi_from_map, parse_map
+
+
+def brute_force_least_rotation(items):
+    rotations = [items[k:] + items[:k] for k in range(len(items))]
+    return rotations.index(min(rotations))
+
+
+def rotations_of(map_str):
+    parsed = parse_map(map_str)
+    tokens = [parsed.sequence[start:end] for start, end, symbol in parsed.spans]
+    return [''.join(tokens[k:] + tokens[:k]) + parsed.linker for k in range(len(tokens))]
+
+
+def test_booth_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(2000):
+        # Few distinct items, so repeats and ties are common
+        items = [rng.choice('ABC') for _ in range(rng.randint(1, 12))]
+        assert least_rotation(items) == brute_force_least_rotation(items), items
+    assert least_rotation(['L{d}', 'L', 'L{d}', 'P', 'Y', 'L{d}']) == 1
+
+
+def test_rotations_share_one_canonical_sequence():
+    for map_str in generate('head_to_tail', 8, 20):
+        canonical = {canonical_map(rotation) for rotation in rotations_of(map_str)}
+        assert len(canonical) == 1, map_str
+        assert get_smi_from_map(canonical.pop()) == get_smi_from_map(map_str)
+
+
+def test_other_peptides_are_unchanged():
+    for map_str in ('L{d}LL{d}PY', 'L{d}LL{d}PY{cyc:2-5}', '{nt:ACE}LL{d}PY{cyc:N-C}'):
+        assert canonical_map(map_str) == map_str
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import urllib.error
+import urllib.request
+
+from service import ConversionService
+from utils import get_smi_from_map, map_to_helm
+
+INPUTS = ['L{d}L{d}LL{d}PY{cyc:N-C}', 'AGL', 'X', 'AGL']
+
+
+def post(url, body, content_type='application/json'):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.status, response.read()
+
+
+def with_service(requests):
+    """Start a one-worker service on a free port, run requests(base_url) on a thread, return its result"""
+    async def run():
+        service = ConversionService(workers=1)
+        await service.start()
+        server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            async with server:
+                return await asyncio.get_running_loop().run_in_executor(None, requests, f'http://127.0.0.1:{port}')
+        finally:
+            service.close()
+    return asyncio.run(run())
+
+
+def test_convert_and_stream():
+    def requests(base):
+        return (post(f'{base}/convert/map_to_smiles', json.dumps({'inputs': INPUTS}).encode()),
+                post(f'{base}/convert/map_to_helm/stream',
+                     b'{"map": "AGL", "id": 7}\n"L{d}L{d}LL{d}PY{cyc:N-C},2"\n', 'application/x-ndjson'),
+                post(f'{base}/convert/unknown', b'{}'),
+                get(f'{base}/health'))
+
+    converted, streamed, unknown, health = with_service(requests)
+    assert converted[0] == 200
+    assert json.loads(converted[1])['results'] == [{'input': line, 'result': get_smi_from_map(line), 'error': None}
+                                                   for line in INPUTS]
+    assert streamed[0] == 200
+    records = [json.loads(line) for line in streamed[1].decode().splitlines()]
+    assert [record['result'] for record in records] == [map_to_helm('AGL', '7'),
+                                                       map_to_helm('L{d}L{d}LL{d}PY{cyc:N-C}', '2')]
+    assert unknown[0] == 404
+    assert json.loads(health[1])['workers'] == 1
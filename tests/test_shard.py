@@ -0,0 +1,58 @@
+import sys
+
+import pytest
+
+import converter_cli
+from benchmarks.workloads import generate
+from shard import shard_span
+
+
+def convert(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['converter_cli.py', *argv])
+    converter_cli.main()
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    lines = [f'{map_str},p{idx}' for idx, map_str in enumerate(generate('side_chain', 10, 40))]
+    lines[5:5] = ['', 'X,bad', '']
+    path = tmp_path / 'peptides.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_spans_cover_the_file(input_path):
+    data = read(input_path)
+    spans = [shard_span(input_path, index, 5) for index in range(1, 6)]
+    assert spans[0][0] == 0 and spans[-1][1] == len(data)
+    for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+        assert end == next_start
+        assert data[end - 1:end] == b'\n'
+
+
+@pytest.mark.parametrize('mode, fmt, count', [('map_to_smiles', 'smiles', 3), ('map_to_helm', 'smiles', 4),
+                                              ('validate', 'smiles', 50), ('map_to_smiles', 'pickle', 3)])
+def test_merged_shards_equal_a_single_run(monkeypatch, tmp_path, input_path, mode, fmt, count):
+    single = str(tmp_path / 'single.out')
+    convert(monkeypatch, mode, '--input', input_path, '--output', single, '--workers', '1', '--format', fmt)
+    parts = [str(tmp_path / f'part{index}.out') for index in range(1, count + 1)]
+    for index, part in enumerate(parts, 1):
+        convert(monkeypatch, mode, '--input', input_path, '--output', part, '--workers', '1', '--format', fmt,
+                '--shard', f'{index}/{count}')
+    merged = str(tmp_path / 'merged.out')
+    convert(monkeypatch, 'merge', '--input', ','.join(reversed(parts)), '--output', merged)
+    assert read(merged) == read(single)
+
+
+def test_merge_needs_every_shard(monkeypatch, tmp_path, input_path):
+    parts = [str(tmp_path / f'part{index}.out') for index in (1, 2)]
+    for index, part in enumerate(parts, 1):
+        convert(monkeypatch, 'map_to_smiles', '--input', input_path, '--output', part, '--workers', '1',
+                '--shard', f'{index}/3')
+    with pytest.raises(ValueError, match='Need shards 1-3'):
+        convert(monkeypatch, 'merge', '--input', ','.join(parts), '--output', str(tmp_path / 'merged.out'))
@@ -0,0 +1,17 @@
+from tables import convert_table, read_chunks
+
+
+def test_helm_to_map_exception_is_an_error_row(tmp_path):
+    # HELM contains commas, so the column is quoted; the second row has a bad connection
+    source = tmp_path / 'peptides.csv'
+    source.write_text('name,helm\n'
+                      'good,"PEPTIDE1{A.[Ala(5-Tet)].G}$$$$"\n'
+                      'bad,"PEPTIDE1{A.G}$PEPTIDE1,PEPTIDE1,x:R1-2:R2$$$"\n')
+    output = tmp_path / 'maps.csv'
+    counts = convert_table(str(source), str(output), 'helm_to_map', 'helm', id_column='name', workers=1)
+    assert counts == {'ok': 1, 'failed': 0, 'error': 1}
+    rows = next(read_chunks(str(output), ['id', 'result', 'status', 'error']))
+    assert rows['id'] == ['good', 'bad']
+    assert rows['result'] == ['A{nnr:TLA}G', '']
+    assert rows['status'] == ['ok', 'error']
+    assert rows['error'] == ['', "invalid literal for int() with base 10: 'x'"]
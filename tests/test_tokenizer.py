@@ -0,0 +1,41 @@
+import random
+
+from benchmarks.workloads import WORKLOADS, generate
+from map_tokenizer import MapTokenizer
+from monomer_library import get_library
+
+
+def first_match_tokens(linear_seq, map_to_helm_dict):
+    # The original tokenizer: the first denotation, in descending order, the rest of the string starts with
+    tokens = []
+    i = 0
+    while i < len(linear_seq):
+        for key in map_to_helm_dict:
+            if linear_seq[i:].startswith(key):
+                tokens.append(map_to_helm_dict[key])
+                i += len(key)
+                break
+        else:
+            tokens.append(linear_seq[i])
+            i += 1
+    return tokens
+
+
+def test_longest_match():
+    tokenizer = MapTokenizer({'L': 'L', 'L{d}': 'dL', 'P': 'P'})
+    assert tokenizer.tokenize('L{d}LP?') == ['dL', 'L', 'P', '?']
+    assert tokenizer.scan('L{d}P?') == [(0, 4, 'dL'), (4, 5, 'P'), (5, 6, None)]
+    assert tokenizer.match('L{x}') == (1, 'L')
+
+
+def test_same_tokens_as_first_match_scan():
+    library = get_library()
+    sequences = [map_str for workload in WORKLOADS for map_str in generate(workload, 12, 50)]
+    denotations = list(library.map_to_helm_dict)
+    rng = random.Random(0)
+    # Fragments of denotations and stray characters, where prefixes of longer keys decide the match
+    for _ in range(200):
+        sequences.append(''.join(rng.choice(denotations)[:rng.randint(1, 6)] + rng.choice(['', '{', '}', 'd', ':'])
+                                 for _ in range(8)))
+    for sequence in sequences:
+        assert library.tokenizer.tokenize(sequence) == first_match_tokens(sequence, library.map_to_helm_dict), sequence
@@ -0,0 +1,21 @@
+from utils import get_smi_from_map
+from validator import check_map
+
+
+def test_single_monomer_is_rejected():
+    for map_str in ('A', '{nt:ACE}'):
+        assert check_map(map_str).startswith('single_monomer:')
+        assert get_smi_from_map(map_str) is None
+
+
+def test_single_monomer_with_cyclic_link_is_valid():
+    assert check_map('A{cyc:N-C}') == 'ok'
+    assert get_smi_from_map('A{cyc:N-C}') is not None
+
+
+def test_unknown_token():
+    assert check_map('AXG') == "unknown_token: Unknown token 'X' at position 1"
+
+
+def test_valid_sequence():
+    assert check_map('L{d}L{d}LL{d}PY{cyc:N-C}') == 'ok'
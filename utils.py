@@ -1,12 +1,89 @@
-from rdkit import Chem
+from rdkit import Chem, RDLogger, rdBase
+from collections import namedtuple
 import re
-import copy
-import pandas as pd
+import functools
+import hashlib
+import os
 import warnings
+from monomer_library import get_library
+from assembly import parse_fragment, assemble_peptide
+from cache import LRUCache, ResultCache, MISSING
+from formula import format_formula, peptide_formula
+from profiling import profiler
+from validator import MapValidationError, validate_parts
 
 warnings.filterwarnings('ignore')
 
-df_monomers = pd.read_csv('data/MAP_momomers_library_new.csv')
+# Library tables that used to be built here at import time, now loaded on first use
+_LIBRARY_ATTRIBUTES = {
+    'monomers2smi_dict': 'monomers2smi_dict',
+    'monomers2r_groups_dict': 'monomers2r_groups_dict',
+    'map_to_helm_dict': 'map_to_helm_dict',
+    'helm_to_map_dict': 'helm_to_map_dict',
+    'map_tokenizer': 'tokenizer',
+}
+
+def __getattr__(name):
+    if name in ('df_monomers', 'df2'):
+        return get_library().dataframe()
+    if name in _LIBRARY_ATTRIBUTES:
+        return getattr(get_library(), _LIBRARY_ATTRIBUTES[name])
+    raise AttributeError(f"module 'utils' has no attribute '{name}'")
+
+# Optional on-disk cache consulted by get_smi_from_map, helm_to_map and map_to_helm
+result_cache = None
+
+def use_result_cache(cache):
+    """Install a ResultCache for the conversion functions, or None to turn caching off"""
+    global result_cache
+    result_cache = cache
+
+# Modules whose code decides a cached result
+CONVERTER_MODULES = ('assembly', 'batch', 'decompose', 'formula', 'map_tokenizer', 'monomer_library',
+                     'rotation', 'utils', 'validator')
+
+@functools.lru_cache(maxsize=None)
+def converter_code_hash():
+    """sha256 of the converter modules' source, so changed converters never serve old results"""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in CONVERTER_MODULES:
+        with open(os.path.join(directory, f'{name}.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def open_result_cache(path, **kwargs):
+    """ResultCache at path, namespaced by the monomer library content, the converter code and RDKit version"""
+    library = get_library()
+    library.load()
+    namespace = f'{library.library_hash}:{converter_code_hash()[:16]}:{rdBase.rdkitVersion}'
+    return ResultCache(path, namespace=namespace, **kwargs)
+
+def cached_conversion(mode):
+    """
+    Serve a conversion from result_cache when one is installed
+    A single argument is the key, as for the batch lines of the mode; several arguments are keyed
+    by the repr of their tuple under '<mode>:args', which no other arguments or line can match
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            if result_cache is None:
+                return func(*args)
+            if len(args) == 1:
+                key_mode, text = mode, args[0]
+            else:
+                key_mode, text = f'{mode}:args', repr(args)
+            result = result_cache.get(key_mode, text)
+            if result is MISSING:
+                profiler.count('result_cache_miss')
+                result = func(*args)
+                result_cache.put(key_mode, text, result)
+            else:
+                profiler.count('result_cache_hit')
+            return result
+        return wrapper
+    return decorator
 
 # Copyright (c) 2021-2024 Charles Xu and others
 #
@@ -87,41 +164,6 @@ def get_smi_from_cxsmiles(cxsmiles):
 
     return smi.strip()
 
-def get_cxsmiles_from_smi(smi):
-    """
-    Get CXSMILES from SMILES
-    Input: 'CCCC[C@H](N(C)[*:_R1])C([*:_R2])=O'
-    Output: 'CCCC[C@H](N(C)[*])C([*])=O|$;;;;;;;_R1;;_R2;$|'
-    """
-    cxsmiles = smi
-    # Get all labels with pattern [*:label]
-    labels = re.findall(r'\[\*\:(.*?)\]', smi)
-    r_groups = []
-    for label in labels:
-        # Replace [*:label] with [*]
-        cxsmiles = cxsmiles.replace(f'[*:{label}]', '[*]')
-        r_groups.append(f'{label}')     # Record label to r_groups list
-
-    pos = list()
-    r_group_idx = 0
-    # Iterate through the SMILES and add ';'s in pos
-    for i in range(len(cxsmiles)):
-        if cxsmiles[i] in ('H', '@', '[', ']', '(', ')', '=', '-', '#', ':', '+',
-                           '1', '2', '3', '4', '5', '6', '7', '8', '9', '0', '/', '\\',
-                           'l', 'r'):  # 'l' for Cl, 'r' for 'Br'
-            # print(cxsmiles[i])
-            continue
-        elif cxsmiles[i] == '*':
-            if r_group_idx >= len(r_groups):
-                raise Exception(
-                    f'Erorr in converting SMILES to CXSMILES, {smi}')
-            pos.append(f"{r_groups[r_group_idx]}")
-            r_group_idx += 1
-        else:
-            pos.append('')
-    pos = '|$' + ';'.join(pos) + '$|'
-    return f'{cxsmiles} {pos}'
-
 def combine_monomer_unused_rgroup(smi, r_group):
     """ 
     Combine two molecules with unused R groups
@@ -153,96 +195,6 @@ def replace_unused_r_groups(mol_smi, r_groups: dict, used_r_groups: list):
     # logger.debug(f"after replace unused r group mol_smi: {mol_smi}")
     return relabel_rgroup2label(mol_smi)
 
-def clean_dummy_labels_in_cxsmiles(smi):
-    """
-    Clean dummy labels in cxsmiles
-    Input: '*C(=O)[C@@H]1CCCN1C(C)=O |$_R2;;;;;;;;;;$,atomProp:0.dummyLabel.*|'
-    Output: '[*]C(=O)[C@@H]1CCCN1C(C)=O |$_R2;;;;;;;;;;$|'
-    """
-    smi_parts = smi.split('|')
-    # logger.info(smi_parts)
-    smi = smi_parts[0].replace('*', '[*]') + '|$' + \
-        smi_parts[1].split('$')[1] + '$|'
-    return smi
-def combine_fragments(smi1, smi2):
-    # logger.info(f"Combine {smi1} and {smi2}...")
-
-    m1 = Chem.MolFromSmiles(get_cxsmiles_from_smi(smi1))
-    m2 = Chem.MolFromSmiles(get_cxsmiles_from_smi(smi2))
-
-    for atm in m1.GetAtoms():
-        if atm.HasProp("atomLabel") and atm.GetProp("atomLabel") == "_R2":
-            atm.SetAtomMapNum(10)  # Use 10 as the atom map number
-    for atm in m2.GetAtoms():
-        if atm.HasProp("atomLabel") and atm.GetProp("atomLabel") == "_R1":
-            atm.SetAtomMapNum(10)  # Use 10 as the atom map number
-    mol = Chem.molzip(m1, m2)
-
-    smi = Chem.MolToCXSmiles(mol)
-    
-    if '|' in smi:
-        # logger.info(smi)
-        smi = get_smi_from_cxsmiles(clean_dummy_labels_in_cxsmiles(smi))
-    # logger.info(f"Combined smiles: {smi}")
-    return smi
-
-def get_linear_peptide(monomer_smis):
-    """Get linear peptide from monomers"""
-
-    for idx, monomer in enumerate(monomer_smis):
-        if idx == 0:
-            smi = monomer
-        else:
-            smi = combine_fragments(smi, monomer)
-    return smi
-
-def connect_mapped_atoms(smi, end1, end2):
-    ''' 
-        smi: smiles contain the two merge ends, e.g. '[*:3]O[C@H](C)[C@H](NC(=O)[C@@H](CC(C)C)N(C)C(=O)[C@@H]1CCCN1C(C)=O)C(=O)N(C)[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N(C)[C@@H](C)C(=O)N[C@H](CC(C)C)C(=O)N1CCC[C@@H]1C([*:2])=O'
-        end1: atom map number of the first end, e.g. 3
-        end2: atom map number of the second end, e.g. 2
-
-        Note: this will not get atomic stereochemistry right
-    '''
-    res = Chem.RWMol(Chem.MolFromSmiles(smi))
-
-    dummy1 = None
-    dummy2 = None
-
-    for atom in res.GetAtoms():
-        if atom.GetAtomMapNum() == end1:
-            dummy1 = atom
-        elif atom.GetAtomMapNum() == end2:
-            dummy2 = atom
-
-    assert dummy1 is not None and dummy2 is not None
-    assert dummy1.GetDegree() == 1
-    assert dummy2.GetDegree() == 1
-
-    nbr1 = dummy1.GetNeighbors()[0]
-    nbr2 = dummy2.GetNeighbors()[0]
-
-    res.BeginBatchEdit()
-    res.RemoveAtom(dummy1.GetIdx())
-    res.RemoveAtom(dummy2.GetIdx())
-
-    res.AddBond(nbr1.GetIdx(), nbr2.GetIdx(), Chem.BondType.SINGLE)
-    res.CommitBatchEdit()
-    return Chem.MolToSmiles(res)
-
-def cyclize_linpep_from_smi(smi, link):
-    """
-    Cyclize a peptide through a link, through definiting a user-defined reaction
-    smi: SMILES of a linear peptide, e.g. '[*:_R3]O[C@H](C)[C@H](NC(=O)[C@@H](CC(C)C)N(C)C(=O)[C@@H]1CCCN1C(C)=O)C(=O)N(C)[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N[C@@H](CC(C)C)C(=O)N(C)[C@@H](C)C(=O)N[C@H](CC(C)C)C(=O)N1CCC[C@@H]1C([*:_R2])=O'
-    link: the link between the two ends, e.g. '4:R3-10:R2', what if '4:R3-14:R3'
-    """
-    smi = relabel_rgroup2index(smi) # *:_R3 -> *:3
-    link = link.split('-')
-    start, end = (int(end.split(':')[1][1:]) for end in link) # 3, 3
-    if end == start: end = end + 1 # 3, 3 -> 3, 4
-    smi = connect_mapped_atoms(smi, start, end)
-    return smi
-
 def get_links_between_monomers(monomer_smis, cyclic_link=None):
     monomer_links = {}
 
@@ -276,62 +228,69 @@ def get_links_between_monomers(monomer_smis, cyclic_link=None):
 
     return monomer_links
 
-def restore_unused_rgroup(monomer_smis, monomer_r_groups, monomer_links):
-    # Replace unused R groups with default _R1, _R2, _R3
-    for idx, mol_cxsmi in enumerate(monomer_smis):
-        # logger.debug(f"mol_cxsmi: {mol_cxsmi}")
-        r_groups = monomer_r_groups[idx]
-        used_r_groups = [r_group[1:] for r_group in list(monomer_links[idx].keys())]
-        # logger.debug(f"used_r_groups: {used_r_groups}, r_groups: {r_groups}")
-        mol_smi = replace_unused_r_groups(mol_cxsmi, r_groups, used_r_groups)
-        # logger.debug(f"after replace rgroup mol_smi: {mol_smi}")
-        monomer_smis[idx] = mol_smi
-    return monomer_smis
-
-
-monomers2smi_dict = {}
-monomers2r_groups_dict = {}
-for index, row in df_monomers.iterrows():
-    smi = get_smi_from_cxsmiles(row['CXSMILES'])
-    monomers2smi_dict[row['Symbol']] = smi
-    monomers2r_groups_dict[row['Symbol']] = {}
-    for r_group in ['R1', 'R2', 'R3']:
-        if row[r_group] != '-':
-            monomers2r_groups_dict[row['Symbol']][r_group] = row[r_group]
+# Capped monomer templates keyed by (Symbol, used R groups)
+fragment_cache = LRUCache(maxsize=4096)
 
-def cyclize_linpep_from_map(monomer_list, cyclic_link):
-    # default monomers with R group denoted by R1, R2, R3
-    monomer_smis = [copy.deepcopy(monomers2smi_dict[monomer]) for monomer in monomer_list]
-    # Default R groups if no linker
-    monomer_r_groups = [copy.deepcopy(monomers2r_groups_dict[monomer]) for monomer in monomer_list]
-    
-    monomer_links = get_links_between_monomers(monomer_smis, cyclic_link)
-    
-    monomer_smis = restore_unused_rgroup(monomer_smis, monomer_r_groups, monomer_links)
+def get_capped_fragment(monomer, used_r_groups):
+    """
+    Template molecule of a monomer with its unused R groups capped
+    monomer: Symbol, e.g. 'L'
+    used_r_groups: R groups taking part in a link, e.g. ['R1', 'R2']
+    """
+    key = (monomer, frozenset(used_r_groups))
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        profiler.count('fragment_cache_miss')
+        library = get_library()
+        # Decoding the library's prebuilt template is far cheaper than capping the SMILES again
+        fragment = library.templates.fragment(*key)
+        if fragment is None:
+            mol_smi = replace_unused_r_groups(library.monomers2smi_dict[monomer],
+                                              library.monomers2r_groups_dict[monomer], key[1])
+            fragment = parse_fragment(mol_smi)
+        fragment_cache.put(key, fragment)
+    else:
+        profiler.count('fragment_cache_hit')
+    return fragment
 
-    # Merge the monomers one by one into a linear peptide
-    pep_smi = get_linear_peptide(monomer_smis)
-    
-    if cyclic_link: # Cyclize the linear peptide
-        pep_smi = cyclize_linpep_from_smi(pep_smi, cyclic_link)
+def warm_fragment_cache(monomers=None):
+    """Fill fragment_cache for every combination of used R groups of the given (default: all) monomers"""
+    library = get_library()
+    RDLogger.DisableLog('rdApp.*')
+    try:
+        for monomer in library.monomers2r_groups_dict if monomers is None else monomers:
+            r_groups = list(library.monomers2r_groups_dict[monomer])
+            for mask in range(1 << len(r_groups)):
+                used_r_groups = [r_group for bit, r_group in enumerate(r_groups) if mask >> bit & 1]
+                try:
+                    get_capped_fragment(monomer, used_r_groups)
+                except Exception:
+                    pass
+    finally:
+        RDLogger.EnableLog('rdApp.*')
+
+def get_capped_fragments(monomer_list, monomer_links):
+    return [get_capped_fragment(monomer, [r_group[1:] for r_group in monomer_links[idx]])
+            for idx, monomer in enumerate(monomer_list)]
+
+def build_peptide_mol(monomer_list, cyclic_link=None):
+    """Assembled RDKit molecule for a list of monomer Symbols and an optional link, e.g. '4:R3-10:R2'"""
+    monomer_links = get_links_between_monomers(monomer_list, cyclic_link)
+    with profiler.stage('cap_fragments'):
+        fragments = get_capped_fragments(monomer_list, monomer_links)
+    # Link all monomers, and the cyclic link, in one molecule
+    with profiler.stage('assemble'):
+        return assemble_peptide(fragments, cyclic_link)
 
-    return pep_smi
+def cyclize_linpep_from_map(monomer_list, cyclic_link):
+    mol = build_peptide_mol(monomer_list, cyclic_link)
+    with profiler.stage('canonicalize'):
+        return Chem.MolToSmiles(mol)
 
 def linpep_from_map(monomer_list):
-    # default monomers with R group denoted by R1, R2, R3
-    monomer_smis = [copy.deepcopy(monomers2smi_dict[monomer]) for monomer in monomer_list]
-    # Default R groups if no linker
-    monomer_r_groups = [copy.deepcopy(monomers2r_groups_dict[monomer]) for monomer in monomer_list]
-    
-    monomer_links = get_links_between_monomers(monomer_smis, cyclic_link=None)
-    
-    monomer_smis = restore_unused_rgroup(monomer_smis, monomer_r_groups, monomer_links)
-
-    # Merge the monomers one by one into a linear peptide
-    pep_smi = get_linear_peptide(monomer_smis)
-
-    return pep_smi
-
+    mol = build_peptide_mol(monomer_list)
+    with profiler.stage('canonicalize'):
+        return Chem.MolToSmiles(mol)
 
 def extract_data(input_string):
     # Define the regex pattern to match the {cyc: x-y} format with positive integers
@@ -378,69 +337,147 @@ def extract_data(input_string):
         else:
             return input_string, None  # Return None if the pattern is not found
 
-df2 = pd.read_csv('data/MAP_momomers_library_new.csv')
-map_to_helm_dict = df2.set_index('MAP_denotion')['Symbol'].sort_index(ascending=False).to_dict()
-
 def monomer_list_from_linear_seq(linear_seq):
-    tokens = []
-    i = 0
-    while i < len(linear_seq):
-        matched = False
-        for key in map_to_helm_dict.keys():
-            if linear_seq[i:].startswith(key):
-                token = map_to_helm_dict[key]
-                tokens.append(token)
-                i += len(key)
-                matched = True
-                break
-        if not matched:
-            # Add unmatched character as-is (can help preserve syntax like {, }, :, etc.)
-            tokens.append(linear_seq[i])
-            i += 1
-    return tokens
+    # Unmatched characters are kept as-is (can help preserve syntax like {, }, :, etc.)
+    return get_library().tokenizer.tokenize(linear_seq)
 
-def get_smi_from_map(map):
-    linear_seq, linker = extract_data(map)
-    # print(linear_seq)
-    # print(linker)
-    monomer_list = monomer_list_from_linear_seq(linear_seq)
-    if linker:
-        # print(linker)
-        linker_list = linker.split('-')
-        cyclic_linker = ''
-        if linker_list[0][-1] == '1' :
-            cyclic_linker += f'{1}:R1-'
-        elif linker_list[0][-1] == 'N' :
-            cyclic_linker += f'{1}:R1-'
-        else:
-            cyclic_linker += f'{int(linker_list[0][-1])}:R3-'
-        end_conn = linker_list[1].replace('}','')
-        if end_conn == 'C':
-            cyclic_linker += f'{len(monomer_list)}:R2'
-        elif  end_conn == str(len(monomer_list)):
-            cyclic_linker += f'{len(monomer_list)}:R2'
-        else:
-            cyclic_linker += f'{int(end_conn)}:R3'
+class ParsedMap(namedtuple('ParsedMap', ['sequence', 'linker', 'spans', 'helm_parts'])):
+    """
+    A MAP string split and tokenized once, shared by the SMILES builder and the HELM writer
+    sequence: the MAP text without its cyclic link, {nt:} modifications first (as extract_data)
+    linker: e.g. '{cyc:N-C}', or None
+    spans: tokenizer.scan(sequence)
+    helm_parts: (linker, sequence) as the HELM writer reads them, or None when they are the same
+    """
+    __slots__ = ()
+
+    @property
+    def monomer_list(self):
+        """Symbols in sequence order; unmatched characters are kept as-is"""
+        return [self.sequence[start] if symbol is None else symbol for start, end, symbol in self.spans]
+
+    @property
+    def terminal_modifications(self):
+        """MAP denotations of the {nt:} and {ct:} modifications, e.g. ['{nt:ACE}', '{ct:PPD}']"""
+        return [self.sequence[start:end] for start, end, symbol in self.spans
+                if symbol is not None and self.sequence.startswith(('{nt:', '{ct:'), start)]
+
+def parse_map(map_str):
+    """
+    Input: '{nt:ACE}L{d}LPY{ct:PPD}{cyc:N-C}'
+    Output: ParsedMap('{nt:ACE}L{d}LPY{ct:PPD}', '{cyc:N-C}', spans, None)
+    """
+    linear_seq, linker = extract_data(map_str)
+    helm_parts = None
+    # The HELM writer removes {nt:} before looking for {cyc:} and does not strip whitespace,
+    # which only matters when both are present or the link left whitespace at an end
+    if ('{nt:' in map_str and '{cyc' in map_str) or (linker and len(linear_seq) + len(linker) != len(map_str)):
+        helm_parts = helm_linker_and_sequence(map_str)
+        if helm_parts == (linker, linear_seq):
+            helm_parts = None
+    return ParsedMap(linear_seq, linker, get_library().tokenizer.scan(linear_seq), helm_parts)
+
+def validated_parts(parsed):
+    """(monomer_list, cyclic_link) of a ParsedMap, or None after recording why it is invalid"""
+    # Reject bad tokens and links before any RDKit work
+    try:
+        with profiler.stage('validate'):
+            return validate_parts(parsed.sequence, parsed.linker, parsed.spans)
+    except MapValidationError as e:
+        profiler.failure(e)
+        return None
+
+def smiles_from_parsed(parsed):
+    parts = validated_parts(parsed)
+    if parts is None:
+        return None
+    monomer_list, cyclic_linker = parts
+    if cyclic_linker:
         try:
-            # print(cyclic_linker)
             smi = cyclize_linpep_from_map(monomer_list, cyclic_linker)
             return smi
         except Exception as e:
+            profiler.failure(e)
             return None
     else:
         try:
             smi = linpep_from_map(monomer_list)
             return smi
         except Exception as e:
+            profiler.failure(e)
             return None
-          
+
+def mol_from_parsed(parsed):
+    """Sanitized RDKit Mol of a ParsedMap, or None"""
+    parts = validated_parts(parsed)
+    if parts is None:
+        return None
+    try:
+        mol = build_peptide_mol(*parts)
+        # Ring info, aromaticity etc. as a Mol read from the SMILES would have
+        with profiler.stage('sanitize'):
+            Chem.SanitizeMol(mol)
+        return mol
+    except Exception as e:
+        profiler.failure(e)
+        return None
+
+@cached_conversion('map_to_smiles')
+def get_smi_from_map(map):
+    with profiler.track('map_to_smiles', map):
+        with profiler.stage('parse'):
+            parsed = parse_map(map)
+        return smiles_from_parsed(parsed)
+
+def get_mol_from_map(map):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C}'
+    Output: the assembled RDKit Mol, or None; no SMILES is written or parsed
+    MolToSmiles of the Mol is what get_smi_from_map returns.
+    """
+    with profiler.track('map_to_mol', map):
+        with profiler.stage('parse'):
+            parsed = parse_map(map)
+        return mol_from_parsed(parsed)
+
+@cached_conversion('map_to_formula')
+def map_to_formula(map_str):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C}'
+    Output: 'C38H60N6O7\\t712.933\\t712.4523', formula, average MW and monoisotopic mass,
+            summed from per-monomer increments without building the molecule; None where
+            get_smi_from_map gives None
+    """
+    with profiler.track('map_to_formula', map_str):
+        with profiler.stage('parse'):
+            parsed = parse_map(map_str)
+        parts = validated_parts(parsed)
+        if parts is None:
+            return None
+        with profiler.stage('formula'):
+            formula = peptide_formula(*parts)
+        return None if formula is None else format_formula(formula)
+
 # code under MIT licence Copyright (c) 2021-2024 Charles Xu and others, ends here 
 
 ##HELM to MAP
-# Load the MAP monomer library
-df2 = pd.read_csv('data/MAP_momomers_library_new.csv')
-map_to_helm_dict = df2.set_index('MAP_denotion')['Symbol'].sort_index(ascending=False).to_dict()
+nterm_regex = re.compile(r'\{nt:[^}]+\}')
+cterm_regex = re.compile(r'\{ct:[^}]+\}')
+cyc_regex = re.compile(r'\{cyc:\s*([N]|\d+)-([C]|\d+)\}')
 
+def move_terminal_modifications(map_format):
+    """
+    Move {nt:...} and {ct:...} modifications to the end of a MAP string
+    Input: '{nt:ACE}AL{ct:PPD}G'
+    Output: 'ALG{nt:ACE}{ct:PPD}'
+    """
+    nterm_modifications = nterm_regex.findall(map_format)
+    final_output = nterm_regex.sub('', map_format)
+    cterm_modifications = cterm_regex.findall(final_output)
+    final_output = cterm_regex.sub('', final_output)
+    return final_output + ''.join(nterm_modifications) + ''.join(cterm_modifications)
+
+@cached_conversion('helm_to_map')
 def helm_to_map(helm):
     try:
         start = helm.index('{') + 1
@@ -448,11 +485,9 @@ def helm_to_map(helm):
         helm_sequence = helm[start:end]
         elements = [elem.strip('[]') for elem in helm_sequence.split('.')]
         num_elements = len(elements)
-        map_format = ''
-        for element in elements:
-            map_notation = df2.loc[df2['Symbol'] == element, 'MAP_denotion']
-            if not map_notation.empty:
-                map_format += map_notation.values[0]
+        # Unknown symbols are dropped
+        helm_to_map_dict = get_library().helm_to_map_dict
+        map_format = ''.join([helm_to_map_dict.get(element, '') for element in elements])
         dollar_split = helm.split('$')
         if len(dollar_split) > 2:
             last_part = dollar_split[1]
@@ -465,90 +500,205 @@ def helm_to_map(helm):
                     cyc_string = f'N-C'
                 else:
                     cyc_string = f'{first_part}-{second_part}'
-                final_output = f'{map_format}'
-                nterm_pattern = r'\{nt:[^}]+\}'
-                cterm_pattern = r'\{ct:[^}]+\}'
-                nterm_modifications = re.findall(nterm_pattern, final_output)
-                final_output = re.sub(nterm_pattern, '', final_output)
-                cterm_modifications = re.findall(cterm_pattern, final_output)
-                final_output = re.sub(cterm_pattern, '', final_output)
-                final_output += ''.join(nterm_modifications) + ''.join(cterm_modifications)
+                final_output = move_terminal_modifications(map_format)
                 return f'{final_output}{{cyc:{cyc_string}}}'
             else:
-                final_output = f'{map_format}'
-                nterm_pattern = r'\{nt:[^}]+\}'
-                cterm_pattern = r'\{ct:[^}]+\}'
-                nterm_modifications = re.findall(nterm_pattern, final_output)
-                final_output = re.sub(nterm_pattern, '', final_output)
-                cterm_modifications = re.findall(cterm_pattern, final_output)
-                final_output = re.sub(cterm_pattern, '', final_output)
-                final_output += ''.join(nterm_modifications) + ''.join(cterm_modifications)
-                return final_output
+                return move_terminal_modifications(map_format)
     except Exception as e:
         return f"ERROR: {e}"
     return ''
 
+@cached_conversion('helm_to_formula')
+def helm_to_formula(helm):
+    """
+    Input: 'PEPTIDE1{[dL].[dL].L.[dL].P.Y}$PEPTIDE1,PEPTIDE1,1:R1-6:R2$$$'
+    Output: as map_to_formula, read from the HELM symbols and connection directly;
+            None for an unknown symbol or a connection that cannot be made
+    """
+    with profiler.track('helm_to_formula', helm):
+        try:
+            start = helm.index('{') + 1
+            end = helm.index('}')
+        except ValueError:
+            return None
+        monomer_list = [elem.strip('[]') for elem in helm[start:end].split('.')]
+        dollar_split = helm.split('$')
+        cyclic_link = dollar_split[1].split(',')[-1] if len(dollar_split) > 2 and dollar_split[1] else None
+        with profiler.stage('formula'):
+            formula = peptide_formula(monomer_list, cyclic_link)
+        return None if formula is None else format_formula(formula)
+
+# A MAP denotation whose braces are all closed, so a pattern never spans two denotations
+balanced_denotation_regex = re.compile(r'(?:[^{}]|\{[^{}]*\})*')
+
+def split_helm(helm):
+    """
+    The parts of a HELM string helm_to_map reads, without converting anything
+    Input: 'PEPTIDE1{[Abu].[Sar].[meL]}$PEPTIDE1,PEPTIDE1,1:R1-3:R2$$$'
+    Output: (body, first, second), e.g. ('[Abu].[Sar].[meL]', '1', '3'); first and second are
+            None without a connection block and '' for an empty one. None when helm_to_map
+            would fail or the cyclization positions are not plain numbers.
+    """
+    start = helm.find('{')
+    end = helm.find('}')
+    if start < 0 or end < 0:
+        return None
+    body = helm[start + 1:end]
+    dollar_split = helm.split('$', 2)
+    if len(dollar_split) < 3:
+        return body, None, None
+    if not dollar_split[1]:
+        return body, '', ''
+    first, colon, rest = dollar_split[1].rpartition(',')[2].partition(':')
+    second = rest.partition(':')[0].split('-', 2)
+    if not colon or len(second) < 2:
+        return None
+    second = second[1]
+    if not (first.isascii() and first.isdigit() and len(first) <= 18
+            and second.isascii() and second.isdigit() and len(second) <= 18):
+        return None
+    return body, first, second
+
+def helm_to_map_series(helms):
+    """
+    helm_to_map over a pandas Series of HELM strings, for large in-memory tables
+    Output: DataFrame with the input index and columns 'helm' and 'map', where 'map' is exactly
+    what helm_to_map returns for each row.
+    Each distinct HELM string is parsed once, each distinct symbol is looked up once and the
+    MAP strings are assembled with numpy; rows of unusual shape are passed to helm_to_map.
+    """
+    import numpy as np
+    import pandas as pd
+
+    helms = pd.Series(helms)
+    values = helms.to_numpy(dtype=object)
+    result = np.empty(len(values), dtype=object)
+    is_str = np.fromiter((type(helm) is str for helm in values), dtype=bool, count=len(values))
+    codes, distinct = pd.factorize(values[is_str])
+    converted = np.empty(len(distinct), dtype=object)
+
+    parts = [split_helm(helm) for helm in distinct]
+    rows = np.flatnonzero(np.fromiter((part is not None for part in parts), dtype=bool, count=len(parts)))
+    body, first, second = zip(*[parts[row] for row in rows]) if len(rows) else ((), (), ())
+
+    # One lookup per distinct symbol. Symbols never contain '.', so all bodies are split in one
+    # go; per-row strings are then summed with reduceat. Only rows with a terminal modification
+    # (or a denotation with unbalanced braces) need move_terminal_modifications.
+    num_elements = np.fromiter((seq.count('.') + 1 for seq in body), dtype=np.int64, count=len(body))
+    offsets = np.cumsum(num_elements) - num_elements
+    symbol_codes, symbols = pd.factorize(np.array('.'.join(body).split('.') if body else [], dtype=object))
+    helm_to_map_dict = get_library().helm_to_map_dict
+    denotations = [helm_to_map_dict.get(symbol.strip('[]'), '') for symbol in symbols]
+    movable = np.array([('{nt:' in denotation or '{ct:' in denotation
+                         or not balanced_denotation_regex.fullmatch(denotation)) for denotation in denotations],
+                       dtype=np.int64)
+    if len(rows):
+        moved = np.add.reduceat(np.array(denotations, dtype=object)[symbol_codes], offsets)
+        for idx in np.flatnonzero(np.add.reduceat(movable[symbol_codes], offsets)):
+            moved[idx] = move_terminal_modifications(moved[idx])
+    else:
+        moved = np.empty(0, dtype=object)
+
+    # first is None without a connection block, '' for an empty one
+    first = np.array(first, dtype=object)
+    second = np.array(second, dtype=object)
+    linear = first == ''
+    cyclic = np.array([bool(part) for part in first], dtype=bool)
+    converted[rows] = ''
+    converted[rows[linear]] = moved[linear]
+    first, second = first[cyclic], second[cyclic]
+    head_to_tail = (first.astype(np.int64) == 1) & (second.astype(np.int64) == num_elements[cyclic])
+    cyc_string = np.where(head_to_tail, 'N-C', first + '-' + second)
+    converted[rows[cyclic]] = moved[cyclic] + '{cyc:' + cyc_string + '}'
+
+    # Everything else goes through helm_to_map, including rows it reports an error for
+    slow = np.setdiff1d(np.arange(len(distinct)), rows)
+    converted[slow] = [helm_to_map(helm) for helm in distinct[slow]]
+    result[is_str] = converted[codes]
+    others = np.flatnonzero(~is_str)
+    result[others] = [helm_to_map(helm) for helm in values[others]]
+    return pd.DataFrame({'helm': helms, 'map': result}, index=helms.index)
 
 ##MAP to HELM sequence
 def process_HELM_seq(helm_seq, ID):
     if '{' in helm_seq:
         start = helm_seq.index('{')
         end = helm_seq.index('}')
-        cyc_seq = helm_seq[start:end]
-        seq_len = len(helm_seq[end+1:].split('.'))
-        cyc_list = cyc_seq.split('-')
-        start_pos = cyc_list[0][-1]
-        end_pos = cyc_list[1]
-       
-        if start_pos == 'N' and end_pos == 'C':
-            return f'PEPTIDE{ID}{{{helm_seq[end+1:]}}}$PEPTIDE{ID},PEPTIDE{ID},1:R1-{seq_len}:R2$$$'
-        elif start_pos != '1' and end_pos == str(seq_len):
-            return f'PEPTIDE{ID}{{{helm_seq[end+1:]}}}$PEPTIDE{ID},PEPTIDE{ID},{start_pos}:R3-{seq_len}:R2$$$'
-        elif start_pos == '1' and end_pos != str(seq_len):
-            return f'PEPTIDE{ID}{{{helm_seq[end+1:]}}}$PEPTIDE{ID},PEPTIDE{ID},1:R1-{end_pos}:R3$$$'
-        else:
-            return f'PEPTIDE{ID}{{{helm_seq[end+1:]}}}$PEPTIDE{ID},PEPTIDE{ID},{start_pos}:R3-{end_pos}:R3$$$'
+        return cyclic_HELM(helm_seq[start:end], helm_seq[end+1:], ID)
     else:
         return f'PEPTIDE{ID}{{{helm_seq}}}$$$$'
 
-def convert_map_to_helm_sequence(map_str, ID):
-    nterm_pattern = r'\{nt:[^}]+\}'
-    cyc_pattern = r'\{cyc:\s*([N]|\d+)-([C]|\d+)\}'
-    string = ''
-    nterm_modifications = re.findall(nterm_pattern, map_str)
-    map_str = re.sub(nterm_pattern, '', map_str)
-    cyc_string = re.search(cyc_pattern, map_str)
-    # print("cyc_string",cyc_string[0])
-    map_str = re.sub(cyc_pattern, '', map_str)
-    if cyc_string:
-        string += ''.join(cyc_string[0]) + ''.join(nterm_modifications) + map_str
+def cyclic_HELM(cyc_seq, helm_seq, ID):
+    """
+    Input: '{cyc:N-C', 'A.L.P.Y', '1', the link part of the HELM sequence up to its '}' and the monomers
+    Output: 'PEPTIDE1{A.L.P.Y}$PEPTIDE1,PEPTIDE1,1:R1-4:R2$$$'
+    """
+    seq_len = len(helm_seq.split('.'))
+    cyc_list = cyc_seq.split('-')
+    start_pos = cyc_list[0][-1]
+    end_pos = cyc_list[1]
+
+    if start_pos == 'N' and end_pos == 'C':
+        return f'PEPTIDE{ID}{{{helm_seq}}}$PEPTIDE{ID},PEPTIDE{ID},1:R1-{seq_len}:R2$$$'
+    elif start_pos != '1' and end_pos == str(seq_len):
+        return f'PEPTIDE{ID}{{{helm_seq}}}$PEPTIDE{ID},PEPTIDE{ID},{start_pos}:R3-{seq_len}:R2$$$'
+    elif start_pos == '1' and end_pos != str(seq_len):
+        return f'PEPTIDE{ID}{{{helm_seq}}}$PEPTIDE{ID},PEPTIDE{ID},1:R1-{end_pos}:R3$$$'
     else:
-        string += ''.join(nterm_modifications) + map_str
+        return f'PEPTIDE{ID}{{{helm_seq}}}$PEPTIDE{ID},PEPTIDE{ID},{start_pos}:R3-{end_pos}:R3$$$'
+
+def helm_linker_and_sequence(map_str):
+    """(cyclic link, sequence) of a MAP string in the order the HELM writer reads them"""
+    nterm_modifications = nterm_regex.findall(map_str)
+    map_str = nterm_regex.sub('', map_str)
+    cyc_string = cyc_regex.search(map_str)
+    map_str = cyc_regex.sub('', map_str)
+    return (cyc_string[0] if cyc_string else None), ''.join(nterm_modifications) + map_str
 
+def helm_monomers(map_str, spans):
+    """
+    Input: 'L{d}LP', its tokenizer spans
+    Output: '[dL].L.P.', unmatched characters kept as-is
+    """
     tokens = []
-    i = 0
-    while i < len(string):
-        matched = False
-        for key in map_to_helm_dict.keys():
-            if string[i:].startswith(key):
-                if string[i-4:i] == 'cyc:':
-                    val = map_to_helm_dict[key]
-                    token = f'[{val}]' if len(val) > 1 else f'{val}'
-                    tokens.append(token)
-                    i += len(key)
-                    matched = True
-                    break
-                else:
-                    val = map_to_helm_dict[key]
-                    token = f'[{val}].' if len(val) > 1 else f'{val}.'
-                    tokens.append(token)
-                    i += len(key)
-                    matched = True
-                    break
-
-        if not matched:
-            tokens.append(string[i])
-            i += 1
-    helm_seq = ''.join(tokens).rstrip('.')
-    # print(helm_seq)
-    return helm_seq
+    for i, end, val in spans:
+        if val is None:
+            tokens.append(map_str[i])
+        elif i >= 4 and map_str[i-4:i] == 'cyc:':
+            tokens.append(f'[{val}]' if len(val) > 1 else f'{val}')
+        else:
+            tokens.append(f'[{val}].' if len(val) > 1 else f'{val}.')
+    return ''.join(tokens)
+
+def helm_sequence_from_parsed(parsed):
+    """
+    Input: ParsedMap of 'L{d}LPY{cyc:N-C}'
+    Output: ('{cyc:N-C}[dL].L.P.Y', 9), the HELM sequence and the length of its link part
+    """
+    tokenizer = get_library().tokenizer
+    if parsed.helm_parts is None:
+        linker, sequence, spans = parsed.linker, parsed.sequence, parsed.spans
+    else:
+        linker, sequence = parsed.helm_parts
+        spans = tokenizer.scan(sequence)
+    # No MAP denotation starts inside a {cyc:} link, so both parts tokenize on their own
+    prefix = helm_monomers(linker, tokenizer.scan(linker)) if linker else ''
+    return (prefix + helm_monomers(sequence, spans)).rstrip('.'), len(prefix)
+
+def helm_from_parsed(parsed, ID):
+    helm_seq, linker_len = helm_sequence_from_parsed(parsed)
+    if not linker_len:
+        return process_HELM_seq(helm_seq, ID)
+    # The link part ends at its only '}'
+    return cyclic_HELM(helm_seq[:linker_len - 1], helm_seq[linker_len:], ID)
+
+def convert_map_to_helm_sequence(map_str, ID):
+    return helm_sequence_from_parsed(parse_map(map_str))[0]
+
+@cached_conversion('map_to_helm')
+def map_to_helm(map_str, ID):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C}', '2'
+    Output: 'PEPTIDE2{[dL].[dL].L.[dL].P.Y}$PEPTIDE2,PEPTIDE2,1:R1-6:R2$$$'
+    """
+    return helm_from_parsed(parse_map(map_str), ID)
@@ -0,0 +1,117 @@
+##MAP validation
+# Cheap structural checks on a MAP sequence, run before any RDKit work:
+# every token must be a known monomer, the {cyc:} link must point inside the
+# peptide, and every R group a link needs must exist on its monomer.
+# Failures carry a short reason code for bulk pre-screening.
+
+from monomer_library import get_library
+
+# Reason codes
+EMPTY = 'empty'
+SINGLE_MONOMER = 'single_monomer'
+UNKNOWN_TOKEN = 'unknown_token'
+BAD_CYCLIC_LINK = 'bad_cyclic_link'
+INDEX_OUT_OF_RANGE = 'index_out_of_range'
+MISSING_R_GROUP = 'missing_r_group'
+R_GROUP_IN_USE = 'r_group_in_use'
+
+
+class MapValidationError(ValueError):
+    def __init__(self, code, message):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+        self.message = message
+
+
+def cyclic_link_from_linker(linker, length):
+    """
+    Input: '{cyc:4-C}' as returned by extract_data, and the number of monomers, e.g. 10
+    Output: '4:R3-10:R2'
+    Only the last digit of the start position is read, as the converter always has.
+    """
+    linker_list = linker.split('-')
+    cyclic_link = ''
+    if linker_list[0][-1] == '1' :
+        cyclic_link += f'{1}:R1-'
+    elif linker_list[0][-1] == 'N' :
+        cyclic_link += f'{1}:R1-'
+    else:
+        cyclic_link += f'{int(linker_list[0][-1])}:R3-'
+    end_conn = linker_list[1].replace('}','')
+    if end_conn == 'C':
+        cyclic_link += f'{length}:R2'
+    elif  end_conn == str(length):
+        cyclic_link += f'{length}:R2'
+    else:
+        cyclic_link += f'{int(end_conn)}:R3'
+    return cyclic_link
+
+
+def validate_parts(linear_seq, linker, spans=None):
+    """
+    Validate a MAP sequence split by extract_data
+    spans: tokenizer.scan(linear_seq) when already done
+    Output: (monomer_list, cyclic_link), cyclic_link is None for a linear peptide
+    Raises MapValidationError
+    """
+    library = get_library()
+    monomer_list = []
+    for start, end, symbol in library.tokenizer.scan(linear_seq) if spans is None else spans:
+        if symbol is None:
+            if linear_seq.startswith('{cyc:', start):
+                raise MapValidationError(BAD_CYCLIC_LINK, f"Malformed cyclic link in '{linear_seq}'")
+            raise MapValidationError(UNKNOWN_TOKEN, f"Unknown token '{linear_seq[start:end]}' at position {start}")
+        monomer_list.append(symbol)
+    if not monomer_list:
+        raise MapValidationError(EMPTY, 'No monomers')
+    # A lone monomer has no link to build the peptide from; formula.peptide_formula agrees
+    if len(monomer_list) == 1 and not linker:
+        raise MapValidationError(SINGLE_MONOMER, f"Only one monomer ({monomer_list[0]}) and no cyclic link")
+
+    # Backbone R2->R1 links, then the cyclic link
+    links = [((idx, 'R2'), (idx + 1, 'R1')) for idx in range(len(monomer_list) - 1)]
+    cyclic_link = None
+    if linker:
+        cyclic_link = cyclic_link_from_linker(linker, len(monomer_list))
+        ends = []
+        for node in cyclic_link.split('-'):
+            idx, r_group = node.split(':')
+            if not 1 <= int(idx) <= len(monomer_list):
+                raise MapValidationError(INDEX_OUT_OF_RANGE,
+                                         f'Cyclic link {cyclic_link} is outside the {len(monomer_list)} monomers')
+            ends.append((int(idx) - 1, r_group))
+        links.append(tuple(ends))
+
+    used = set()
+    for link in links:
+        for idx, r_group in link:
+            symbol = monomer_list[idx]
+            if r_group not in library.monomers2link_r_groups_dict.get(symbol, ()):
+                raise MapValidationError(MISSING_R_GROUP, f'Monomer {idx + 1} ({symbol}) has no {r_group}')
+            if (idx, r_group) in used:
+                raise MapValidationError(R_GROUP_IN_USE, f'{r_group} of monomer {idx + 1} ({symbol}) is linked twice')
+            used.add((idx, r_group))
+    return monomer_list, cyclic_link
+
+
+def validate_map(map_str):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C}'
+    Output: (monomer_list, cyclic_link); raises MapValidationError
+    """
+    from utils import parse_map
+
+    parsed = parse_map(map_str)
+    return validate_parts(parsed.sequence, parsed.linker, parsed.spans)
+
+
+def check_map(map_str):
+    """
+    Input: 'L{d}L{d}LL{d}PY{cyc:N-C}'
+    Output: 'ok', or '<reason code>: <message>'
+    """
+    try:
+        validate_map(map_str)
+    except MapValidationError as e:
+        return str(e)
+    return 'ok'